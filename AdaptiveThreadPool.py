@@ -0,0 +1,220 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Sample - Self-Tuning Thread Pool
+#
+# A fixed number of threads is either too few (latency-bound endpoints - the threads
+# spend nearly all of their time waiting, so more of them would get more done) or too
+# many (throttled endpoints - extra threads just queue up at the server and make every
+# request slower). This pool measures completed calls per second and their latency as
+# it runs and grows or shrinks the number of worker threads within [minWorkers,
+# maxWorkers] to settle near the knee of the throughput curve:
+#
+# - additive increase: while throughput keeps improving, add step workers
+# - back off: when throughput drops after an increase, the knee has been passed, so
+#   remove step workers
+# - multiplicative decrease: when calls fail or latency climbs past latencyFactor times
+#   the best latency seen, the upstream is overloaded - halve the workers
+###########################################################################################
+
+import queue
+import threading
+import time
+
+# sentinel telling a worker thread there is no more work
+STOP = object()
+
+
+class AdaptiveThreadPool:
+    # onWorkerStart / onWorkerExit are called on each worker thread as it starts and
+    # finishes (e.g., to size and close the thread's session) - a worker whose start
+    # raises is counted in failedStarts and replaced by the controller. failed is called
+    # with what the function returned and says whether the call failed - for functions
+    # that return their failures instead of raising them (a raised exception always counts)
+    def __init__(self, function, minWorkers=2, maxWorkers=64, initialWorkers=None,
+                 interval=0.25, step=2, latencyFactor=2.0, tolerance=0.05,
+                 onWorkerStart=None, onWorkerExit=None, failed=None):
+        if not 1 <= minWorkers <= maxWorkers:
+            raise ValueError(f"need 1 <= minWorkers <= maxWorkers, got {minWorkers} and {maxWorkers}")
+        self.function = function
+        self.minWorkers = minWorkers
+        self.maxWorkers = maxWorkers
+        self.interval = interval
+        self.step = step
+        self.latencyFactor = latencyFactor
+        self.tolerance = tolerance
+        self.onWorkerStart = onWorkerStart
+        self.onWorkerExit = onWorkerExit
+        self.failed = failed
+
+        # bounded so a long (or endless) iterable of items is not read ahead of the workers
+        self.queue = queue.Queue(maxsize=maxWorkers * 2)
+        self.lock = threading.Lock()
+        self.target = min(max(initialWorkers or minWorkers, minWorkers), maxWorkers)
+        self.workers = 0
+        self.peakWorkers = 0
+        self.threads = []
+
+        # measurements for the current interval, reset by the controller
+        self.completed = 0
+        self.errors = 0
+        self.latencyTotal = 0.0
+        self.totalCompleted = 0
+        self.totalErrors = 0
+        self.failedStarts = 0
+
+        self.bestLatency = None
+        self.lastThroughput = 0.0
+        self.lastMove = 0
+        self.history = []
+
+    ###########################################################################################
+    # Function to start workers until there are as many as the current target
+    ###########################################################################################
+    def spawnWorkers(self):
+        with self.lock:
+            while self.workers < self.target:
+                self.workers += 1
+                self.peakWorkers = max(self.peakWorkers, self.workers)
+                thread = threading.Thread(target=self.work, daemon=True,
+                                          name=f"AdaptiveWorker-{len(self.threads)}")
+                self.threads.append(thread)
+                thread.start()
+
+    ###########################################################################################
+    # Worker thread - run the function on items from the queue, retiring whenever there are
+    # more workers than the controller's target
+    ###########################################################################################
+    def work(self):
+        try:
+            try:
+                if self.onWorkerStart is not None:
+                    self.onWorkerStart()
+            except Exception:
+                # the thread never takes an item - the controller starts another in its place
+                with self.lock:
+                    self.workers -= 1
+                    self.failedStarts += 1
+                return
+            while True:
+                with self.lock:
+                    if self.workers > self.target:
+                        self.workers -= 1
+                        return
+                item = self.queue.get()
+                if item is STOP:
+                    with self.lock:
+                        self.workers -= 1
+                    self.queue.task_done()
+                    return
+
+                startTime = time.perf_counter()
+                try:
+                    result = self.function(item)
+                    failed = self.failed is not None and self.failed(result)
+                except Exception:
+                    failed = True
+                latency = time.perf_counter() - startTime
+                with self.lock:
+                    if failed:
+                        self.errors += 1
+                    else:
+                        self.completed += 1
+                        self.latencyTotal += latency
+                self.queue.task_done()
+        finally:
+            if self.onWorkerExit is not None:
+                self.onWorkerExit()
+
+    ###########################################################################################
+    # Controller thread - every interval, compare this interval's throughput and latency
+    # with the last and move the target number of workers
+    ###########################################################################################
+    def control(self, finished):
+        lastTime = time.perf_counter()
+        while not finished.wait(self.interval):
+            now = time.perf_counter()
+            with self.lock:
+                completed, errors, latencyTotal = self.completed, self.errors, self.latencyTotal
+                self.completed = self.errors = 0
+                self.latencyTotal = 0.0
+                self.totalCompleted += completed
+                self.totalErrors += errors
+            if not completed and not errors:
+                # calls take longer than the interval - wait for some to finish, replacing
+                # any workers that failed to start in the meantime
+                self.spawnWorkers()
+                continue
+            throughput = completed / (now - lastTime)
+            latency = latencyTotal / completed if completed else None
+            lastTime = now
+            self.adjust(throughput, latency, errors)
+            self.history.append({"time": now, "workers": self.target, "throughput": throughput,
+                                 "latency": latency, "errors": errors})
+            self.spawnWorkers()
+
+        with self.lock:
+            self.totalCompleted += self.completed
+            self.totalErrors += self.errors
+
+    def adjust(self, throughput, latency, errors):
+        if latency is not None:
+            # let the best latency drift up slowly so an upstream that has become slower
+            # for good is not treated as overloaded forever
+            if self.bestLatency is None or latency < self.bestLatency:
+                self.bestLatency = latency
+            else:
+                self.bestLatency *= 1.01
+
+        if errors or (latency is not None and latency > self.bestLatency * self.latencyFactor):
+            target = max(self.minWorkers, self.target // 2)
+            move = 0
+        elif throughput > self.lastThroughput * (1 + self.tolerance):
+            target = min(self.maxWorkers, self.target + self.step)
+            move = 1
+        elif throughput < self.lastThroughput * (1 - self.tolerance) and self.lastMove > 0:
+            target = max(self.minWorkers, self.target - self.step)
+            move = -1
+        else:
+            target = self.target
+            move = 0
+
+        with self.lock:
+            self.target = target
+        self.lastMove = move
+        self.lastThroughput = throughput
+
+    ###########################################################################################
+    # Function to call the function on every item (any iterable) and wait for them all to
+    # finish. Exceptions raised by the function are counted as errors, not re-raised
+    ###########################################################################################
+    def map(self, items):
+        finished = threading.Event()
+        self.spawnWorkers()
+        controller = threading.Thread(target=self.control, args=(finished,), daemon=True,
+                                      name="AdaptiveController")
+        controller.start()
+        try:
+            for item in items:
+                self.queue.put(item)
+            self.queue.join()
+        finally:
+            finished.set()
+            controller.join()
+            with self.lock:
+                remaining = self.workers
+            for _ in range(remaining):
+                self.queue.put(STOP)
+            for thread in self.threads:
+                thread.join()
+
+    ###########################################################################################
+    # Function to return where the pool settled along with its adjustment history
+    ###########################################################################################
+    def statistics(self):
+        return {
+            "finalWorkers": self.target,
+            "peakWorkers": self.peakWorkers,
+            "completed": self.totalCompleted,
+            "errors": self.totalErrors,
+            "failedStarts": self.failedStarts,
+            "history": self.history,
+        }
@@ -63,13 +63,31 @@
 #     different processors. Numer of Processors: Many
 ###########################################################################################
 
+import argparse
+import asyncio
+import contextlib
+import functools
+import math
 import multiprocessing
 import requests
+import sys
+import threading
 import time
 
+import ConcurrencyProfiler
+import DownloadReporter
+import ParallelExecutors
+import RequestPolicy
+import RequestTiming
+import SumOfSquaresKernels
 import URLDownloadAsyncIO
+import URLDownloadCache
+import URLDownloadHybrid
 import URLDownloadMultiThreaded
+import URLDownloadPipeline
+import URLDownloadStreaming
 import URLDownloadSynchronous
+import WarmWorkerPool
 
 session = None
 def setGlobalSession():
@@ -77,24 +95,144 @@ def setGlobalSession():
     if not session:
         session = requests.Session()
 
-def downloadSite(url):
-    with session.get(url) as response:
-        name = multiprocessing.current_process().name
-        print(f"{name}:Read {len(response.content)} from {url}")
+# stream=True reads the body in chunks into the process's reusable buffer (and hands it
+# to a sink from sinkFactory, which must be picklable) instead of buffering it in memory.
+# With a cache, each process reopens the cache directory. With instrument=True the
+# request is timed in phases (see RequestTiming). A RequestPolicy becomes one per process,
+# so each process keeps its own breakers and latencies.
+# Returns a DownloadReporter.DownloadResult (with its latency) - its source and timing row let the parent
+# count the cache and record the timings, which the worker can't do for it
+def downloadSite(url, stream=False, sinkFactory=None, cache=None, instrument=False, policy=None):
+    startTime = time.perf_counter()
+    if policy is None:
+        try:
+            result = fetchSite(url, session, stream, sinkFactory, cache, instrument)
+        except (requests.RequestException, OSError) as error:
+            result = DownloadReporter.DownloadResult(url, error=error)
+    else:
+        fetch = functools.partial(fetchSite, url, stream=stream, sinkFactory=sinkFactory,
+                                  cache=cache, instrument=instrument)
+        # two attempts writing to sinks for the same url would clash - only hedge without one
+        result = policy.call(url, fetch, session, hedge=sinkFactory is None)
+    result.latency = time.perf_counter() - startTime
+    return result
+
+# one attempt at downloading a web page - raises when the request fails
+def fetchSite(url, session, stream=False, sinkFactory=None, cache=None, instrument=False,
+              timeout=None, deadline=None):
+    if cache is not None:
+        result = cache.fetch(url, session, sinkFactory, timeout, deadline)
+        return DownloadReporter.DownloadResult(url, result.status, result.size, result.source)
+    if instrument:
+        RequestTiming.instrumentSession(session)
+    # with a deadline the body is streamed either way, so it can be given up between chunks
+    with session.get(url, stream=stream or deadline is not None, timeout=timeout) as response:
+        size = URLDownloadStreaming.readBody(response, url, stream, sinkFactory, deadline)
+        timing = getattr(response, "timing", None) if instrument else None
+        row = RequestTiming.finishRow(timing) if timing is not None else None
+        return DownloadReporter.DownloadResult(url, response.status_code, size, timing=row)
+
+###########################################################################################
+# The worker processes are started once and reused by every download and sum of squares
+# job (and every menu selection) - see WarmWorkerPool. Recycling a worker after this many
+# tasks keeps a slow leak in one of them from growing forever. forkserver starts workers
+# from a clean server process that has already imported this module (and with it
+# requests, aiohttp, ...) instead of forking whatever state the parent has built up
+###########################################################################################
+MAX_TASKS_PER_CHILD = 10_000
+POOL_CONTEXT = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else None
+
+workerPool = None
+def getWorkerPool():
+    global workerPool
+    if workerPool is None:
+        workerPool = WarmWorkerPool.WarmWorkerPool(initializer=setGlobalSession,
+                                                   maxtasksperchild=MAX_TASKS_PER_CHILD,
+                                                   context=POOL_CONTEXT,
+                                                   preload=["Concurrency"])
+    return workerPool
+
+###########################################################################################
+# The pipeline engine processes bodies on a concurrent.futures.ProcessPoolExecutor so the
+# event loop can await its results - it is started once and kept warm the same way (see
+# ParallelExecutors)
+###########################################################################################
+def getProcessExecutor():
+    return ParallelExecutors.getExecutor(ParallelExecutors.PROCESSES, POOL_CONTEXT)
+
+###########################################################################################
+# Function to stop every worker process - profiled workers write their profiles as they
+# exit (see ConcurrencyProfiler), and the next job starts fresh ones
+###########################################################################################
+def shutdownWorkers():
+    if workerPool is not None:
+        workerPool.shutdown()
+    ParallelExecutors.shutdown()
+
+# urls handed to the worker processes at a time, and how many of those batches may be
+# waiting for a process or on their way back before no more urls are read
+CHUNK_SIZE = 16
+CHUNKS_IN_FLIGHT_PER_PROCESS = 4
+
+###########################################################################################
+# Generator to pass the sites on to the pool no faster than window allows - each url
+# takes a slot that is given back as its result is read, and stop ends it early. The
+# urls passed on are counted in counts["sent"] when counts is given
+###########################################################################################
+def throttle(sites, window, stop, counts=None):
+    for url in sites:
+        window.acquire()
+        if stop.is_set():
+            return
+        if counts is not None:
+            counts["sent"] += 1
+        yield url
 
 ###########################################################################################
-# Function to download a series of web pages using multiprocessing
+# Function to download a series of web pages using multiprocessing, handing each result
+# to the optional DownloadReporter.Reporter in the parent
+#
+# sites can be any iterable, including a generator - the pool reads its input as fast as
+# it can, so it is fed through throttle() to keep a fixed number of urls in flight and
+# memory flat however many urls there are
 ###########################################################################################
-def downloadAllSites(sites):
-    # Create a number of separate Python interpreter processes and have each one 
-    # run downloadSiteMultiProcessing on some of the items in sites
+def downloadAllSites(sites, stream=False, sinkFactory=None, cache=None, recorder=None,
+                     reporter=None, policy=None):
+    # Use a number of separate Python interpreter processes and have each one 
+    # run downloadSite on some of the items in sites
     # Pool matches the # of CPUs on the computer with the # of processes it creates
-    # #of processes in an optional parameter
     # having too many processes can slow things down as setting them up and breaking them
-    # down is an expensive operation
-    # create a session for each process not each time 
-    with multiprocessing.Pool(initializer=setGlobalSession) as pool:
-        pool.map(downloadSite, sites)
+    # down is an expensive operation - so the pool is kept warm between calls
+    # a session is created for each process not each time 
+    download = functools.partial(downloadSite, stream=stream, sinkFactory=sinkFactory,
+                                 cache=cache, instrument=recorder is not None, policy=policy)
+    workers = getWorkerPool()
+    windowSize = workers.processes * CHUNKS_IN_FLIGHT_PER_PROCESS * CHUNK_SIZE
+    window = threading.Semaphore(windowSize)
+    stop = threading.Event()
+    counts = {"sent": 0, "received": 0}
+    results = workers.getPool().imap_unordered(ConcurrencyProfiler.wrapTask(download),
+                                               throttle(sites, window, stop, counts), CHUNK_SIZE)
+    # with a ConcurrencyProfiler running, the urls in flight are recorded as the run goes
+    watch = ConcurrencyProfiler.watch("multiprocessing",
+                                      depth=lambda: counts["sent"] - counts["received"])
+    try:
+        # the workers counted into their own copies of the cache and timed the requests in
+        # their own processes - record both here for the caller
+        with watch:
+            for result in results:
+                window.release()
+                counts["received"] += 1
+                if result.source is not None:
+                    cache.count(result.source)
+                if result.timing is not None:
+                    recorder.add(*result.timing)
+                if reporter is not None:
+                    reporter.report(result)
+    finally:
+        # don't leave the pool's feeder thread waiting for a slot if we stopped early
+        stop.set()
+        window.release(windowSize)
 
 
 ###########################################################################################
@@ -115,55 +253,163 @@ def testConcurrency4IOBoundMultiProcessing():
             "https://www.jython.org",
             "http://olympus.realpython.org/dice",
         ] * 80
-        startTime = time.time()
-        downloadAllSites(sites)
+        with DownloadReporter.Reporter(DownloadReporter.PROGRESS) as reporter:
+            startTime = time.time()
+            downloadAllSites(sites, reporter=reporter)
         duration = time.time() - startTime
         print(f"\nPERFORMANCE: Downloaded {len(sites)} in {duration} seconds")
 
 
 ###########################################################################################
-# Function to return sum of squares
+# Function to download a series of web pages with one asyncio event loop per process on
+# the warm worker pool - see URLDownloadHybrid
+###########################################################################################
+def downloadAllSitesHybrid(sites, concurrency=URLDownloadAsyncIO.DEFAULT_CONCURRENCY,
+                           limitPerHost=URLDownloadAsyncIO.DEFAULT_LIMIT_PER_HOST, cache=None,
+                           recorder=None, reporter=None, policy=None):
+    workers = getWorkerPool()
+    return URLDownloadHybrid.downloadAllSites(sites, workers.getPool(), workers.processes,
+                                              concurrency, limitPerHost, cache, recorder,
+                                              reporter, policy)
+
+
+###########################################################################################
+# Function to download a series of web pages with asyncio and process every body on the
+# warm process executor while the next ones download - see URLDownloadPipeline
+###########################################################################################
+def downloadAllSitesPipeline(sites, processor=URLDownloadPipeline.digestBody,
+                             concurrency=URLDownloadAsyncIO.DEFAULT_CONCURRENCY,
+                             limitPerHost=URLDownloadAsyncIO.DEFAULT_LIMIT_PER_HOST,
+                             recorder=None, reporter=None, overlap=True):
+    executor = getProcessExecutor()
+    return asyncio.run(URLDownloadPipeline.downloadAllSites(
+        sites, executor, processor=processor, concurrency=concurrency, limitPerHost=limitPerHost,
+        recorder=recorder, reporter=reporter, overlap=overlap))
+
+
+###########################################################################################
+# Function to return sum of squares (the pure Python reference kernel)
 ###########################################################################################
 def sumOfSquares(number):
-    return sum(i * i for i in range(number))
+    return SumOfSquaresKernels.sumOfSquaresPython(number)
 
 ###########################################################################################
 # Function to accept a list of numbers and then compute the sum of square for each item 
 # in the list
+#
+# Param: backend - name of the SumOfSquaresKernels kernel to use (python, numpy or
+#                  closedform)
+#        verify - when True, check every result against the pure Python reference
+###########################################################################################
+def findSums(numbers, backend="python", verify=False):
+    kernel = SumOfSquaresKernels.getKernel(backend)
+    results = [kernel(number) for number in numbers]
+    if verify:
+        SumOfSquaresKernels.verifyResults(backend, numbers, results)
+    return results
+
+# each core gets about this many sub-ranges so that a core finishing early can pick up
+# another one instead of sitting idle while the others finish theirs
+SUBRANGES_PER_PROCESS = 4
+
+###########################################################################################
+# Function to split the numbers' ranges into sub-ranges of roughly equal work - the
+# total work divided into `parts` pieces. Returns (backend, index, start, stop) tasks,
+# index being the position in numbers each sub-range's partial sum belongs to
 ###########################################################################################
-def findSums(numbers):
-    for number in numbers:
-        sumOfSquares(number)
+def splitRanges(numbers, parts, backend="python"):
+    totalWork = sum(max(number, 0) for number in numbers)
+    subRangeSize = max(1, math.ceil(totalWork / max(parts, 1)))
+    tasks = []
+    for index, number in enumerate(numbers):
+        for start in range(0, number, subRangeSize):
+            tasks.append((backend, index, start, min(start + subRangeSize, number)))
+    return tasks
 
 ###########################################################################################
 # Same logic but with the addition of using multiprocessing
+#
+# Param: split - when True, every number's range is split into sub-ranges sized to the
+#                number of processes and the partial sums are added back up per number,
+#                so all of the cores stay busy however many numbers there are (and however
+#                uneven they are). When False, each number is one task as before
 ###########################################################################################
-def findSumsMultiProcessing(numbers):
-    with multiprocessing.Pool() as pool:
-        pool.map(sumOfSquares, numbers)
+def findSumsMultiProcessing(numbers, backend="python", verify=False, split=True):
+    workers = getWorkerPool()
+    pool = workers.getPool()
+    if split:
+        processes = workers.processes
+        tasks = splitRanges(numbers, processes * SUBRANGES_PER_PROCESS, backend)
+        results = [0] * len(numbers)
+        # sub-ranges are handed out a few at a time in whatever order the processes
+        # ask for them and the partial sums are added up as they come back
+        chunkSize = max(1, len(tasks) // (processes * SUBRANGES_PER_PROCESS))
+        subRange = ConcurrencyProfiler.wrapTask(SumOfSquaresKernels.sumOfSquaresSubRange)
+        for index, partialSum in pool.imap_unordered(subRange, tasks, chunkSize):
+            results[index] += partialSum
+    else:
+        results = pool.map(ConcurrencyProfiler.wrapTask(SumOfSquaresKernels.getKernel(backend)),
+                           numbers)
+    if verify:
+        SumOfSquaresKernels.verifyResults(backend, numbers, results)
+    return results
+
+###########################################################################################
+# Same logic on the cheapest parallel executor the interpreter supports - threads on a
+# free-threaded build, subinterpreters on 3.14, otherwise processes (see
+# ParallelExecutors). The sub-ranges are split the same way as findSumsMultiProcessing
+#
+# Param: kind - ParallelExecutors kind to use instead of the detected one. NumPy can't
+#               be imported in a subinterpreter, so the numpy kernel runs on processes
+#               instead of interpreters
+#
+# Returns the results and the kind of executor that computed them
+###########################################################################################
+def findSumsParallel(numbers, backend="python", verify=False, kind=None):
+    kind = kind or ParallelExecutors.detectKind()
+    if(kind == ParallelExecutors.INTERPRETERS and backend == "numpy"):
+        kind = ParallelExecutors.PROCESSES
+    SumOfSquaresKernels.checkKernel(backend)
+    executor = ParallelExecutors.getExecutor(kind, POOL_CONTEXT)
+    parts = ParallelExecutors.WORKERS * SUBRANGES_PER_PROCESS
+    tasks = splitRanges(numbers, parts, backend)
+    results = [0] * len(numbers)
+    # chunksize only batches tasks for processes - the other kinds share memory and
+    # ignore it
+    chunkSize = max(1, len(tasks) // parts)
+    subRange = SumOfSquaresKernels.sumOfSquaresSubRange
+    if(kind == ParallelExecutors.PROCESSES):
+        # threads are profiled with the parent - only processes need to profile themselves
+        subRange = ConcurrencyProfiler.wrapTask(subRange)
+    for index, partialSum in executor.map(subRange, tasks, chunksize=chunkSize):
+        results[index] += partialSum
+    if verify:
+        SumOfSquaresKernels.verifyResults(backend, numbers, results)
+    return results, kind
 
 ###########################################################################################
 # Function to test a lenthy CPU intensive operation to determine performance 
 #
 # Param: multiProcessing - when False, operation done synchronously on one processor
 #                          when True, operation done via multiProcessing
+#        backend - name of the sum of squares kernel (python, numpy or closedform)
 #
 # Upside of multiprocessing is that it is faster and easier to set up in this case
 # Communication between processes also adds complexity that a sychronous, non-current
 # program would not need to deal with 
 ###########################################################################################
-def testConcurrency5CPUBoundSynchronous(multiProcessing=False):
+def testConcurrency5CPUBoundSynchronous(multiProcessing=False, backend="python"):
     if __name__ == "__main__":
         numbers = [3_000_000 + x for x in range(20)]
 
         startTime = time.time()
         if(multiProcessing == True):
-            findSumsMultiProcessing(numbers)
+            findSumsMultiProcessing(numbers, backend)
         else:
-            findSums(numbers)
+            findSums(numbers, backend)
 
         duration = time.time() - startTime
-        print(f"\nPERFORMANCE: Duration {duration} seconds")
+        print(f"\nPERFORMANCE: Duration {duration} seconds ({backend} kernel)")
 
 ###########################################################################################
 # Function to test a lenthy CPU intensive operation done via MultiProcessing to determine 
@@ -175,8 +421,194 @@ def testConcurrency5CPUBoundSynchronous(multiProcessing=False):
 # All this overhead in addition to the lenthy operation causes it to be slower than the 
 # synchronous, single threaded solution!
 ###########################################################################################
-def testConcurrency6CPUBoundSMultiProcessing():
-    testConcurrency5CPUBoundSynchronous(True)
+def testConcurrency6CPUBoundSMultiProcessing(backend="python"):
+    testConcurrency5CPUBoundSynchronous(True, backend)
+
+###########################################################################################
+# Function to test the same CPU intensive operation on the cheapest parallel executor
+# the running interpreter supports
+#
+# Upside over mode 6 is that threads (free-threaded build) and subinterpreters start
+# faster and use less memory than whole processes, and tasks don't cross a pipe
+#
+# Downside is that it needs a recent interpreter - on a build with the GIL and without
+# subinterpreters it falls back to processes and performs like mode 6
+###########################################################################################
+def testConcurrency9CPUBoundParallel(backend="python"):
+    if __name__ == "__main__":
+        numbers = [3_000_000 + x for x in range(20)]
+
+        startTime = time.time()
+        _, kind = findSumsParallel(numbers, backend)
+        duration = time.time() - startTime
+        print(f"\nPERFORMANCE: Duration {duration} seconds ({backend} kernel on {kind}, "
+              f"{ParallelExecutors.startupSeconds[kind]:.3f} seconds to start them)")
+
+
+###########################################################################################
+# Batch entry point - run one of the download engines over a list of urls of any length,
+# e.g. from a scheduler:
+#
+#   python Concurrency.py urls.txt --strategy asyncio --report jsonl --report-file out.jsonl
+#   producer | python Concurrency.py --strategy multithreaded --workers 20
+#
+# The urls are read lazily, one per line, and every engine takes only a bounded number of
+# them ahead of the downloads (see each downloadAllSites), so memory stays flat however
+# long the input is. Results go to a DownloadReporter.Reporter and the PERFORMANCE summary
+# goes to stderr so it never mixes with JSON lines on stdout
+###########################################################################################
+
+# the engines the batch entry point can run
+BATCH_STRATEGIES = ("synchronous", "multithreaded", "asyncio", "multiprocessing", "hybrid",
+                    "pipeline")
+
+# the sites the interactive samples download
+SAMPLE_SITES = [
+    "https://www.jython.org",
+    "http://olympus.realpython.org/dice",
+] * 80
+
+###########################################################################################
+# Function to open the file of urls, or stdin when path is "-" - as a context manager
+# that leaves stdin open at the end
+###########################################################################################
+def openInput(path="-"):
+    return contextlib.nullcontext(sys.stdin) if path == "-" else open(path)
+
+###########################################################################################
+# Generator to read urls one per line from an open file (see openInput). Blank lines and
+# # comments are skipped. The asyncio engines read it on a thread, so a slow producer on
+# the other end of stdin never blocks their event loop
+###########################################################################################
+def readUrls(lines):
+    for line in lines:
+        url = line.strip()
+        if url and not url.startswith("#"):
+            yield url
+
+###########################################################################################
+# Function to download sites (any iterable) with the named engine, handing every result
+# to reporter
+#
+# Param: workers - threads for multithreaded, concurrent downloads per event loop for
+#                  asyncio and hybrid (the process engines use one process per CPU)
+#        limitPerHost - connections open to one host per event loop (asyncio, hybrid)
+#        stream - read bodies in chunks (synchronous, multithreaded, multiprocessing)
+#        cache - optional URLDownloadCache.ResponseCache
+#        policy - optional RequestPolicy.RequestPolicy (deadline, hedging, circuit breakers)
+#        processor - function the pipeline runs on every body (URLDownloadPipeline.PROCESSORS)
+###########################################################################################
+def downloadBatch(sites, strategy="asyncio", reporter=None, workers=None,
+                  limitPerHost=URLDownloadAsyncIO.DEFAULT_LIMIT_PER_HOST, stream=False,
+                  cache=None, policy=None, processor=URLDownloadPipeline.digestBody):
+    if(strategy == "synchronous"):
+        URLDownloadSynchronous.downloadAllSites(sites, stream=stream, cache=cache,
+                                                reporter=reporter, policy=policy)
+    elif(strategy == "multithreaded"):
+        URLDownloadMultiThreaded.downloadAllSites(sites, stream=stream, cache=cache,
+                                                  reporter=reporter, workers=workers or 5,
+                                                  policy=policy)
+    elif(strategy == "asyncio"):
+        asyncio.run(URLDownloadAsyncIO.downloadAllSitesBounded(
+            sites, concurrency=workers or URLDownloadAsyncIO.DEFAULT_CONCURRENCY,
+            limitPerHost=limitPerHost, cache=cache, reporter=reporter, policy=policy))
+    elif(strategy == "multiprocessing"):
+        downloadAllSites(sites, stream=stream, cache=cache, reporter=reporter, policy=policy)
+    elif(strategy == "hybrid"):
+        downloadAllSitesHybrid(sites, concurrency=workers or URLDownloadAsyncIO.DEFAULT_CONCURRENCY,
+                               limitPerHost=limitPerHost, cache=cache, reporter=reporter,
+                               policy=policy)
+    elif(strategy == "pipeline"):
+        # bodies go to the processes through shared memory, not through a cache or policy
+        if(cache is not None or policy is not None):
+            raise ValueError("the pipeline strategy does not support a cache or request policy")
+        downloadAllSitesPipeline(sites, processor, concurrency=workers or URLDownloadAsyncIO.DEFAULT_CONCURRENCY,
+                                 limitPerHost=limitPerHost, reporter=reporter)
+    else:
+        raise ValueError(f"unknown strategy {strategy!r} - choose from {', '.join(BATCH_STRATEGIES)}")
+
+###########################################################################################
+# Function to run downloadBatch with a reporter and print the PERFORMANCE summary to
+# summaryFile. Returns the reporter's summary
+###########################################################################################
+def runBatch(sites, strategy="asyncio", report=DownloadReporter.PROGRESS, reportFile=None,
+             interval=1.0, summaryFile=None, **options):
+    with DownloadReporter.Reporter(report, reportFile, interval) as reporter:
+        startTime = time.time()
+        downloadBatch(sites, strategy, reporter, **options)
+    duration = time.time() - startTime
+    summary = reporter.summary()
+    print(f"\nPERFORMANCE: Downloaded {summary['downloaded']} sites ({summary['bytes']} bytes, "
+          f"{summary['errors']} errors) in {duration} seconds ({strategy})",
+          file=summaryFile or sys.stdout)
+    if options.get("policy") is not None:
+        counts = summary["policy"]
+        print(f"POLICY: {counts['hedges']} hedges ({counts['hedgeWins']} won), "
+              f"{counts['trips']} circuit breaker trips, {counts['rejected']} urls rejected",
+              file=summaryFile or sys.stdout)
+    return summary
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Download a list of urls with one of the concurrency approaches "
+                                                 "(run without arguments for the interactive samples)")
+    parser.add_argument("input", nargs="?", default="-",
+                        help="file of urls, one per line ('-' or omitted for stdin)")
+    parser.add_argument("--strategy", choices=BATCH_STRATEGIES, default="asyncio",
+                        help="download engine (default: asyncio)")
+    parser.add_argument("--workers", type=int,
+                        help="threads (multithreaded) or concurrent downloads per event loop (asyncio, hybrid, pipeline)")
+    parser.add_argument("--limit-per-host", type=int, default=URLDownloadAsyncIO.DEFAULT_LIMIT_PER_HOST,
+                        help="connections open to one host per event loop (asyncio, hybrid, pipeline)")
+    parser.add_argument("--stream", action="store_true",
+                        help="read bodies in chunks (synchronous, multithreaded, multiprocessing)")
+    parser.add_argument("--cache", metavar="DIRECTORY", help="serve repeated urls from an on-disk cache")
+    parser.add_argument("--cache-ttl", type=float, default=0.0,
+                        help="seconds a cached response is served without revalidating")
+    parser.add_argument("--report", choices=DownloadReporter.MODES, default=DownloadReporter.PROGRESS,
+                        help="how the results are reported (default: progress)")
+    parser.add_argument("--report-file", metavar="PATH",
+                        help="file the results are appended to (default: stdout)")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between progress lines")
+    parser.add_argument("--processor", choices=list(URLDownloadPipeline.PROCESSORS), default="sha256",
+                        help="processing the pipeline runs on every body (default: sha256)")
+    parser.add_argument("--profile", metavar="DIRECTORY",
+                        help="profile the run (every thread and worker process) into DIRECTORY")
+    parser.add_argument("--profile-mode", choices=ConcurrencyProfiler.MODES, default=ConcurrencyProfiler.SAMPLE,
+                        help="sample the stacks or run cProfile (default: sample)")
+    RequestPolicy.addArguments(parser)
+    args = parser.parse_args(argv)
+    # bodies go to the pipeline's processes through shared memory, not through a cache or
+    # policy - say so here rather than with a traceback once the run has started
+    if(args.strategy == "pipeline" and (args.cache or RequestPolicy.settingsFromArguments(args))):
+        parser.error("--strategy pipeline does not support --cache or the request policy options")
+    return args
+
+def main(argv=None):
+    args = parseArguments(argv)
+    # open the input first so that a bad path fails before any pool has started
+    with openInput(args.input) as lines:
+        cache = None
+        if args.cache:
+            cache = URLDownloadCache.ResponseCache(args.cache, defaultTtl=args.cache_ttl)
+        settings = RequestPolicy.settingsFromArguments(args)
+        policy = RequestPolicy.RequestPolicy(**settings) if settings is not None else None
+        profiler = None
+        if args.profile:
+            profiler = ConcurrencyProfiler.Profiler(args.profile, args.profile_mode)
+        with profiler or contextlib.nullcontext():
+            try:
+                summary = runBatch(readUrls(lines), args.strategy, args.report, args.report_file,
+                                   args.interval, summaryFile=sys.stderr, workers=args.workers,
+                                   limitPerHost=args.limit_per_host, stream=args.stream, cache=cache,
+                                   policy=policy, processor=URLDownloadPipeline.PROCESSORS[args.processor])
+            finally:
+                if profiler is not None:
+                    shutdownWorkers()
+    if profiler is not None:
+        print(f"\nPROFILE: written to {args.profile} (profile.prof, profile.collapsed)\n", file=sys.stderr)
+        print(ConcurrencyProfiler.formatSummary(ConcurrencyProfiler.mergeProfiles(args.profile)),
+              file=sys.stderr)
+    return summary
 
 
 ###########################################################################################
@@ -190,9 +622,12 @@ def getProcessSelection():
         3.) I/O Bound Problem: Download Multiple URLs - AsyncIO Approach
         4.) I/O Bound Problem: Download Multiple URLs - Multiprocess Approach
         5.) CPU Bound Problem: CPU Intensive Operation- Synchronous Approach
-        6.) CPU Bound Problem: CPU Intensive Operation- Multiprocess Approach""")
-        processSelection = input("\nPlease make a selection from the above choices. Please Enter a Value Between 1 and 6 (or q to quit): ")
-        if(processSelection not in ['1', '2', '3', '4', '5', '6']):
+        6.) CPU Bound Problem: CPU Intensive Operation- Multiprocess Approach
+        7.) I/O Bound Problem: Download Multiple URLs - Hybrid Multiprocess + AsyncIO Approach
+        8.) I/O + CPU Bound Problem: Download and Process Multiple URLs - Pipelined AsyncIO + Multiprocess Approach
+        9.) CPU Bound Problem: CPU Intensive Operation- Free-Threaded / Subinterpreter Approach (Processes Where Unsupported)""")
+        processSelection = input("\nPlease make a selection from the above choices. Please Enter a Value Between 1 and 9 (or q to quit): ")
+        if(processSelection not in ['1', '2', '3', '4', '5', '6', '7', '8', '9']):
             if(processSelection != 'q'):
                 print("\nINVALID SELECTION!\n")
             continue
@@ -205,8 +640,11 @@ def intro():
     print("""    This application is intended to diagnose a variety of approaches to solving 2 types of problems that can potentially
     be solved efficiently through the implementation of a type of concurrency solution. These types of problems are those that are
     I/O Bound and those that are CPU Bound. 4 Approaches are suggested for a particular I/O bound problem involving downloading of
-    URLs: Synchronous (Single Threaded), MultiThreaded, AsyncIO and MultiProcess. 2 Approaches are suggested for a particular CPU
-    Bound problem involving lengthy operations of summing squares: Synchronous (Single Threaded) and MultiProcess. MultiThreaded
+    URLs: Synchronous (Single Threaded), MultiThreaded, AsyncIO and MultiProcess, plus a Hybrid of MultiProcess and AsyncIO
+    (one event loop per process) for when a single event loop runs out of CPU, and a Pipeline that processes each downloaded
+    page in another process while the next pages download. 2 Approaches are suggested for a particular CPU
+    Bound problem involving lengthy operations of summing squares: Synchronous (Single Threaded) and MultiProcess, plus a third that
+    runs on threads or subinterpreters when the interpreter can run those in parallel (free-threaded builds, Python 3.14). MultiThreaded
     and AsyncIO are discouraged for these types of problems as their performance is worse than Synchronous (Single Threaded) since 
     there is extra CPU overhead to managing threads and tasks in addition to the intense CPU operations involved in the problem. \n
     Note that MultiProcess approach is also discouraged for I/O Bound problems as the overhead of managing processes adds to 
@@ -214,26 +652,43 @@ def intro():
 
     Enter q at any time to quit. Cheers!\n""")
 
+# the download menu selections and the batch strategy each one runs
+MENU_STRATEGIES = {
+    '1': "synchronous",
+    '2': "multithreaded",
+    '3': "asyncio",
+    '4': "multiprocessing",
+    '7': "hybrid",
+    '8': "pipeline",
+}
+
 ###########################################################################################
-# Main
+# Interactive menu - the download selections run the sample sites through runBatch
 ###########################################################################################
-if(__name__ == "__main__"):
+def runMenu():
     intro()
     processSelection = ''
     while(processSelection != 'q'):
         processSelection = getProcessSelection()
         if(processSelection != 'q'):
-            if(processSelection == '1'):
-                URLDownloadSynchronous.testConcurrency1IOBoundSynchronous()
-            elif(processSelection == '2'):
-                URLDownloadMultiThreaded.testConcurrency2IOBoundThreaded()
-            elif(processSelection == '3'):
-                URLDownloadAsyncIO.testConcurrency3IOBoundAsyncIO()
-            elif(processSelection == '4'):
-                testConcurrency4IOBoundMultiProcessing()
+            if(processSelection in MENU_STRATEGIES):
+                runBatch(SAMPLE_SITES, MENU_STRATEGIES[processSelection])
             elif(processSelection == '5'):
                 print("Performing lengthy CPU operation...")
                 testConcurrency5CPUBoundSynchronous()
+            elif(processSelection == '9'):
+                print("Performing lengthy CPU operation...")
+                testConcurrency9CPUBoundParallel()
             else:
                 print("Performing lengthy CPU operation...")
                 testConcurrency6CPUBoundSMultiProcessing()
+
+###########################################################################################
+# Main - with arguments, or with urls piped in, run the batch entry point; otherwise
+# show the interactive menu
+###########################################################################################
+if(__name__ == "__main__"):
+    if(len(sys.argv) > 1 or not sys.stdin.isatty()):
+        main()
+    else:
+        runMenu()
@@ -0,0 +1,577 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Reproducible Download Benchmark
+#
+# The testConcurrency* functions time themselves against real websites, so the numbers
+# depend on the network and can't be compared from one run to the next. This harness
+# starts a local stand-in HTTP server with configurable latency, body size, jitter and
+# error rate, runs every downloadAllSites implementation against it with warmup and
+# repeated trials, and reports throughput plus the p50/p95/p99 latency of the requests as
+# a table and as JSON
+#
+# Example: python ConcurrencyBenchmark.py --sites 160 --trials 5 --json results.json
+#
+# With --timings every request is also timed in phases (dns, connect, tls, time to first
+# byte, transfer - see RequestTiming) and the per-request percentiles are reported for
+# each strategy and host
+#
+# Every strategy hands its results to a DownloadReporter.Reporter. By default it only
+# counts them (errors and status codes appear in the JSON report); --report progress or
+# print writes to the console from the reporter's background thread and --report jsonl
+# with --report-file writes one line per url
+#
+# With --cpu it benchmarks the CPU bound sum of squares sample instead: every kernel
+# (python, numpy, closedform) run synchronously and with multiprocessing, so the gain
+# from a better algorithm or vectorization shows next to the gain from more processes
+#
+# Example: python ConcurrencyBenchmark.py --cpu --trials 3
+#
+# With --pipeline it benchmarks the download + process pipeline (URLDownloadPipeline):
+# every body is run through the sum of squares processor (--rounds times), first with
+# the stages one after the other and then overlapped, so the pipelined time can be
+# compared with the sum and the maximum of the two stages
+#
+# Example: python ConcurrencyBenchmark.py --pipeline --rounds 5 --trials 3
+#
+# With --profile DIRECTORY every strategy's (or CPU mode's) timed trials are profiled
+# into DIRECTORY/<strategy> - every thread and worker process, see ConcurrencyProfiler -
+# and the hottest frames, worker utilization, event loop lag and queue depths are
+# reported after the table. Profiling slows the runs down, so compare timings without it
+###########################################################################################
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import sys
+import tempfile
+import time
+
+import Concurrency
+import ConcurrencyProfiler
+import DownloadReporter
+import LocalTestServer
+import ParallelExecutors
+import PerformanceStats
+import RequestPolicy
+import RequestTiming
+import SumOfSquaresKernels
+import URLDownloadAsyncIO
+import URLDownloadCache
+import URLDownloadMultiThreaded
+import URLDownloadPipeline
+import URLDownloadSynchronous
+import WarmWorkerPool
+
+
+def runAsyncIO(sites, **options):
+    asyncio.run(URLDownloadAsyncIO.downloadAllSites(sites, **options))
+
+
+def runAsyncIOBounded(sites, **options):
+    asyncio.run(URLDownloadAsyncIO.downloadAllSitesBounded(sites, **options))
+
+
+# the downloadAllSites implementations, keyed by the name used on the command line
+STRATEGIES = {
+    "synchronous": URLDownloadSynchronous.downloadAllSites,
+    "multithreaded": URLDownloadMultiThreaded.downloadAllSites,
+    "multithreaded-adaptive": functools.partial(URLDownloadMultiThreaded.downloadAllSites,
+                                                adaptive=True),
+    "asyncio": runAsyncIO,
+    "asyncio-bounded": runAsyncIOBounded,
+    "multiprocessing": Concurrency.downloadAllSites,
+    "hybrid": Concurrency.downloadAllSitesHybrid,
+}
+
+# strategies that run on Concurrency's warm worker pool
+POOL_STRATEGIES = {"multiprocessing", "hybrid"}
+
+# strategies built on requests, which accept stream=True to read bodies in chunks
+STREAMING_STRATEGIES = {"synchronous", "multithreaded", "multithreaded-adaptive",
+                        "multiprocessing"}
+
+
+###########################################################################################
+# Context manager to silence the per-URL console output while a trial runs. The file
+# descriptor is redirected (not just sys.stdout) so worker processes are silenced too
+###########################################################################################
+@contextlib.contextmanager
+def suppressOutput(enabled=True):
+    if not enabled:
+        yield
+        return
+    sys.stdout.flush()
+    savedFd = os.dup(1)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(savedFd, 1)
+            os.close(savedFd)
+
+
+###########################################################################################
+# Function to build the list of sites - a handful of distinct paths on the stand-in
+# server repeated to the requested total, mirroring the [...] * 80 lists in the samples
+###########################################################################################
+def buildSites(server, siteCount, distinctSites=2):
+    base = LocalTestServer.baseUrl(server)
+    return [f"{base}/site/{i % distinctSites}" for i in range(siteCount)]
+
+
+###########################################################################################
+# Function to run function warmup times untimed and then trials times, returning the
+# duration of each timed trial. afterWarmup is called between the two (e.g., to discard
+# measurements taken during the warmup)
+###########################################################################################
+def timeTrials(function, trials, warmup, afterWarmup=None):
+    for _ in range(warmup):
+        function()
+    if afterWarmup is not None:
+        afterWarmup()
+
+    durations = []
+    for _ in range(trials):
+        startTime = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - startTime)
+    return durations
+
+
+###########################################################################################
+# Context manager to profile what runs inside it into directory (nothing when directory
+# is None). The worker processes are shut down at the end so they write their profiles
+###########################################################################################
+@contextlib.contextmanager
+def profiling(directory, mode=ConcurrencyProfiler.SAMPLE):
+    if directory is None:
+        yield
+        return
+    with ConcurrencyProfiler.Profiler(directory, mode):
+        try:
+            yield
+        finally:
+            Concurrency.shutdownWorkers()
+
+
+###########################################################################################
+# Function to benchmark one strategy - run the warmup passes untimed, then time each
+# trial. Throughput comes from the per-trial durations and the latency percentiles from
+# every request made in the timed trials (each downloadSite call's result.latency)
+#
+# Param: cacheTtl - when not None, every strategy gets its own empty response cache
+#                   (with this default TTL) that lives across its warmup and trials
+#        timings - record the phase timings of every request in the timed trials
+#        report / reportFile - DownloadReporter mode and output for the results
+#        policy - RequestPolicy.RequestPolicy settings (deadline, hedging, breakers); each
+#                 strategy gets a fresh policy so none inherits another's latencies
+#        profile / profileMode - directory and ConcurrencyProfiler mode to profile the
+#                                timed trials with
+###########################################################################################
+def benchmarkStrategy(name, sites, trials=5, warmup=1, quiet=True, stream=False,
+                      cacheTtl=None, timings=False, report=DownloadReporter.QUIET,
+                      reportFile=None, policy=None, profile=None,
+                      profileMode=ConcurrencyProfiler.SAMPLE):
+    options = {}
+    if stream and name in STREAMING_STRATEGIES:
+        options["stream"] = True
+    cacheDirectory = None
+    if cacheTtl is not None:
+        cacheDirectory = tempfile.TemporaryDirectory(prefix="benchmark-cache-")
+        options["cache"] = URLDownloadCache.ResponseCache(cacheDirectory.name, defaultTtl=cacheTtl)
+    recorder = None
+    if timings:
+        recorder = options["recorder"] = RequestTiming.TimingRecorder(name)
+    reporter = options["reporter"] = DownloadReporter.Reporter(report, reportFile, label=name,
+                                                               keepLatencies=True)
+    if policy is not None:
+        options["policy"] = RequestPolicy.RequestPolicy(**policy)
+    downloadAllSites = functools.partial(STRATEGIES[name], **options)
+    with suppressOutput(quiet):
+        # start the worker processes before the first trial so their start-up is reported
+        # on its own (and is 0 when an earlier strategy already warmed them up). Workers
+        # inherit the fork server's output, so it has to start inside suppressOutput too
+        poolWarmup = Concurrency.getWorkerPool().start() if name in POOL_STRATEGIES else None
+        profileDirectory = os.path.join(profile, name) if profile is not None else None
+
+        # the warmup's requests are not part of the timed trials
+        def afterWarmup():
+            reporter.resetLatencies()
+            if recorder is not None:
+                recorder.clear()
+
+        try:
+            with profiling(profileDirectory, profileMode):
+                durations = timeTrials(functools.partial(downloadAllSites, sites), trials, warmup,
+                                       afterWarmup)
+        finally:
+            reporter.close()
+            if policy is not None:
+                options["policy"].close()
+
+    cacheStats = None
+    if cacheDirectory is not None:
+        cacheStats = options["cache"].statistics()
+        cacheDirectory.cleanup()
+
+    downloads = reporter.summary()
+    latency = downloads.pop("latency")
+    throughputs = [len(sites) / duration for duration in durations]
+    return {
+        "strategy": name,
+        "sites": len(sites),
+        "trials": trials,
+        "warmup": warmup,
+        "stream": stream and name in STREAMING_STRATEGIES,
+        "durations": durations,
+        "throughput": {
+            "mean": sum(throughputs) / len(throughputs),
+            "best": max(throughputs),
+            "worst": min(throughputs),
+        },
+        "latency": latency,
+        "cache": cacheStats,
+        "poolWarmup": poolWarmup,
+        "timings": recorder.toDict() if recorder is not None else None,
+        "downloads": downloads,
+        "policy": policy,
+        "profile": ConcurrencyProfiler.mergeProfiles(profileDirectory) if profileDirectory else None,
+    }
+
+
+###########################################################################################
+# Function to run the whole suite - start the server, benchmark each strategy in turn
+# and return a JSON serializable report including the server configuration
+###########################################################################################
+def runBenchmark(strategies=None, siteCount=160, distinctSites=2, trials=5, warmup=1,
+                 quiet=True, stream=False, cacheTtl=None, timings=False,
+                 report=DownloadReporter.QUIET, reportFile=None, policy=None, profile=None,
+                 profileMode=ConcurrencyProfiler.SAMPLE, **serverConfig):
+    strategies = strategies or list(STRATEGIES)
+    server = LocalTestServer.startServer(**serverConfig)
+    try:
+        sites = buildSites(server, siteCount, distinctSites)
+        results = [benchmarkStrategy(name, sites, trials, warmup, quiet, stream, cacheTtl,
+                                     timings, report, reportFile, policy, profile, profileMode)
+                   for name in strategies]
+        serverStats = {"requests": server.requestCount, "errors": server.errorCount,
+                       "notModified": server.notModifiedCount}
+        config = dict(server.config)
+    finally:
+        LocalTestServer.stopServer(server)
+
+    return {"server": config, "serverStats": serverStats, "results": results}
+
+
+###########################################################################################
+# Function to format the report as a console table. Latency columns are the per-request
+# latencies in milliseconds
+###########################################################################################
+def formatReport(report):
+    header = ["strategy", "sites", "trials", "req/s mean", "req/s best",
+              "p50 ms", "p95 ms", "p99 ms"]
+    rows = []
+    for result in report["results"]:
+        latency = result["latency"]
+        rows.append([
+            result["strategy"], result["sites"], result["trials"],
+            f"{result['throughput']['mean']:.1f}", f"{result['throughput']['best']:.1f}",
+            f"{latency['p50'] * 1000:.1f}", f"{latency['p95'] * 1000:.1f}",
+            f"{latency['p99'] * 1000:.1f}",
+        ])
+        if result["cache"] is not None:
+            rows[-1].append(f"{result['cache']['hitRatio']:.2f}")
+        if result["policy"] is not None:
+            counts = result["downloads"]["policy"]
+            rows[-1] += [counts["hedges"], counts["trips"], result["downloads"]["errors"]]
+    if any(result["cache"] is not None for result in report["results"]):
+        header.append("cache hits")
+    if any(result["policy"] is not None for result in report["results"]):
+        header += ["hedges", "trips", "errors"]
+    poolWarmup = sum(result["poolWarmup"] or 0.0 for result in report["results"])
+    return (PerformanceStats.formatTable(header, rows) + formatPoolWarmup(poolWarmup)
+            + formatTimings(report) + formatProfiles(report))
+
+
+###########################################################################################
+# Function to format the per-request phase timings of every strategy that recorded them
+# (cache hits are served without a request, so they are not timed)
+###########################################################################################
+def formatTimings(report):
+    summaries = [(result["strategy"], result["timings"]["summary"])
+                 for result in report["results"] if result["timings"]]
+    if not summaries:
+        return ""
+    return "\n\nper-request timings:\n" + RequestTiming.formatSummaries(summaries)
+
+
+# the ways of running the CPU bound sample, keyed by the name used in the report
+CPU_MODES = {
+    "synchronous": Concurrency.findSums,
+    "multiprocessing": Concurrency.findSumsMultiProcessing,
+    "multiprocessing-per-number": functools.partial(Concurrency.findSumsMultiProcessing,
+                                                    split=False),
+}
+
+
+def findSumsOn(kind, numbers, backend):
+    return Concurrency.findSumsParallel(numbers, backend, kind=kind)[0]
+
+# the parallel executors (see ParallelExecutors) that can run here - threads always run,
+# but only in parallel on a free-threaded build
+for kind in ParallelExecutors.availableKinds():
+    CPU_MODES[f"parallel-{kind}"] = functools.partial(findSumsOn, kind)
+
+
+###########################################################################################
+# Function to benchmark the CPU bound sample - every mode with every kernel (backend).
+# Each result is checked against the pure Python reference once, outside of the timing,
+# and speedup is relative to the synchronous python run (the original mode 5). The
+# parallel executors start before their first run and the seconds that took are reported
+# as start-up, next to the worker pool warm-up the multiprocessing modes pay
+###########################################################################################
+def runCpuBenchmark(modes=None, backends=None, numbers=None, trials=3, warmup=1, verify=True,
+                    profile=None, profileMode=ConcurrencyProfiler.SAMPLE):
+    modes = modes or list(CPU_MODES)
+    backends = backends or SumOfSquaresKernels.availableKernels()
+    numbers = numbers or [3_000_000 + x for x in range(20)]
+
+    results = []
+    poolWarmup = None
+    for mode in modes:
+        if mode.startswith("multiprocessing") and poolWarmup is None:
+            poolWarmup = Concurrency.getWorkerPool().start()
+        for backend in backends:
+            findSums = functools.partial(CPU_MODES[mode], numbers, backend)
+            startup = None
+            if mode.startswith("parallel-"):
+                kind = mode[len("parallel-"):]
+                ParallelExecutors.getExecutor(kind, Concurrency.POOL_CONTEXT)
+                startup = ParallelExecutors.startupSeconds[kind]
+            if verify:
+                SumOfSquaresKernels.verifyResults(backend, numbers, findSums())
+            profileDirectory = None
+            if profile is not None:
+                profileDirectory = os.path.join(profile, f"{mode}-{backend}")
+            with profiling(profileDirectory, profileMode):
+                durations = timeTrials(findSums, trials, warmup)
+            results.append({"mode": mode, "backend": backend, "trials": trials,
+                            "durations": durations, "startup": startup,
+                            "latency": PerformanceStats.summarizeLatencies(durations),
+                            "profile": ConcurrencyProfiler.mergeProfiles(profileDirectory)
+                                       if profileDirectory else None})
+
+    baseline = next((result["latency"]["p50"] for result in results
+                     if result["mode"] == "synchronous" and result["backend"] == "python"), None)
+    for result in results:
+        result["speedup"] = baseline / result["latency"]["p50"] if baseline else None
+    return {"numbers": len(numbers), "poolWarmup": poolWarmup, "results": results,
+            "detectedKind": ParallelExecutors.detectKind()}
+
+
+def formatCpuReport(report):
+    header = ["mode", "kernel", "trials", "p50 ms", "p95 ms", "speedup", "start-up ms"]
+    rows = []
+    for result in report["results"]:
+        latency = result["latency"]
+        speedup = f"{result['speedup']:.1f}x" if result["speedup"] else "-"
+        startup = f"{result['startup'] * 1000:.1f}" if result["startup"] is not None else "-"
+        rows.append([result["mode"], result["backend"], result["trials"],
+                     f"{latency['p50'] * 1000:.2f}", f"{latency['p95'] * 1000:.2f}", speedup,
+                     startup])
+    table = PerformanceStats.formatTable(header, rows)
+    table += f"\n\nparallel executor this interpreter would pick: {report['detectedKind']}"
+    return table + formatPoolWarmup(report["poolWarmup"]) + formatProfiles(report)
+
+
+###########################################################################################
+# Function to benchmark the pipeline against the stand-in server - the sequential run
+# times each stage on its own, the pipelined run overlaps them
+###########################################################################################
+def runPipelineBenchmark(siteCount=160, distinctSites=2, trials=3, warmup=1, rounds=1,
+                         profile=None, profileMode=ConcurrencyProfiler.SAMPLE, **serverConfig):
+    processor = functools.partial(URLDownloadPipeline.sumOfSquaresOfBytes, rounds=rounds)
+    server = LocalTestServer.startServer(**serverConfig)
+    try:
+        sites = buildSites(server, siteCount, distinctSites)
+        # start the processes before the first trial so their start-up isn't timed
+        executor = Concurrency.getProcessExecutor()
+        startTime = time.perf_counter()
+        list(executor.map(WarmWorkerPool.ping, range(os.cpu_count() or 1)))
+        poolWarmup = time.perf_counter() - startTime
+
+        results = []
+        for overlap in (False, True):
+            mode = "pipelined" if overlap else "sequential"
+            stages = []
+            def runPipeline():
+                stages.append(Concurrency.downloadAllSitesPipeline(sites, processor,
+                                                                  overlap=overlap))
+            profileDirectory = os.path.join(profile, mode) if profile is not None else None
+            with profiling(profileDirectory, profileMode):
+                durations = timeTrials(runPipeline, trials, warmup, stages.clear)
+            downloadSeconds = PerformanceStats.summarizeLatencies(
+                [totals["downloadSeconds"] for totals in stages])["p50"]
+            processSeconds = PerformanceStats.summarizeLatencies(
+                [totals["processSeconds"] - totals["downloadSeconds"] for totals in stages])["p50"]
+            results.append({"mode": mode, "trials": trials,
+                            "durations": durations,
+                            "latency": PerformanceStats.summarizeLatencies(durations),
+                            "downloadSeconds": downloadSeconds,
+                            "processSeconds": processSeconds if not overlap else None,
+                            "errors": sum(totals["errors"] + totals["processErrors"]
+                                          for totals in stages),
+                            "profile": ConcurrencyProfiler.mergeProfiles(profileDirectory)
+                                       if profileDirectory else None})
+        config = dict(server.config)
+    finally:
+        LocalTestServer.stopServer(server)
+    return {"server": config, "sites": len(sites), "rounds": rounds, "poolWarmup": poolWarmup,
+            "results": results}
+
+
+def formatPipelineReport(report):
+    header = ["mode", "sites", "trials", "p50 ms", "p95 ms", "download ms", "process ms", "errors"]
+    rows = []
+    for result in report["results"]:
+        latency = result["latency"]
+        processSeconds = result["processSeconds"]
+        rows.append([result["mode"], report["sites"], result["trials"],
+                     f"{latency['p50'] * 1000:.1f}", f"{latency['p95'] * 1000:.1f}",
+                     f"{result['downloadSeconds'] * 1000:.1f}",
+                     f"{processSeconds * 1000:.1f}" if processSeconds is not None else "-",
+                     result["errors"]])
+    table = PerformanceStats.formatTable(header, rows)
+    sequential, pipelined = report["results"]
+    stages = (sequential["downloadSeconds"], sequential["processSeconds"])
+    table += (f"\n\nstages: sum {sum(stages) * 1000:.1f} ms, max {max(stages) * 1000:.1f} ms - "
+              f"pipelined p50 {pipelined['latency']['p50'] * 1000:.1f} ms")
+    return table + formatPoolWarmup(report["poolWarmup"]) + formatProfiles(report)
+
+
+###########################################################################################
+# Function to format the profile summary of every run that was profiled
+###########################################################################################
+def formatProfiles(report):
+    sections = []
+    for result in report["results"]:
+        if result.get("profile"):
+            name = result.get("strategy") or f"{result['mode']} {result.get('backend', '')}".strip()
+            sections.append(f"\n\nprofile of {name}:\n"
+                            + ConcurrencyProfiler.formatSummary(result["profile"]))
+    return "".join(sections)
+
+
+def formatPoolWarmup(poolWarmup):
+    if not poolWarmup:
+        return ""
+    return f"\n\nworker pool warm-up (not included above): {poolWarmup * 1000:.1f} ms"
+
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the download strategies against a local stand-in server")
+    parser.add_argument("--strategy", action="append", choices=list(STRATEGIES),
+                        help="strategy to run (repeatable, default: all)")
+    parser.add_argument("--sites", type=int, default=160, help="number of URLs per trial")
+    parser.add_argument("--distinct", type=int, default=2, help="number of distinct URLs")
+    parser.add_argument("--trials", type=int, default=5, help="timed trials per strategy")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed warmup passes per strategy")
+    parser.add_argument("--latency", type=float, default=0.05, help="server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- latency jitter in seconds")
+    parser.add_argument("--body-size", type=int, default=10_000, help="response body size in bytes")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the jitter/error generator")
+    parser.add_argument("--slow-rate", type=float, default=0.0,
+                        help="fraction of requests the server answers slowly")
+    parser.add_argument("--slow-latency", type=float, default=1.0,
+                        help="extra seconds a slow request takes")
+    RequestPolicy.addArguments(parser)
+    parser.add_argument("--stream", action="store_true",
+                        help="stream bodies in chunks in the requests based strategies")
+    parser.add_argument("--cache", action="store_true",
+                        help="give each strategy a fresh on-disk response cache")
+    parser.add_argument("--cache-ttl", type=float, default=0.0,
+                        help="seconds a cached response is served without revalidating")
+    parser.add_argument("--max-age", type=int, help="have the server send Cache-Control: max-age")
+    parser.add_argument("--timings", action="store_true",
+                        help="time every request in phases and report them per strategy and host")
+    parser.add_argument("--cpu", action="store_true",
+                        help="benchmark the CPU bound sum of squares sample instead")
+    parser.add_argument("--kernel", action="append", choices=list(SumOfSquaresKernels.KERNELS),
+                        help="sum of squares kernel for --cpu (repeatable, default: all available)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="benchmark the download + process pipeline instead")
+    parser.add_argument("--rounds", type=int, default=1,
+                        help="sum of squares passes over every body for --pipeline")
+    parser.add_argument("--profile", metavar="DIRECTORY",
+                        help="profile every strategy's timed trials into DIRECTORY/<strategy>")
+    parser.add_argument("--profile-mode", choices=ConcurrencyProfiler.MODES,
+                        default=ConcurrencyProfiler.SAMPLE,
+                        help="sample the stacks or run cProfile (default: sample)")
+    parser.add_argument("--json", metavar="PATH", help="write the JSON report to PATH ('-' for stdout)")
+    parser.add_argument("--report", choices=DownloadReporter.MODES, default=DownloadReporter.QUIET,
+                        help="how the download results are reported (default: quiet)")
+    parser.add_argument("--report-file", metavar="PATH",
+                        help="file the results are written to (default: stdout)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="show the per-URL output (same as --report print)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArguments(argv)
+    if args.cpu:
+        report = runCpuBenchmark(backends=args.kernel, trials=args.trials, warmup=args.warmup,
+                                 profile=args.profile, profileMode=args.profile_mode)
+        print(formatCpuReport(report))
+        writeJson(report, args.json)
+        return report
+    if args.pipeline:
+        report = runPipelineBenchmark(siteCount=args.sites, distinctSites=args.distinct,
+                                      trials=args.trials, warmup=args.warmup, rounds=args.rounds,
+                                      latency=args.latency, jitter=args.jitter,
+                                      bodySize=args.body_size, errorRate=args.error_rate,
+                                      seed=args.seed, profile=args.profile,
+                                      profileMode=args.profile_mode)
+        print(formatPipelineReport(report))
+        writeJson(report, args.json)
+        return report
+
+    mode = DownloadReporter.PRINT if args.verbose else args.report
+    # only keep the console when the reporter is writing to it
+    quiet = mode == DownloadReporter.QUIET or args.report_file is not None
+    if args.report_file:
+        # every strategy's reporter appends to the file - start it empty
+        open(args.report_file, "w").close()
+    report = runBenchmark(strategies=args.strategy, siteCount=args.sites,
+                          distinctSites=args.distinct, trials=args.trials,
+                          warmup=args.warmup, quiet=quiet, stream=args.stream,
+                          report=mode, reportFile=args.report_file,
+                          policy=RequestPolicy.settingsFromArguments(args),
+                          profile=args.profile, profileMode=args.profile_mode,
+                          slowRate=args.slow_rate, slowLatency=args.slow_latency,
+                          cacheTtl=args.cache_ttl if args.cache else None,
+                          timings=args.timings, maxAge=args.max_age,
+                          latency=args.latency, jitter=args.jitter,
+                          bodySize=args.body_size, errorRate=args.error_rate, seed=args.seed)
+    print(formatReport(report))
+    writeJson(report, args.json)
+    return report
+
+
+def writeJson(report, path):
+    report = PerformanceStats.jsonSafe(report)
+    if path == "-":
+        print(json.dumps(report, indent=2, allow_nan=False))
+    elif path:
+        with open(path, "w") as output:
+            json.dump(report, output, indent=2, allow_nan=False)
+
+
+if(__name__ == "__main__"):
+    main()
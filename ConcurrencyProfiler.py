@@ -0,0 +1,455 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Opt-In Profiling and Concurrency Monitoring
+#
+# When a run is slow the total duration doesn't say where the time went - threads
+# fighting over the GIL, an event loop blocked by a slow callback, or pickling and IPC
+# between processes. A Profiler records that for every approach without changing it:
+#
+# - sample mode (the default) - a background thread takes the stack of every other
+#   thread every few milliseconds and counts them as collapsed stacks
+#   ("process;thread;outer;...;inner count", the input flamegraph.pl and speedscope take)
+# - cprofile mode - cProfile on the thread running the job. Threads started while the
+#   profiler runs get their own cProfile too, but only up to Python 3.11 - from 3.12 on
+#   only one cProfile can be active in a process, so use sample mode for thread pools
+# - a monitor thread records, every monitorInterval seconds, how late it woke up (time
+#   spent waiting for the GIL or a CPU), the lag of every event loop being watched and
+#   the queue depth and busy workers of every executor being watched
+#
+# Worker processes profile themselves: wrapTask() wraps the function sent to a pool so
+# the first task in each worker starts a Profiler there, and the worker writes its
+# files as it exits - shut the pools down before reading the results (see
+# Concurrency.shutdownWorkers). Every process writes <label>.prof or <label>.collapsed
+# plus <label>.json (busy time and the monitor's samples) to the directory, and
+# mergeProfiles() combines them into profile.prof / profile.collapsed and a summary. The
+# files of an earlier run in the same directory are removed when the next one starts
+#
+# Nothing is recorded unless a Profiler is running - the engines' calls to wrapTask(),
+# watch() and watchLoop() do nothing otherwise
+###########################################################################################
+
+import asyncio
+import contextlib
+import cProfile
+import glob
+import json
+import multiprocessing.util
+import os
+import pstats
+import sys
+import threading
+import time
+
+import PerformanceStats
+
+SAMPLE = "sample"
+CPROFILE = "cprofile"
+MODES = (SAMPLE, CPROFILE)
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+DEFAULT_MONITOR_INTERVAL = 0.1
+
+# the Profiler running in this process, if any
+active = None
+
+
+###########################################################################################
+# Function to return a thread's stack as one collapsed line, outermost frame first
+###########################################################################################
+def collapseStack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+###########################################################################################
+# Records the profile of one process. In the parent, use it as a context manager around
+# the job; in worker processes ProfiledTask starts one the first time a task runs
+#
+# Param: directory - where this process's files are written
+#        mode - SAMPLE or CPROFILE
+#        sampleInterval - seconds between stack samples (SAMPLE mode)
+#        monitorInterval - seconds between monitor samples
+#        label - name of the process in the files (default: "parent-<pid>")
+#        worker - True in a worker process: cProfile then only runs during tasks, so
+#                 the time a worker spends waiting for its next task isn't counted
+###########################################################################################
+class Profiler:
+    def __init__(self, directory, mode=SAMPLE, sampleInterval=DEFAULT_SAMPLE_INTERVAL,
+                 monitorInterval=DEFAULT_MONITOR_INTERVAL, label=None, worker=False):
+        if mode not in MODES:
+            raise ValueError(f"unknown profile mode {mode!r} - choose from {', '.join(MODES)}")
+        self.directory = directory
+        self.mode = mode
+        self.sampleInterval = sampleInterval
+        self.monitorInterval = monitorInterval
+        self.label = label or f"parent-{os.getpid()}"
+        self.worker = worker
+
+        self.lock = threading.Lock()
+        self.stacks = {}
+        self.samples = []
+        self.watches = []
+        self.loops = []
+        self.profile = cProfile.Profile() if mode == CPROFILE else None
+        self.threadProfiles = []
+        self.tasks = 0
+        self.busySeconds = 0.0
+        self.stopping = threading.Event()
+        self.threads = []
+        self.startTime = None
+        self.elapsed = None
+
+    def start(self):
+        global active
+        os.makedirs(self.directory, exist_ok=True)
+        if not self.worker:
+            removeProfiles(self.directory)
+        self.startTime = time.perf_counter()
+        targets = [self.monitor]
+        if self.mode == SAMPLE:
+            targets.append(self.sample)
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True,
+                                      name=f"ConcurrencyProfiler-{target.__name__}")
+            thread.start()
+            self.threads.append(thread)
+        # after the profiler's own threads have started, so they aren't profiled
+        if self.mode == CPROFILE:
+            threading.setprofile(self.profileThread)
+            if not self.worker:
+                self.profile.enable()
+        active = self
+        return self
+
+    def stop(self):
+        global active
+        if active is self:
+            active = None
+        if self.elapsed is not None:
+            return
+        if self.profile is not None:
+            threading.setprofile(None)
+            self.profile.disable()
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - self.startTime
+        self.write()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    ###########################################################################################
+    # Function to run one task of a worker process, profiling it in CPROFILE mode and
+    # counting the time spent on it towards the worker's utilization
+    ###########################################################################################
+    def run(self, function, args, kwargs):
+        startTime = time.perf_counter()
+        if self.profile is not None:
+            self.profile.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if self.profile is not None:
+                self.profile.disable()
+            self.busySeconds += time.perf_counter() - startTime
+            self.tasks += 1
+
+    # installed with threading.setprofile - swaps itself for a cProfile of the new thread
+    def profileThread(self, frame, event, arg):
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 3.12 and later - another cProfile is already active in this process
+            return
+        with self.lock:
+            self.threadProfiles.append(profile)
+
+    ###########################################################################################
+    # Background thread - count the stack of every other thread each sampleInterval
+    ###########################################################################################
+    def sample(self):
+        while not self.stopping.wait(self.sampleInterval):
+            ownThreads = {thread.ident for thread in self.threads}
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident in ownThreads:
+                    continue
+                stack = f"{self.label};{names.get(ident, ident)};{collapseStack(frame)}"
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    ###########################################################################################
+    # Background thread - every monitorInterval, record how late it woke up, post a probe
+    # to every watched event loop and read every watched executor's gauges
+    ###########################################################################################
+    def monitor(self):
+        due = time.perf_counter() + self.monitorInterval
+        while not self.stopping.wait(max(0.0, due - time.perf_counter())):
+            now = time.perf_counter()
+            elapsed = now - self.startTime
+            self.record(elapsed, "process", "wakeup delay ms", (now - due) * 1000)
+            due = now + self.monitorInterval
+            with self.lock:
+                watches = list(self.watches)
+                loops = list(self.loops)
+            for name, gauges in watches:
+                for metric, gauge in gauges.items():
+                    try:
+                        value = gauge()
+                    except Exception:
+                        continue
+                    self.record(elapsed, name, metric, value)
+            for state in loops:
+                # one probe at a time - a loop that is still busy with the last one
+                # reports its lag once it gets to it
+                if state["sent"] is None:
+                    state["sent"] = time.perf_counter()
+                    try:
+                        state["loop"].call_soon_threadsafe(self.probeAnswered, state)
+                    except RuntimeError:
+                        state["sent"] = None
+
+    # runs on the watched loop - how long the probe waited there is the loop's lag
+    def probeAnswered(self, state):
+        now = time.perf_counter()
+        self.record(now - self.startTime, state["name"], "loop lag ms", (now - state["sent"]) * 1000)
+        state["sent"] = None
+
+    def record(self, elapsed, name, metric, value):
+        self.samples.append((round(elapsed, 4), name, metric, value))
+
+    ###########################################################################################
+    # Functions to register what the monitor reads - see the module level watch() and
+    # watchLoop()
+    ###########################################################################################
+    def addWatch(self, name, gauges):
+        entry = (name, gauges)
+        with self.lock:
+            self.watches.append(entry)
+        return entry
+
+    def removeWatch(self, entry):
+        with self.lock:
+            if entry in self.watches:
+                self.watches.remove(entry)
+
+    def addLoop(self, name, loop):
+        state = {"name": name, "loop": loop, "sent": None}
+        with self.lock:
+            self.loops.append(state)
+        return state
+
+    def removeLoop(self, state):
+        with self.lock:
+            if state in self.loops:
+                self.loops.remove(state)
+
+    ###########################################################################################
+    # Function to write this process's files - <label>.prof or <label>.collapsed and
+    # <label>.json
+    ###########################################################################################
+    def write(self):
+        path = os.path.join(self.directory, self.label)
+        if self.profile is not None:
+            stats = pstats.Stats(self.profile)
+            with self.lock:
+                threadProfiles = list(self.threadProfiles)
+            for profile in threadProfiles:
+                try:
+                    stats.add(profile)
+                except TypeError:
+                    # a thread that never made a call has no stats
+                    pass
+            stats.dump_stats(path + ".prof")
+        else:
+            with open(path + ".collapsed", "w") as output:
+                output.writelines(f"{stack} {count}\n" for stack, count in self.stacks.items())
+        with open(path + ".json", "w") as output:
+            json.dump({"label": self.label, "pid": os.getpid(), "mode": self.mode,
+                       "worker": self.worker, "elapsed": self.elapsed, "tasks": self.tasks,
+                       "busySeconds": self.busySeconds, "samples": self.samples}, output)
+
+
+###########################################################################################
+# Picklable wrapper for a function sent to a worker process - starts the worker's
+# Profiler the first time it runs there and runs function under it. The worker writes
+# its files when it exits
+###########################################################################################
+workerProfiler = None
+
+
+class ProfiledTask:
+    def __init__(self, function, directory, mode=SAMPLE, sampleInterval=DEFAULT_SAMPLE_INTERVAL,
+                 monitorInterval=DEFAULT_MONITOR_INTERVAL):
+        self.function = function
+        self.directory = directory
+        self.mode = mode
+        self.sampleInterval = sampleInterval
+        self.monitorInterval = monitorInterval
+
+    def __call__(self, *args, **kwargs):
+        global workerProfiler
+        if workerProfiler is None or workerProfiler.directory != self.directory:
+            # a warm worker that was profiled for an earlier run - finish that one first
+            if workerProfiler is not None:
+                workerProfiler.stop()
+            workerProfiler = Profiler(self.directory, self.mode, self.sampleInterval,
+                                      self.monitorInterval, label=f"worker-{os.getpid()}",
+                                      worker=True).start()
+            multiprocessing.util.Finalize(workerProfiler, workerProfiler.stop, exitpriority=10)
+        return workerProfiler.run(self.function, args, kwargs)
+
+
+###########################################################################################
+# Function for the engines to wrap what they send to worker processes - returns function
+# itself unless a Profiler is running in this process
+###########################################################################################
+def wrapTask(function):
+    profiler = active
+    if profiler is None or profiler.worker:
+        return function
+    return ProfiledTask(function, profiler.directory, profiler.mode, profiler.sampleInterval,
+                        profiler.monitorInterval)
+
+
+###########################################################################################
+# Context managers for the engines to have the monitor read their state while they run:
+#
+#   watch("asyncio", depth=queue.qsize) - gauges are functions returning a number; busy
+#                                         and workers together also give "utilization"
+#   watchLoop("asyncio")                - the lag of the running event loop
+###########################################################################################
+@contextlib.contextmanager
+def watch(name, workers=None, **gauges):
+    profiler = active
+    if profiler is None:
+        yield
+        return
+    if workers and "busy" in gauges:
+        busy = gauges["busy"]
+        gauges["utilization"] = lambda: busy() / workers
+    entry = profiler.addWatch(name, gauges)
+    try:
+        yield
+    finally:
+        profiler.removeWatch(entry)
+
+
+@contextlib.contextmanager
+def watchLoop(name):
+    profiler = active
+    if profiler is None:
+        yield
+        return
+    state = profiler.addLoop(name, asyncio.get_running_loop())
+    try:
+        yield
+    finally:
+        profiler.removeLoop(state)
+
+
+###########################################################################################
+# Function to remove the files an earlier run wrote to directory, so they aren't merged
+# with this one's
+###########################################################################################
+def removeProfiles(directory):
+    for pattern in ("parent-*", "worker-*", "profile.*"):
+        for path in glob.glob(os.path.join(directory, pattern)):
+            if path.endswith((".prof", ".collapsed", ".json")):
+                os.remove(path)
+
+
+###########################################################################################
+# Function to merge the files every process wrote to directory into profile.prof and
+# profile.collapsed. Returns a summary of the hottest functions (cprofile) or stacks
+# (sample), each process's utilization and each monitored metric
+###########################################################################################
+def mergeProfiles(directory, top=15):
+    summary = {"functions": [], "stacks": [], "processes": [], "metrics": []}
+
+    profiles = sorted(path for path in glob.glob(os.path.join(directory, "*.prof"))
+                      if os.path.basename(path) != "profile.prof")
+    if profiles:
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(os.path.join(directory, "profile.prof"))
+        entries = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+        for (filename, line, function), (_, calls, ownTime, totalTime, _) in entries[:top]:
+            summary["functions"].append({"function": f"{function} ({os.path.basename(filename)}:{line})",
+                                         "calls": calls, "ownSeconds": ownTime,
+                                         "totalSeconds": totalTime})
+
+    stacks = {}
+    for path in glob.glob(os.path.join(directory, "*.collapsed")):
+        if os.path.basename(path) == "profile.collapsed":
+            continue
+        with open(path) as lines:
+            for line in lines:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                stacks[stack] = stacks.get(stack, 0) + int(count)
+    if stacks:
+        with open(os.path.join(directory, "profile.collapsed"), "w") as output:
+            output.writelines(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+        # the innermost frame of each sample - where the threads actually were
+        leaves = {}
+        for stack, count in stacks.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + count
+        total = sum(leaves.values())
+        for leaf, count in sorted(leaves.items(), key=lambda item: item[1], reverse=True)[:top]:
+            summary["stacks"].append({"frame": leaf, "samples": count, "share": count / total})
+
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path) as source:
+            process = json.load(source)
+        elapsed = process["elapsed"] or 0.0
+        summary["processes"].append({
+            "label": process["label"], "tasks": process["tasks"], "elapsed": elapsed,
+            "busySeconds": process["busySeconds"],
+            "utilization": process["busySeconds"] / elapsed if process["worker"] and elapsed else None})
+        series = {}
+        for _, name, metric, value in process["samples"]:
+            series.setdefault((name, metric), []).append(value)
+        for (name, metric), values in sorted(series.items()):
+            stats = PerformanceStats.summarizeLatencies(values)
+            summary["metrics"].append({"process": process["label"], "name": name, "metric": metric,
+                                       "samples": stats["count"], "mean": stats["mean"],
+                                       "p95": stats["p95"], "max": stats["max"]})
+    return summary
+
+
+###########################################################################################
+# Function to format mergeProfiles' summary as console tables
+###########################################################################################
+def formatSummary(summary):
+    sections = []
+    if summary["functions"]:
+        rows = [[entry["function"], entry["calls"], f"{entry['ownSeconds'] * 1000:.1f}",
+                 f"{entry['totalSeconds'] * 1000:.1f}"] for entry in summary["functions"]]
+        sections.append(PerformanceStats.formatTable(["function", "calls", "own ms", "total ms"], rows))
+    if summary["stacks"]:
+        rows = [[entry["frame"], entry["samples"], f"{entry['share'] * 100:.1f}%"]
+                for entry in summary["stacks"]]
+        sections.append(PerformanceStats.formatTable(["innermost frame", "samples", "share"], rows))
+    if summary["processes"]:
+        rows = [[entry["label"], entry["tasks"], f"{entry['elapsed'] * 1000:.1f}",
+                 f"{entry['busySeconds'] * 1000:.1f}",
+                 f"{entry['utilization'] * 100:.1f}%" if entry["utilization"] is not None else "-"]
+                for entry in summary["processes"]]
+        sections.append(PerformanceStats.formatTable(["process", "tasks", "profiled ms", "busy ms",
+                                                     "utilization"], rows))
+    if summary["metrics"]:
+        rows = [[entry["process"], entry["name"], entry["metric"], entry["samples"],
+                 f"{entry['mean']:.2f}", f"{entry['p95']:.2f}", f"{entry['max']:.2f}"]
+                for entry in summary["metrics"]]
+        sections.append(PerformanceStats.formatTable(["process", "watch", "metric", "samples",
+                                                     "mean", "p95", "max"], rows))
+    return "\n\n".join(sections)
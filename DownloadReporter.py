@@ -0,0 +1,262 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Download Results and Batched Reporting
+#
+# Printing a line per url from every thread, task or process serializes them all on
+# stdout, and at high request rates the console writes show up in the measured duration.
+# Instead, every downloadSite returns a DownloadResult (url, status, bytes, source,
+# timings, latency, error) and downloadAllSites hands them to a Reporter:
+#
+# - report() only puts the result on a queue, so it is cheap and safe to call from any
+#   thread or from the event loop. The queue is bounded, so when the writer falls behind
+#   the downloads wait for it instead of piling results up in memory
+# - a background thread takes the results off the queue in batches, keeps the counts
+#   and writes each batch with a single write:
+#
+#     quiet    - nothing is written, only the counts are kept (see summary())
+#     progress - a one line summary every `interval` seconds and once more at the end
+#     print    - the original "Read <bytes> from <url>" line for every url
+#     jsonl    - one JSON object per url (DownloadResult.toDict()) to a file
+#
+# close() (or leaving the with block) waits until every result has been written
+###########################################################################################
+
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+
+import PerformanceStats
+
+QUIET = "quiet"
+PROGRESS = "progress"
+PRINT = "print"
+JSONL = "jsonl"
+MODES = (QUIET, PROGRESS, PRINT, JSONL)
+
+# the most results written in one batch
+BATCH_SIZE = 1024
+# the most results waiting to be handled before report() waits for the writer
+QUEUE_SIZE = 8 * BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# put on the queue by close() to stop the background thread
+STOP = object()
+# put on the queue by resetLatencies() - the latencies of the results before it are dropped
+RESET = object()
+
+
+###########################################################################################
+# Outcome of downloading one url. source is where a cached response came from (see
+# URLDownloadCache), timing the RequestTiming row when the request was timed, latency the
+# seconds downloadSite took (with a RequestPolicy, until the attempt kept answered) and
+# error the repr of the exception when the download failed. The flags record what a
+# RequestPolicy did: hedged - a duplicate request was sent, hedgeWon - the duplicate's
+# response is the one kept, tripped - this failure opened the host's circuit breaker,
+# rejected - the breaker was open so no request was sent. processed is what the
+# URLDownloadPipeline processor returned for the body
+###########################################################################################
+class DownloadResult:
+    __slots__ = ("url", "status", "size", "source", "timing", "latency", "error",
+                 "hedged", "hedgeWon", "tripped", "rejected", "processed")
+
+    def __init__(self, url, status=None, size=0, source=None, timing=None, error=None,
+                 rejected=False):
+        self.url = url
+        self.status = status
+        self.size = size
+        self.source = source
+        self.timing = timing
+        self.latency = None
+        # exceptions don't always survive pickling between processes - keep their repr
+        self.error = error if error is None or isinstance(error, str) else repr(error)
+        self.hedged = False
+        self.hedgeWon = False
+        self.tripped = False
+        self.rejected = rejected
+        self.processed = None
+
+    @property
+    def ok(self):
+        return self.error is None and (self.status is None or self.status < 400)
+
+    def toDict(self):
+        return {"url": self.url, "status": self.status, "size": self.size,
+                "source": self.source, "timing": self.timing, "latency": self.latency,
+                "error": self.error,
+                "hedged": self.hedged, "hedgeWon": self.hedgeWon, "tripped": self.tripped,
+                "rejected": self.rejected, "processed": self.processed}
+
+    # the line the samples used to print for every url
+    def describe(self):
+        if self.error is not None:
+            return f"Failed {self.url}: {self.error}"
+        if self.source is not None:
+            return f"Read {self.size} from {self.url} ({self.source})"
+        return f"Read {self.size} from {self.url}"
+
+
+###########################################################################################
+# Results kept in a list - lets code that takes a reporter collect its results instead,
+# e.g. in a worker process that returns them to the parent
+###########################################################################################
+class ResultList(list):
+    report = list.append
+
+
+###########################################################################################
+# Consumes DownloadResults in batches on a background thread
+#
+# Param: mode - one of MODES
+#        output - file object or path to write to (default sys.stdout); a path is opened
+#                 for appending and closed again by close()
+#        interval - seconds between the progress summaries
+#        label - added to every JSON line as "label" (e.g., the strategy name)
+#        keepLatencies - keep every result's latency so summary() can report their
+#                        percentiles (memory grows with the number of urls)
+#        queueSize - results waiting to be handled before report() blocks
+#
+# A batch that fails to be handled (e.g., the output file's disk is full) is logged and
+# dropped - the thread carries on with the next, so report() never waits on a writer
+# that has died
+###########################################################################################
+class Reporter:
+    def __init__(self, mode=PROGRESS, output=None, interval=1.0, label=None,
+                 batchSize=BATCH_SIZE, keepLatencies=False, queueSize=QUEUE_SIZE):
+        if mode not in MODES:
+            raise ValueError(f"unknown report mode {mode!r} - choose from {', '.join(MODES)}")
+        self.mode = mode
+        self.interval = interval
+        self.label = label
+        self.batchSize = batchSize
+        self.ownsOutput = isinstance(output, str)
+        self.output = open(output, "a") if self.ownsOutput else output or sys.stdout
+
+        self.downloaded = 0
+        self.bytes = 0
+        self.errors = 0
+        self.statuses = {}
+        self.sources = {}
+        self.policy = {"hedges": 0, "hedgeWins": 0, "trips": 0, "rejected": 0}
+        self.latencies = [] if keepLatencies else None
+        self.startTime = time.perf_counter()
+        self.lastProgress = self.startTime
+
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.thread = threading.Thread(target=self.run, daemon=True, name="DownloadReporter")
+        self.thread.start()
+
+    def report(self, result):
+        self.queue.put(result)
+
+    def reportAll(self, results):
+        for result in results:
+            self.queue.put(result)
+
+    # drop the latencies of everything reported so far (e.g., the warmup's) - queued, so
+    # results still waiting to be handled are dropped too
+    def resetLatencies(self):
+        self.queue.put(RESET)
+
+    ###########################################################################################
+    # Background thread - wait for a result, then take whatever else is already queued
+    # (up to batchSize) and handle them together
+    ###########################################################################################
+    def run(self):
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self.queue.get(timeout=self.interval)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < self.batchSize:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch and batch[-1] is STOP:
+                stopping = True
+                batch.pop()
+            try:
+                self.handleBatch(batch)
+                if self.mode == PROGRESS and (stopping or
+                                              time.perf_counter() - self.lastProgress >= self.interval):
+                    self.writeProgress()
+            except Exception:
+                logger.exception("DownloadReporter failed to handle %d results", len(batch))
+
+    def handleBatch(self, batch):
+        for result in batch:
+            if result is RESET:
+                if self.latencies is not None:
+                    self.latencies.clear()
+                continue
+            if self.latencies is not None and result.latency is not None:
+                self.latencies.append(result.latency)
+            if result.error is not None:
+                self.errors += 1
+            else:
+                self.downloaded += 1
+                self.bytes += result.size or 0
+                self.statuses[result.status] = self.statuses.get(result.status, 0) + 1
+            if result.source is not None:
+                self.sources[result.source] = self.sources.get(result.source, 0) + 1
+            self.policy["hedges"] += result.hedged
+            self.policy["hedgeWins"] += result.hedgeWon
+            self.policy["trips"] += result.tripped
+            self.policy["rejected"] += result.rejected
+
+        batch = [result for result in batch if result is not RESET]
+        if not batch:
+            return
+        if self.mode == PRINT:
+            self.write("".join(result.describe() + "\n" for result in batch))
+        elif self.mode == JSONL:
+            lines = []
+            for result in batch:
+                record = result.toDict()
+                if self.label is not None:
+                    record["label"] = self.label
+                # a processor's result may not be JSON - fall back to its repr
+                lines.append(json.dumps(PerformanceStats.jsonSafe(record), default=repr,
+                                        allow_nan=False) + "\n")
+            self.write("".join(lines))
+
+    def writeProgress(self):
+        now = time.perf_counter()
+        elapsed = now - self.startTime
+        rate = (self.downloaded + self.errors) / elapsed if elapsed > 0 else 0.0
+        self.lastProgress = now
+        self.write(f"{self.downloaded} downloaded ({self.bytes} bytes), {self.errors} errors "
+                   f"- {rate:.1f} urls/s\n")
+
+    def write(self, text):
+        self.output.write(text)
+        self.output.flush()
+
+    ###########################################################################################
+    # Function to stop the background thread once it has handled everything reported so far
+    ###########################################################################################
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(STOP)
+            self.thread.join()
+        if self.ownsOutput and not self.output.closed:
+            self.output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # the counts so far - complete once close() has returned
+    def summary(self):
+        summary = {"downloaded": self.downloaded, "bytes": self.bytes, "errors": self.errors,
+                   "statuses": {str(status): count for status, count in self.statuses.items()},
+                   "sources": dict(self.sources), "policy": dict(self.policy)}
+        if self.latencies is not None:
+            summary["latency"] = PerformanceStats.summarizeLatencies(self.latencies)
+        return summary
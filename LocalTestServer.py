@@ -0,0 +1,141 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Local HTTP Stand-In Server
+#
+# A small threaded HTTP server that stands in for jython.org / realpython.org when we
+# benchmark the download strategies. Latency, body size, jitter and error rate are all
+# configurable and the random number generator is seeded so that runs are reproducible
+# and do not need network access (i.e., they can run in CI)
+###########################################################################################
+
+import email.utils
+import http.server
+import random
+import sys
+import threading
+import time
+import zlib
+
+
+###########################################################################################
+# Request handler - sleeps for the configured latency (plus jitter), then either returns
+# an error or a body of the configured size. HTTP/1.1 is used so that sessions can keep
+# their connections alive across requests, just like they would against a real site
+###########################################################################################
+class StandInRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes - without this the client's delayed ACK
+    # adds ~40ms to every keep-alive request and swamps the configured latency
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        delay, failed = self.server.nextBehaviour()
+        if delay > 0:
+            time.sleep(delay)
+
+        if failed:
+            body = b"injected failure"
+            self.send_response(500)
+        else:
+            body = self.server.body
+            if self.server.config["validators"]:
+                # the body is the same for every path, so the path makes each url's
+                # ETag unique
+                etag = '"%08x"' % zlib.crc32(self.path.encode("utf-8"), self.server.bodyChecksum)
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    self.server.countRequest(failed, notModified=True)
+                    return
+            self.send_response(200)
+            if self.server.config["validators"]:
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", self.server.lastModified)
+            if self.server.config["maxAge"] is not None:
+                self.send_header("Cache-Control", f"max-age={self.server.config['maxAge']}")
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.countRequest(failed)
+
+    # keep the console quiet - the benchmark prints its own report
+    def log_message(self, format, *args):
+        pass
+
+
+###########################################################################################
+# Threaded server holding the configuration and the seeded random number generator
+# shared by all of the handler threads
+###########################################################################################
+class StandInServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connections when a pool of processes all connect
+    # at the same time
+    request_queue_size = 1024
+
+    # validators - send ETag/Last-Modified and answer matching If-None-Match with a 304
+    # maxAge - when not None, send Cache-Control: max-age=maxAge
+    # slowRate / slowLatency - fraction of requests that take slowLatency seconds longer
+    #                          (a long tail, like a real upstream's)
+    def __init__(self, address, latency=0.05, bodySize=10_000, jitter=0.0, errorRate=0.0,
+                 seed=0, validators=True, maxAge=None, slowRate=0.0, slowLatency=1.0):
+        super().__init__(address, StandInRequestHandler)
+        self.config = {"latency": latency, "bodySize": bodySize, "jitter": jitter,
+                       "errorRate": errorRate, "seed": seed, "validators": validators,
+                       "maxAge": maxAge, "slowRate": slowRate, "slowLatency": slowLatency}
+        self.body = bytes(i % 256 for i in range(bodySize))
+        self.bodyChecksum = zlib.crc32(self.body)
+        self.lastModified = email.utils.formatdate(usegmt=True)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requestCount = 0
+        self.errorCount = 0
+        self.notModifiedCount = 0
+
+    # draw the latency and error decision for the next request under the lock so the
+    # sequence produced by the seed is not corrupted by concurrent handler threads
+    def nextBehaviour(self):
+        config = self.config
+        with self.lock:
+            delay = config["latency"]
+            if config["jitter"]:
+                delay += self.random.uniform(-config["jitter"], config["jitter"])
+            failed = self.random.random() < config["errorRate"]
+            if config["slowRate"] and self.random.random() < config["slowRate"]:
+                delay += config["slowLatency"]
+        return max(0.0, delay), failed
+
+    # clients closing their keep-alive connections at the end of a run is expected
+    def handle_error(self, request, clientAddress):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, clientAddress)
+
+    def countRequest(self, failed, notModified=False):
+        with self.lock:
+            self.requestCount += 1
+            if failed:
+                self.errorCount += 1
+            if notModified:
+                self.notModifiedCount += 1
+
+
+###########################################################################################
+# Function to start a stand-in server on a background thread. Port 0 lets the operating
+# system pick a free port - use baseUrl(server) to find out which one it chose
+###########################################################################################
+def startServer(host="127.0.0.1", port=0, **config):
+    server = StandInServer((host, port), **config)
+    thread = threading.Thread(target=server.serve_forever, name="StandInServer", daemon=True)
+    thread.start()
+    return server
+
+
+def stopServer(server):
+    server.shutdown()
+    server.server_close()
+
+
+def baseUrl(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
@@ -0,0 +1,113 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Parallel Executors for CPU Bound Work
+#
+# multiprocessing gets around the GIL by running a whole interpreter process per core,
+# and each one pays for starting up, importing the modules and pickling every task and
+# result across a pipe. Newer interpreters have two cheaper ways of running Python code
+# on every core:
+#
+# - free-threaded builds (3.13t and later - sys._is_gil_enabled() is False) have no GIL,
+#   so plain threads run Python code in parallel
+# - 3.14 adds concurrent.futures.InterpreterPoolExecutor - each of its threads runs its
+#   own subinterpreter with its own GIL, all in the one process
+#
+# detectKind() picks the cheapest kind the running interpreter can run in parallel -
+# threads, then interpreters, falling back to processes - and getExecutor() keeps one
+# warm executor per kind so only the first job pays for starting it
+#
+# Subinterpreters import their own copy of every module a task needs, and extension
+# modules that don't support subinterpreters (NumPy, for one) can't be imported there
+###########################################################################################
+
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+THREADS = "threads"
+INTERPRETERS = "interpreters"
+PROCESSES = "processes"
+KINDS = (THREADS, INTERPRETERS, PROCESSES)
+
+# workers per executor - one per CPU
+WORKERS = os.cpu_count() or 1
+
+
+###########################################################################################
+# Functions to detect what the running interpreter supports
+###########################################################################################
+def gilEnabled():
+    isGilEnabled = getattr(sys, "_is_gil_enabled", None)
+    return True if isGilEnabled is None else isGilEnabled()
+
+
+def interpretersSupported():
+    return hasattr(concurrent.futures, "InterpreterPoolExecutor")
+
+
+def detectKind():
+    if not gilEnabled():
+        return THREADS
+    if interpretersSupported():
+        return INTERPRETERS
+    return PROCESSES
+
+
+###########################################################################################
+# Function to return the kinds that can run here. Threads always can, but with the GIL
+# enabled they take turns instead of running in parallel
+###########################################################################################
+def availableKinds():
+    return [kind for kind in KINDS if kind != INTERPRETERS or interpretersSupported()]
+
+
+###########################################################################################
+# Function to create an executor of the given kind
+#
+# Param: context - multiprocessing start method for the processes kind (default: the
+#                  platform's default)
+###########################################################################################
+def createExecutor(kind, workers=WORKERS, context=None):
+    if kind == THREADS:
+        return concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="ParallelExecutor")
+    if kind == INTERPRETERS:
+        if not interpretersSupported():
+            raise RuntimeError(f"subinterpreters need Python 3.14 or later, this is {sys.version.split()[0]}")
+        return concurrent.futures.InterpreterPoolExecutor(workers)
+    if kind == PROCESSES:
+        return concurrent.futures.ProcessPoolExecutor(workers,
+                                                      mp_context=multiprocessing.get_context(context))
+    raise ValueError(f"unknown executor kind {kind!r} - choose from {', '.join(KINDS)}")
+
+
+executors = {}
+startupSeconds = {}
+executorsLock = threading.Lock()
+
+###########################################################################################
+# Function to return the warm executor of the given kind (default: detectKind()),
+# creating it and starting its workers the first time. The seconds that took are kept
+# in startupSeconds[kind]
+###########################################################################################
+def getExecutor(kind=None, context=None):
+    kind = kind or detectKind()
+    with executorsLock:
+        executor = executors.get(kind)
+        if executor is None:
+            startTime = time.perf_counter()
+            executor = createExecutor(kind, context=context)
+            # a builtin runs anywhere - once per worker to get all of them started
+            list(executor.map(abs, range(WORKERS)))
+            startupSeconds[kind] = time.perf_counter() - startTime
+            executors[kind] = executor
+    return executor
+
+
+def shutdown():
+    with executorsLock:
+        running = list(executors.values())
+        executors.clear()
+    for executor in running:
+        executor.shutdown()
@@ -0,0 +1,78 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Performance Statistics Helpers
+#
+# Small helpers shared by the benchmark harness and the download strategies to turn a
+# collection of raw measurements (seconds) into the summary figures we report:
+# throughput and the p50/p95/p99 percentiles
+###########################################################################################
+
+import math
+
+
+###########################################################################################
+# Function to return the requested percentile (0-100) of a collection of values using
+# linear interpolation between the closest ranks. Returns nan for an empty collection
+###########################################################################################
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return math.nan
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * (pct / 100.0)
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    if lower == upper:
+        return ordered[lower]
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+###########################################################################################
+# Function to summarize a collection of latencies (seconds) into count, mean, min, max
+# and the p50/p95/p99 percentiles
+###########################################################################################
+def summarizeLatencies(values):
+    values = list(values)
+    if not values:
+        return {"count": 0, "mean": math.nan, "min": math.nan, "max": math.nan,
+                "p50": math.nan, "p95": math.nan, "p99": math.nan}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "min": min(values),
+        "max": max(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+###########################################################################################
+# Function to return a copy of value (nested dicts, lists and tuples) with the nan and
+# infinite floats - an empty summary's figures, phases that weren't measured - replaced
+# by None, so json.dumps writes null instead of NaN, which JSON doesn't allow
+###########################################################################################
+def jsonSafe(value):
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: jsonSafe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonSafe(item) for item in value]
+    return value
+
+
+###########################################################################################
+# Function to format a table of rows (list of lists) with a header row so the columns
+# line up when printed to the console
+###########################################################################################
+def formatTable(header, rows):
+    cells = [[str(cell) for cell in header]] + [[str(cell) for cell in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(header))]
+    lines = []
+    for index, row in enumerate(cells):
+        lines.append("  ".join(cell.rjust(widths[i]) if i else cell.ljust(widths[i])
+                               for i, cell in enumerate(row)))
+        if index == 0:
+            lines.append("  ".join("-" * width for width in widths))
+    return "\n".join(lines)
@@ -0,0 +1,490 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Deadlines, Hedged Requests and Circuit
+# Breakers
+#
+# A batch of downloads is only as fast as its slowest request, and one slow or failing
+# host can stretch the whole run. A RequestPolicy wraps each download with:
+#
+# - a deadline: the most seconds a request may take in total, after which it is given
+#   up as a TimeoutError
+# - hedging: when a request has not answered by the p95 latency seen so far (or after
+#   hedgeAfter seconds), a duplicate is sent and whichever answers first is kept - the
+#   cost is a few percent more requests, the gain a much shorter tail
+# - a circuit breaker per host: after breakerFailures failures in a row (errors or 5xx)
+#   the host's breaker opens and its urls are failed straight away, without a request,
+#   for breakerCooldown seconds. Then one request is let through to probe the host - it
+#   closes the breaker again if it succeeds
+#
+# The same policy works for the requests based engines (call - on the calling thread
+# with the caller's session or, when hedging, on the policy's threads so both attempts
+# can be waited for, each with that thread's own session) and for asyncio (callAsync -
+# attempts are tasks and the losers are cancelled). Every DownloadResult records whether
+# it was hedged, whether the hedge won, whether its failure tripped the breaker and
+# whether the breaker rejected it, so the counts add up across processes
+###########################################################################################
+
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import time
+import urllib.parse
+import uuid
+
+import aiohttp
+import requests
+
+import DownloadReporter
+import PerformanceStats
+
+# the latencies the hedge delay is worked out from
+LATENCY_WINDOW = 256
+# recompute the hedge delay after this many new latencies
+HEDGE_RECOMPUTE_EVERY = 16
+
+
+###########################################################################################
+# Helper function to tell whether the current task itself has been asked to stop, as
+# opposed to it seeing the cancellation of a future it awaited. Task.cancelling() needs
+# Python 3.11 - before that every cancellation is taken to be the task's own
+###########################################################################################
+def cancelRequested():
+    cancelling = getattr(asyncio.current_task(), "cancelling", None)
+    return cancelling is None or cancelling() > 0
+
+
+###########################################################################################
+# Raised (as the result's error) for a url whose host's breaker is open
+###########################################################################################
+class CircuitOpenError(Exception):
+    pass
+
+
+###########################################################################################
+# Circuit breaker for one host. closed - requests flow; open - requests are rejected
+# until the cooldown has passed; half-open - one probe request is in flight
+###########################################################################################
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failures=5, cooldown=30.0):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutiveFailures = 0
+        self.openedAt = 0.0
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    # whether a request may be sent now - after the cooldown only the first caller is let
+    # through, as the probe. Returns False, or the state the request is sent in (HALF_OPEN
+    # for the probe)
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return self.CLOSED
+            if self.state == self.OPEN and time.monotonic() - self.openedAt >= self.cooldown:
+                self.state = self.HALF_OPEN
+                return self.HALF_OPEN
+            return False
+
+    # the probe ended without an outcome (it was cancelled) - let the next request probe
+    def releaseProbe(self):
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.openedAt = time.monotonic() - self.cooldown
+
+    # returns True when this failure opened the breaker
+    def recordFailure(self):
+        with self.lock:
+            self.consecutiveFailures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and
+                                                self.consecutiveFailures >= self.failures):
+                self.state = self.OPEN
+                self.openedAt = time.monotonic()
+                self.trips += 1
+                return True
+            return False
+
+    def recordSuccess(self):
+        with self.lock:
+            self.consecutiveFailures = 0
+            self.state = self.CLOSED
+
+
+###########################################################################################
+# Deadline, hedging and circuit breaker settings plus the state they need (latencies,
+# breakers, the threads attempts run on)
+#
+# Param: deadline - seconds a request may take in total (None for no limit)
+#        hedge - send a duplicate request when the first is slower than the hedge delay
+#        hedgeAfter - fixed hedge delay in seconds; by default it is the hedgePercentile
+#                     latency of recent requests, once there are hedgeMinSamples of them
+#        breakerFailures - failures in a row that open a host's breaker (None for no
+#                          breakers)
+#        breakerCooldown - seconds an open breaker rejects requests before a probe
+#        maxWorkers - threads the hedged requests based attempts run on - reserveThreads
+#                     raises it to fit the engine's threads
+#
+# Pickled into a worker process, a policy becomes that process's copy of it (see
+# openPolicy) so its breakers and latencies live as long as the process does
+###########################################################################################
+class RequestPolicy:
+    def __init__(self, deadline=None, hedge=False, hedgeAfter=None, hedgePercentile=95,
+                 hedgeMinSamples=20, breakerFailures=None, breakerCooldown=30.0,
+                 maxWorkers=32, key=None):
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedgeAfter = hedgeAfter
+        self.hedgePercentile = hedgePercentile
+        self.hedgeMinSamples = hedgeMinSamples
+        self.breakerFailures = breakerFailures
+        self.breakerCooldown = breakerCooldown
+        self.maxWorkers = maxWorkers
+        self.key = key or uuid.uuid4().hex
+
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.newLatencies = 0
+        self.hedgeDelayValue = None
+        self.breakers = {}
+        self.executor = None
+        # executors replaced by reserveThreads - attempts may still be running on them
+        self.retiredExecutors = []
+        self.threadLocal = threading.local()
+        self.threadSessions = []
+        self.stats = collections.Counter()
+
+    def __reduce__(self):
+        return (openPolicy, (self.key, self.settings()))
+
+    def settings(self):
+        return {"deadline": self.deadline, "hedge": self.hedge, "hedgeAfter": self.hedgeAfter,
+                "hedgePercentile": self.hedgePercentile, "hedgeMinSamples": self.hedgeMinSamples,
+                "breakerFailures": self.breakerFailures, "breakerCooldown": self.breakerCooldown,
+                "maxWorkers": self.maxWorkers}
+
+    ###########################################################################################
+    # Function to return the seconds to wait before hedging, or None when not hedging yet
+    ###########################################################################################
+    def hedgeDelay(self):
+        if not self.hedge:
+            return None
+        if self.hedgeAfter is not None:
+            return self.hedgeAfter
+        with self.lock:
+            if len(self.latencies) < self.hedgeMinSamples:
+                return None
+            if self.hedgeDelayValue is None or self.newLatencies >= HEDGE_RECOMPUTE_EVERY:
+                self.hedgeDelayValue = PerformanceStats.percentile(self.latencies,
+                                                                   self.hedgePercentile)
+                self.newLatencies = 0
+            return self.hedgeDelayValue
+
+    def getBreaker(self, url):
+        if self.breakerFailures is None:
+            return None
+        host = urllib.parse.urlsplit(url).netloc
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            with self.lock:
+                breaker = self.breakers.setdefault(
+                    host, CircuitBreaker(self.breakerFailures, self.breakerCooldown))
+        return breaker
+
+    def rejected(self, url):
+        self.count("rejected")
+        host = urllib.parse.urlsplit(url).netloc
+        return DownloadReporter.DownloadResult(
+            url, error=CircuitOpenError(f"circuit open for {host}"), rejected=True)
+
+    ###########################################################################################
+    # Function to record how a request went - its latency (successes only, so failures
+    # that return quickly don't pull the hedge delay down) and its breaker's state
+    ###########################################################################################
+    def record(self, result, breaker, latency):
+        failed = result.error is not None or (result.status is not None and result.status >= 500)
+        if not failed:
+            with self.lock:
+                self.latencies.append(latency)
+                self.newLatencies += 1
+        if breaker is not None:
+            if failed:
+                result.tripped = breaker.recordFailure()
+                if result.tripped:
+                    self.count("trips")
+            else:
+                breaker.recordSuccess()
+        if result.hedged:
+            self.count("hedges")
+        if result.hedgeWon:
+            self.count("hedgeWins")
+        return result
+
+    # a call stopped (cancelled, interrupted) before it had an outcome - a probe it was
+    # sending must not leave its breaker half-open for good
+    def abandon(self, breaker, state):
+        if state == CircuitBreaker.HALF_OPEN:
+            breaker.releaseProbe()
+
+    def deadlineExceeded(self, url):
+        self.count("deadlines")
+        return DownloadReporter.DownloadResult(
+            url, error=TimeoutError(f"no response within {self.deadline} seconds"))
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def statistics(self):
+        with self.lock:
+            stats = {name: self.stats[name]
+                     for name in ("hedges", "hedgeWins", "trips", "rejected", "deadlines")}
+            stats["hedgeDelay"] = self.hedgeDelayValue if self.hedgeAfter is None else self.hedgeAfter
+            stats["openBreakers"] = sorted(host for host, breaker in self.breakers.items()
+                                           if breaker.state != CircuitBreaker.CLOSED)
+        return stats
+
+    ###########################################################################################
+    # requests - fetch(session, timeout, deadline) downloads url with the session given
+    # and returns a DownloadResult (raising requests exceptions). timeout is the socket
+    # timeout - the time left before the deadline when the attempt starts - and deadline
+    # the time.perf_counter() time the body has to be read by. The socket timeout only
+    # bounds each read, so the body read itself is given up between chunks once the
+    # deadline passes (see URLDownloadStreaming.streamResponse) - an attempt ends at about
+    # the deadline, or at most one socket timeout later when the server stops sending
+    # altogether. Without hedging the attempt runs on the calling thread with the caller's
+    # session; with hedging both attempts run on the policy's threads, each with that
+    # thread's session, so the calling thread can wait for whichever answers first and
+    # carry on while the other is still reading
+    ###########################################################################################
+    def call(self, url, fetch, session, hedge=True):
+        breaker = self.getBreaker(url)
+        state = breaker.allow() if breaker is not None else None
+        if breaker is not None and not state:
+            return self.rejected(url)
+        startTime = time.perf_counter()
+        hedgeDelay = self.hedgeDelay() if hedge else None
+        deadline = startTime + self.deadline if self.deadline is not None else None
+        try:
+            if hedgeDelay is None:
+                result = self.attempt(url, fetch, session, deadline)
+                if deadline is not None and (result is None or time.perf_counter() > deadline):
+                    result = self.deadlineExceeded(url)
+            else:
+                result = self.callOnThreads(url, fetch, hedgeDelay, startTime, deadline)
+        except BaseException:
+            self.abandon(breaker, state)
+            raise
+        return self.record(result, breaker, time.perf_counter() - startTime)
+
+    # one attempt, given whatever time is left before the deadline - on one of the policy's
+    # threads the time spent waiting for the thread counts too. Returns None when there
+    # was no time left to send it. A session of None is an attempt on the policy's threads
+    # - it gets that thread's own session, as the call can return while the attempt is
+    # still reading and the caller's session would then be used by two threads at once
+    def attempt(self, url, fetch, session, deadline=None):
+        if session is None:
+            session = self.getThreadSession()
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                return None
+        try:
+            return fetch(session, timeout=timeout, deadline=deadline)
+        except (requests.RequestException, OSError) as error:
+            return DownloadReporter.DownloadResult(url, error=error)
+
+    def getThreadSession(self):
+        session = getattr(self.threadLocal, "session", None)
+        if session is None:
+            session = self.threadLocal.session = requests.Session()
+            with self.lock:
+                self.threadSessions.append(session)
+        return session
+
+    ###########################################################################################
+    # Function to make room on the policy's threads for callers threads calling at once - a
+    # hedged call holds two of them, so with fewer the attempts would queue for a thread
+    # and run out their deadline there. The engines call it with their number of threads
+    ###########################################################################################
+    def reserveThreads(self, callers):
+        with self.lock:
+            if callers * 2 <= self.maxWorkers:
+                return
+            self.maxWorkers = callers * 2
+            # calls already running keep using the old executor - it is shut down by close
+            if self.executor is not None:
+                self.retiredExecutors.append(self.executor)
+                self.executor = None
+
+    def getExecutor(self):
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = concurrent.futures.ThreadPoolExecutor(
+                        self.maxWorkers, thread_name_prefix="RequestPolicy")
+        return self.executor
+
+    def callOnThreads(self, url, fetch, hedgeDelay, startTime, deadline):
+        executor = self.getExecutor()
+        primary = executor.submit(self.attempt, url, fetch, None, deadline)
+        done, pending = set(), {primary}
+        hedgeFuture = None
+        if deadline is None or startTime + hedgeDelay < deadline:
+            done, pending = concurrent.futures.wait(pending, timeout=hedgeDelay)
+            if not done:
+                hedgeFuture = executor.submit(self.attempt, url, fetch, None, deadline)
+                pending = {primary, hedgeFuture}
+
+        result = None
+        while True:
+            for future in done:
+                candidate = future.result()
+                if candidate is None:
+                    continue
+                candidate.hedgeWon = future is hedgeFuture
+                # keep waiting for the other attempt while there is one when this one failed
+                if result is None or candidate.ok:
+                    result = candidate
+            if not pending or (result is not None and result.ok):
+                break
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                break
+            done, pending = concurrent.futures.wait(
+                pending, timeout=remaining, return_when=concurrent.futures.FIRST_COMPLETED)
+        # attempts still running can't be interrupted - they give up their body read once
+        # the deadline passes
+        if result is None:
+            result = self.deadlineExceeded(url)
+        result.hedged = hedgeFuture is not None
+        return result
+
+    ###########################################################################################
+    # asyncio - fetch() returns a coroutine that downloads url and returns a
+    # DownloadResult (raising aiohttp exceptions). Attempts that lose, or run past the
+    # deadline, are cancelled
+    ###########################################################################################
+    async def callAsync(self, url, fetch, hedge=True):
+        breaker = self.getBreaker(url)
+        state = breaker.allow() if breaker is not None else None
+        if breaker is not None and not state:
+            return self.rejected(url)
+        startTime = time.perf_counter()
+        hedgeDelay = self.hedgeDelay() if hedge else None
+        deadline = startTime + self.deadline if self.deadline is not None else None
+
+        primary = asyncio.ensure_future(self.attemptAsync(url, fetch))
+        done, pending = set(), {primary}
+        hedgeTask = None
+        result = None
+        try:
+            if hedgeDelay is not None and (deadline is None or startTime + hedgeDelay < deadline):
+                done, pending = await asyncio.wait(pending, timeout=hedgeDelay)
+                if not done:
+                    hedgeTask = asyncio.ensure_future(self.attemptAsync(url, fetch))
+                    pending = {primary, hedgeTask}
+
+            while True:
+                for task in done:
+                    candidate = task.result()
+                    candidate.hedgeWon = task is hedgeTask
+                    if result is None or candidate.ok:
+                        result = candidate
+                if not pending or (result is not None and result.ok):
+                    break
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            self.abandon(breaker, state)
+            raise
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if result is None:
+            result = self.deadlineExceeded(url)
+        result.hedged = hedgeTask is not None
+        return self.record(result, breaker, time.perf_counter() - startTime)
+
+    async def attemptAsync(self, url, fetch):
+        try:
+            return await fetch()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            return DownloadReporter.DownloadResult(url, error=error)
+        except asyncio.CancelledError as error:
+            # a cancellation this attempt wasn't sent (a future it awaited was cancelled by
+            # someone else) fails the attempt instead of the caller
+            if cancelRequested():
+                raise
+            return DownloadReporter.DownloadResult(url, error=error)
+
+    def close(self):
+        with self.lock:
+            executors = self.retiredExecutors + [self.executor]
+            sessions, self.threadSessions = self.threadSessions, []
+            self.retiredExecutors, self.executor = [], None
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=False)
+        for session in sessions:
+            session.close()
+
+
+###########################################################################################
+# Functions to add the policy's command line options to an argparse parser and to turn
+# the parsed options back into RequestPolicy settings (None when none were given)
+###########################################################################################
+def addArguments(parser):
+    parser.add_argument("--deadline", type=float, help="seconds a request may take in total")
+    parser.add_argument("--hedge", action="store_true",
+                        help="send a duplicate of requests slower than the p95 latency")
+    parser.add_argument("--hedge-after", type=float,
+                        help="hedge after this many seconds instead of the p95 latency")
+    parser.add_argument("--breaker-failures", type=int,
+                        help="failures in a row that open a host's circuit breaker")
+    parser.add_argument("--breaker-cooldown", type=float, default=30.0,
+                        help="seconds an open circuit breaker rejects requests")
+
+
+def settingsFromArguments(args):
+    hedge = args.hedge or args.hedge_after is not None
+    if args.deadline is None and not hedge and args.breaker_failures is None:
+        return None
+    return {"deadline": args.deadline, "hedge": hedge, "hedgeAfter": args.hedge_after,
+            "breakerFailures": args.breaker_failures, "breakerCooldown": args.breaker_cooldown}
+
+
+# policies unpickled in this process, keyed by the policy they were pickled from, so that
+# every task a pool worker runs shares one set of breakers and latencies
+openPolicies = {}
+openPoliciesLock = threading.Lock()
+
+
+###########################################################################################
+# Function to return this process's copy of the policy with key, creating it the first time
+#
+# Pool workers live on from one run to the next (see WarmWorkerPool) and run one task at
+# a time, so once a task brings a policy with a new key the runs that used the others are
+# over - they are closed then, instead of leaving their threads and sessions open for as
+# long as the worker lives. A later task with one of their keys gets a fresh copy
+###########################################################################################
+def openPolicy(key, settings):
+    with openPoliciesLock:
+        policy = openPolicies.get(key)
+        if policy is not None:
+            return policy
+        finished = list(openPolicies.values())
+        openPolicies.clear()
+        policy = openPolicies[key] = RequestPolicy(key=key, **settings)
+    for oldPolicy in finished:
+        oldPolicy.close()
+    return policy
@@ -0,0 +1,314 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Per-Request Timing Instrumentation
+#
+# The samples only print the total duration of a run, which can't tell a slow DNS
+# server from slow connection setup or a slow transfer. This module times each request
+# in phases:
+#
+#   dns      - resolving the host name
+#   connect  - opening the TCP connection (0 when a kept-alive connection is reused)
+#   tls      - the TLS handshake
+#   ttfb     - time to first byte: from sending the request until the response headers
+#              arrive (includes dns, connect and tls when a new connection was needed)
+#   transfer - reading the body
+#   total    - the whole request
+#
+# For aiohttp, createTraceConfig hooks into aiohttp's TraceConfig signals; aiohttp opens
+# the connection and does the TLS handshake in one step, so tls is folded into connect.
+# For requests, instrumentSession mounts a TimingAdapter whose connections time
+# themselves; urllib3 resolves and connects in one call, so dns is folded into connect.
+# Phases that can't be measured are recorded as nan.
+#
+# Recording has to be cheap enough to leave switched on: each finished request is one
+# array.extend of seven doubles into a TimingRecorder (no per-request objects are kept),
+# which holds the GIL for its whole duration and so needs no lock
+###########################################################################################
+
+import array
+import math
+import threading
+import time
+import urllib.parse
+
+import aiohttp
+import requests.adapters
+import urllib3
+import urllib3.connection
+
+import PerformanceStats
+
+PHASES = ("dns", "connect", "tls", "ttfb", "transfer", "total")
+# each recorded row is the host id followed by the phases
+ROW_SIZE = 1 + len(PHASES)
+
+# histogram bucket upper bounds in milliseconds
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, math.inf)
+
+
+###########################################################################################
+# Timing of one request while it is in flight
+###########################################################################################
+class TimingRecord:
+    __slots__ = ("host", "start", "dns", "connect", "tls", "ttfb")
+
+    def __init__(self, url):
+        self.host = urllib.parse.urlsplit(url).netloc
+        self.start = time.perf_counter()
+        self.dns = math.nan
+        self.connect = 0.0
+        self.tls = math.nan
+        self.ttfb = math.nan
+
+
+###########################################################################################
+# Function to close off a request once its body has been read, returning its row of
+# (host, dns, connect, tls, ttfb, transfer, total) - transfer is the time since the
+# headers arrived and total the time since the request started
+###########################################################################################
+def finishRow(record):
+    total = time.perf_counter() - record.start
+    ttfb = record.ttfb if record.ttfb == record.ttfb else total
+    return (record.host, record.dns, record.connect, record.tls, ttfb, total - ttfb, total)
+
+
+###########################################################################################
+# Compact store of finished requests for one strategy - a flat array of doubles, one
+# row of ROW_SIZE values per request, plus the table of host names the rows refer to
+###########################################################################################
+class TimingRecorder:
+    def __init__(self, strategy=""):
+        self.strategy = strategy
+        self.values = array.array("d")
+        self.hostNames = []
+        self.hostIds = {}
+        self.hostLock = threading.Lock()
+
+    def hostId(self, host):
+        hostId = self.hostIds.get(host)
+        if hostId is None:
+            with self.hostLock:
+                hostId = self.hostIds.get(host)
+                if hostId is None:
+                    hostId = self.hostIds[host] = len(self.hostNames)
+                    self.hostNames.append(host)
+        return hostId
+
+    # record a request straight from its phases (seconds)
+    def add(self, host, dns, connect, tls, ttfb, transfer, total):
+        self.values.extend((self.hostId(host), dns, connect, tls, ttfb, transfer, total))
+
+    # record a request once its body has been read, returning its row
+    def finish(self, record):
+        if record is None:
+            return None
+        row = finishRow(record)
+        self.add(*row)
+        return row
+
+    def clear(self):
+        del self.values[:]
+
+    def __len__(self):
+        return len(self.values) // ROW_SIZE
+
+    ###########################################################################################
+    # Functions to move rows between processes - rows() returns picklable (host, phases...)
+    # tuples and addRows() records them
+    ###########################################################################################
+    def rows(self):
+        values = self.values
+        return [(self.hostNames[int(values[i])],) + tuple(values[i + 1:i + ROW_SIZE])
+                for i in range(0, len(values), ROW_SIZE)]
+
+    def addRows(self, rows):
+        for row in rows:
+            self.add(*row)
+
+    # the values of one phase (seconds), optionally for one host only
+    def phaseValues(self, phase, host=None):
+        offset = 1 + PHASES.index(phase)
+        values = self.values
+        hostId = None if host is None else self.hostIds.get(host, -1)
+        return [values[i + offset] for i in range(0, len(values), ROW_SIZE)
+                if (hostId is None or values[i] == hostId) and values[i + offset] == values[i + offset]]
+
+    ###########################################################################################
+    # Function to return percentiles (PerformanceStats.summarizeLatencies) of every phase,
+    # for all hosts together ("all") and for each host
+    ###########################################################################################
+    def summary(self):
+        hosts = [None] + list(self.hostNames)
+        return {host or "all": {phase: PerformanceStats.summarizeLatencies(self.phaseValues(phase, host))
+                                for phase in PHASES}
+                for host in hosts}
+
+    ###########################################################################################
+    # Function to return the histogram of a phase as (upper bound ms, count) pairs
+    ###########################################################################################
+    def histogram(self, phase="total", host=None, buckets=HISTOGRAM_BUCKETS_MS):
+        counts = [0] * len(buckets)
+        for value in self.phaseValues(phase, host):
+            milliseconds = value * 1000
+            for index, bound in enumerate(buckets):
+                if milliseconds <= bound:
+                    counts[index] += 1
+                    break
+        return list(zip(buckets, counts))
+
+    def toDict(self):
+        return {"strategy": self.strategy, "requests": len(self), "summary": self.summary(),
+                "histogram": [(str(bound), count) for bound, count in self.histogram()]}
+
+    def report(self):
+        return formatSummaries([(self.strategy, self.summary())])
+
+
+###########################################################################################
+# Function to format (strategy, summary) pairs as a table of the p50/p95/p99 of every
+# phase in milliseconds, with a row per strategy and host
+###########################################################################################
+def formatSummaries(summaries):
+    header = ["strategy", "host", "requests"] + [f"{phase} p50/p95/p99 ms" for phase in PHASES]
+    rows = []
+    for strategy, summary in summaries:
+        for host, phases in summary.items():
+            row = [strategy, host, phases["total"]["count"]]
+            for phase in PHASES:
+                stats = phases[phase]
+                if stats["count"]:
+                    row.append("/".join(f"{stats[p] * 1000:.1f}" for p in ("p50", "p95", "p99")))
+                else:
+                    row.append("-")
+            rows.append(row)
+    return PerformanceStats.formatTable(header, rows)
+
+
+###########################################################################################
+# aiohttp - pass a TimingRecord as trace_request_ctx to session.get and the signals fill
+# in its phases; call recorder.finish(record) once the body has been read
+###########################################################################################
+def createTraceConfig():
+    # a request on a kept-alive connection never resolves the host at all
+    async def onRequestStart(session, context, params):
+        record = context.trace_request_ctx
+        if record is not None:
+            record.dns = 0.0
+
+    async def onDnsStart(session, context, params):
+        context.dnsStart = time.perf_counter()
+
+    async def onDnsEnd(session, context, params):
+        record = context.trace_request_ctx
+        if record is not None:
+            record.dns = time.perf_counter() - context.dnsStart
+
+    async def onDnsCacheHit(session, context, params):
+        record = context.trace_request_ctx
+        if record is not None:
+            record.dns = 0.0
+
+    async def onConnectionStart(session, context, params):
+        context.connectStart = time.perf_counter()
+
+    async def onConnectionEnd(session, context, params):
+        record = context.trace_request_ctx
+        if record is not None:
+            # the resolve happens inside connection creation - don't count it twice
+            dns = record.dns if record.dns == record.dns else 0.0
+            record.connect = time.perf_counter() - context.connectStart - dns
+
+    async def onRequestEnd(session, context, params):
+        record = context.trace_request_ctx
+        if record is not None:
+            record.ttfb = time.perf_counter() - record.start
+
+    traceConfig = aiohttp.TraceConfig()
+    traceConfig.on_request_start.append(onRequestStart)
+    traceConfig.on_dns_resolvehost_start.append(onDnsStart)
+    traceConfig.on_dns_resolvehost_end.append(onDnsEnd)
+    traceConfig.on_dns_cache_hit.append(onDnsCacheHit)
+    traceConfig.on_connection_create_start.append(onConnectionStart)
+    traceConfig.on_connection_create_end.append(onConnectionEnd)
+    traceConfig.on_request_end.append(onRequestEnd)
+    return traceConfig
+
+
+###########################################################################################
+# requests - connections time themselves into the record of the request the thread is
+# currently sending (a connection is always opened on the thread sending the request)
+###########################################################################################
+currentRequest = threading.local()
+
+
+class TimedHTTPConnection(urllib3.connection.HTTPConnection):
+    def _new_conn(self):
+        startTime = time.perf_counter()
+        sock = super()._new_conn()
+        record = getattr(currentRequest, "record", None)
+        if record is not None:
+            record.connect = time.perf_counter() - startTime
+        return sock
+
+
+class TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def _new_conn(self):
+        startTime = time.perf_counter()
+        sock = super()._new_conn()
+        record = getattr(currentRequest, "record", None)
+        if record is not None:
+            record.connect = time.perf_counter() - startTime
+        return sock
+
+    # connect() is _new_conn() followed by the handshake - the rest of it is TLS
+    def connect(self):
+        startTime = time.perf_counter()
+        super().connect()
+        record = getattr(currentRequest, "record", None)
+        if record is not None:
+            record.tls = time.perf_counter() - startTime - record.connect
+
+
+class TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+###########################################################################################
+# Adapter that starts a TimingRecord for every request and attaches it to the response
+# as response.timing once the headers have arrived - pass that to recorder.finish once
+# the body has been read
+###########################################################################################
+class TimingAdapter(requests.adapters.HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool,
+                                                   "https": TimedHTTPSConnectionPool}
+
+    def send(self, request, *args, **kwargs):
+        record = currentRequest.record = TimingRecord(request.url)
+        try:
+            response = super().send(request, *args, **kwargs)
+        finally:
+            currentRequest.record = None
+        record.ttfb = time.perf_counter() - record.start
+        response.timing = record
+        return response
+
+
+###########################################################################################
+# Function to mount TimingAdapters on a requests session, keeping the connection pool
+# sizes of the adapters it replaces. Instrumenting a session twice does nothing
+###########################################################################################
+def instrumentSession(session):
+    for prefix in ("http://", "https://"):
+        adapter = session.get_adapter(prefix)
+        if isinstance(adapter, TimingAdapter):
+            continue
+        session.mount(prefix, TimingAdapter(pool_connections=adapter._pool_connections,
+                                            pool_maxsize=adapter._pool_maxsize,
+                                            max_retries=adapter.max_retries,
+                                            pool_block=adapter._pool_block))
+    return session
@@ -0,0 +1,157 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Sum of Squares Compute Kernels
+#
+# The CPU bound sample adds up i * i for every i in range(number). Running more
+# processes is one way to make that faster; doing less work per number is another:
+#
+# - python: the pure Python generator - the reference every other kernel is checked against
+# - numpy: the same sum vectorized in chunks. Each chunk is summed in int64, so chunks
+#   are kept small enough that their sum cannot overflow; once that would make them
+#   smaller than NUMPY_MIN_INT64_CHUNK values the chunks fall back to Python integers
+#   (dtype=object)
+# - closedform: the exact formula (n - 1) * n * (2n - 1) / 6 - no loop at all
+#
+# NumPy is optional - the numpy kernel is only available when it is installed
+#
+# Every kernel also comes in a range form, sum(i * i for i in range(start, stop)), so one
+# number's work can be split into sub-ranges and the partial sums added back together
+###########################################################################################
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+INT64_MAX = 2 ** 63 - 1
+NUMPY_CHUNK_SIZE = 1 << 20
+# int64 chunks smaller than this are slower than summing Python integers
+NUMPY_MIN_INT64_CHUNK = 4096
+
+
+###########################################################################################
+# Function to return sum of squares - the pure Python reference
+###########################################################################################
+def sumOfSquaresPython(number):
+    return sum(i * i for i in range(number))
+
+
+def sumOfSquaresPythonRange(start, stop):
+    return sum(i * i for i in range(start, stop))
+
+
+###########################################################################################
+# Function to return sum of squares from the closed form of sum(i * i for i < n)
+###########################################################################################
+def sumOfSquaresClosedForm(number):
+    if number <= 0:
+        return 0
+    return (number - 1) * number * (2 * number - 1) // 6
+
+
+# negative i square to the same values as -i, so a range reaching below 0 is summed as
+# the squares of 1..-start plus those of the part from 0 up
+def sumOfSquaresClosedFormRange(start, stop):
+    if stop <= start:
+        return 0
+    if start >= 0:
+        return sumOfSquaresClosedForm(stop) - sumOfSquaresClosedForm(start)
+    if stop <= 0:
+        return sumOfSquaresClosedForm(1 - start) - sumOfSquaresClosedForm(1 - stop)
+    return sumOfSquaresClosedForm(1 - start) + sumOfSquaresClosedForm(stop)
+
+
+###########################################################################################
+# Function to return sum of squares with NumPy, summing chunkSize values at a time
+###########################################################################################
+def sumOfSquaresNumpy(number, chunkSize=NUMPY_CHUNK_SIZE):
+    return sumOfSquaresNumpyRange(0, number, chunkSize)
+
+
+def sumOfSquaresNumpyRange(start, stop, chunkSize=NUMPY_CHUNK_SIZE):
+    if numpy is None:
+        raise RuntimeError("the numpy kernel needs NumPy installed")
+    if stop <= start:
+        return 0
+
+    # the sum of a chunk is at most chunk * largestSquare - keep that inside int64. Past
+    # about 1e8 that shrinks the chunks towards a single value (one numpy call per number),
+    # so once they would be smaller than NUMPY_MIN_INT64_CHUNK use Python integers instead
+    largestSquare = max(start * start, (stop - 1) ** 2)
+    int64ChunkSize = INT64_MAX // max(1, largestSquare)
+    if int64ChunkSize < min(chunkSize, NUMPY_MIN_INT64_CHUNK):
+        dtype = object
+    else:
+        dtype = numpy.int64
+        chunkSize = min(chunkSize, int64ChunkSize)
+
+    total = 0
+    for chunkStart in range(start, stop, chunkSize):
+        values = numpy.arange(chunkStart, min(chunkStart + chunkSize, stop), dtype=dtype)
+        total += int(numpy.dot(values, values))
+    return total
+
+
+# kernels by the name used to select them
+KERNELS = {
+    "python": sumOfSquaresPython,
+    "numpy": sumOfSquaresNumpy,
+    "closedform": sumOfSquaresClosedForm,
+}
+
+# the same kernels in their range form
+RANGE_KERNELS = {
+    "python": sumOfSquaresPythonRange,
+    "numpy": sumOfSquaresNumpyRange,
+    "closedform": sumOfSquaresClosedFormRange,
+}
+
+REFERENCE_KERNEL = "python"
+
+
+###########################################################################################
+# Function to return the kernel for name, checking that it can run here
+###########################################################################################
+def getKernel(name):
+    checkKernel(name)
+    return KERNELS[name]
+
+
+def getRangeKernel(name):
+    checkKernel(name)
+    return RANGE_KERNELS[name]
+
+
+def checkKernel(name):
+    if name not in KERNELS:
+        raise ValueError(f"unknown sum of squares kernel {name!r} - choose from {', '.join(KERNELS)}")
+    if name == "numpy" and numpy is None:
+        raise RuntimeError("the numpy kernel needs NumPy installed")
+
+
+###########################################################################################
+# Function run by the parallel workers to sum one sub-range - task is (kernel name, index,
+# start, stop) and index comes back with the partial sum. It lives here, away from the
+# download code, so a worker only has to import this module to run it
+###########################################################################################
+def sumOfSquaresSubRange(task):
+    name, index, start, stop = task
+    return index, getRangeKernel(name)(start, stop)
+
+
+###########################################################################################
+# Function to return the names of the kernels that can run here
+###########################################################################################
+def availableKernels():
+    return [name for name in KERNELS if name != "numpy" or numpy is not None]
+
+
+###########################################################################################
+# Function to check a kernel's results against the reference kernel, raising a
+# RuntimeError naming the first number it got wrong
+###########################################################################################
+def verifyResults(name, numbers, results):
+    reference = KERNELS[REFERENCE_KERNEL]
+    for number, result in zip(numbers, results):
+        expected = reference(number)
+        if result != expected:
+            raise RuntimeError(f"{name} kernel returned {result} for {number}, expected {expected}")
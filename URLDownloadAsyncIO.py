@@ -14,35 +14,244 @@
 
 import aiohttp
 import asyncio
+import collections.abc
+import functools
+import itertools
 import time
 
+import ConcurrencyProfiler
+import DownloadReporter
+import RequestTiming
+
+# read bodies in 64KiB chunks and by default run 100 workers with at most 10 connections
+# open to any one host
+CHUNK_SIZE = 64 * 1024
+DEFAULT_CONCURRENCY = 100
+DEFAULT_LIMIT_PER_HOST = 10
+
+# urls read from a non-sequence input per trip to the reader thread
+READ_BATCH_SIZE = 256
+
 
 ###########################################################################################
-# Function to download a web page asynchronously
+# Function to download a web page asynchronously - only the headers are waited for, so
+# the size is the Content-Length. An optional RequestPolicy.RequestPolicy adds a deadline,
+# hedging and circuit breakers. Returns a DownloadReporter.DownloadResult; a failed
+# request is returned, not raised
 ###########################################################################################
-async def downloadSite(session, url):
-    async with session.get(url) as response:
-        print("Read {0} from {1}".format(response.content_length, url))
+async def downloadSite(session, url, cache=None, recorder=None, policy=None):
+    fetch = functools.partial(fetchSite, session, url, cache, recorder)
+    return await timedDownload(url, fetch, policy)
+
+
+# run fetch (directly or through the policy), recording the seconds it took as the
+# result's latency
+async def timedDownload(url, fetch, policy=None):
+    startTime = time.perf_counter()
+    if policy is not None:
+        result = await policy.callAsync(url, fetch)
+    else:
+        try:
+            result = await fetch()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            result = DownloadReporter.DownloadResult(url, error=error)
+    result.latency = time.perf_counter() - startTime
+    return result
+
+
+# one attempt at downloading a web page - raises when the request fails
+async def fetchSite(session, url, cache=None, recorder=None):
+    if cache is not None:
+        result = await cache.fetchAsync(url, session)
+        return DownloadReporter.DownloadResult(url, result.status, result.size, result.source)
+    record = RequestTiming.TimingRecord(url) if recorder is not None else None
+    async with session.get(url, trace_request_ctx=record) as response:
+        status, size = response.status, response.content_length
+    timing = recorder.finish(record) if recorder is not None else None
+    return DownloadReporter.DownloadResult(url, status, size, timing=timing)
 
 
 ###########################################################################################
-# Function to download a series of web pages asynchronously
+# Helper function to create the session - with a recorder, aiohttp's trace signals time
+# the phases of every request (see RequestTiming)
 ###########################################################################################
-async def downloadAllSites(sites):
+def createSession(recorder=None, **kwargs):
+    if recorder is not None:
+        kwargs["trace_configs"] = [RequestTiming.createTraceConfig()]
+    return aiohttp.ClientSession(**kwargs)
+
+
+###########################################################################################
+# Function to download a series of web pages asynchronously, handing each result to the
+# optional DownloadReporter.Reporter once they have all finished. Returns the results
+###########################################################################################
+async def downloadAllSites(sites, cache=None, recorder=None, reporter=None, policy=None):
     # share the session across all tasks as they are running in the same thread
-    async with aiohttp.ClientSession() as session:
+    async with createSession(recorder) as session:
         tasks = []
+        urls = []
         for url in sites:
             # create a list of tasks, one for each site 
             # tasks take far fewer resources and less time to create than threads
             # creating and running more of them works well so they scale better than threads
-            task = asyncio.ensure_future(downloadSite(session, url))
+            task = asyncio.ensure_future(downloadSite(session, url, cache, recorder, policy))
+            urls.append(url)
             tasks.append(task)
         # keep session context alive until all of the tasks have completed; schedule the tasks
-        # concurrently - pause here and come back here when gather is ready
-        await asyncio.gather(*tasks, return_exceptions=True)
+        # concurrently - pause here and come back here when gather is ready. With a
+        # ConcurrencyProfiler running, the loop's lag and the tasks still running are recorded
+        with ConcurrencyProfiler.watchLoop("asyncio"), ConcurrencyProfiler.watch(
+                "asyncio", depth=lambda: sum(not task.done() for task in tasks)):
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+    # downloadSite returns failed requests as results - anything raised here is unexpected,
+    # but it is still reported rather than dropped
+    for index, (url, result) in enumerate(zip(urls, results)):
+        if isinstance(result, BaseException):
+            results[index] = result = DownloadReporter.DownloadResult(url, error=result)
+        if reporter is not None:
+            reporter.report(result)
+    return results
+
+
+###########################################################################################
+# Function to download a web page asynchronously, reading the whole body in fixed-size
+# chunks so that the time measured is the download and not just the response headers.
+# With a cache, the response comes from URLDownloadCache.ResponseCache instead.
+# Returns a DownloadReporter.DownloadResult; a failed request is returned, not raised
+###########################################################################################
+async def downloadSiteStreaming(session, url, chunkSize=CHUNK_SIZE, recorder=None, cache=None,
+                                policy=None):
+    fetch = functools.partial(fetchSiteStreaming, session, url, chunkSize, recorder, cache)
+    return await timedDownload(url, fetch, policy)
+
+
+# one attempt at downloading a web page in chunks - raises when the request fails
+async def fetchSiteStreaming(session, url, chunkSize=CHUNK_SIZE, recorder=None, cache=None):
+    if cache is not None:
+        result = await cache.fetchAsync(url, session, chunkSize=chunkSize)
+        return DownloadReporter.DownloadResult(url, result.status, result.size, result.source)
+    record = RequestTiming.TimingRecord(url) if recorder is not None else None
+    async with session.get(url, trace_request_ctx=record) as response:
+        size = 0
+        while True:
+            chunk = await response.content.read(chunkSize)
+            if not chunk:
+                break
+            size += len(chunk)
+    timing = recorder.finish(record) if recorder is not None else None
+    return DownloadReporter.DownloadResult(url, response.status, size, timing=timing)
 
 
+###########################################################################################
+# Async generator over sites. Lists (and other sequences) are already in memory and are
+# iterated directly; anything else - a generator reading a file or stdin, say - is read
+# on a thread, as a blocking read on the event loop would stall every download in flight
+# for as long as the producer on the other end takes. The thread reads READ_BATCH_SIZE
+# urls per trip, so the hop to it isn't paid for every url of a long input
+###########################################################################################
+async def iterateSites(sites, batchSize=READ_BATCH_SIZE):
+    if isinstance(sites, collections.abc.Sequence):
+        for url in sites:
+            yield url
+        return
+    loop = asyncio.get_running_loop()
+    iterator = iter(sites)
+    while True:
+        batch = await loop.run_in_executor(None, list, itertools.islice(iterator, batchSize))
+        for url in batch:
+            yield url
+        if len(batch) < batchSize:
+            return
+
+
+# what a RequestPolicy did, counted from the results' flags
+POLICY_COUNTS = ("hedges", "hedgeWins", "trips", "rejected")
+
+def countPolicy(counts, result):
+    counts["hedges"] += result.hedged
+    counts["hedgeWins"] += result.hedgeWon
+    counts["trips"] += result.tripped
+    counts["rejected"] += result.rejected
+
+
+###########################################################################################
+# Worker - pull urls off the queue until the None sentinel arrives. Errors are counted
+# per url so one failing site does not stop the worker - that includes anything else a
+# url raises (e.g., an OSError from the cache's disk), as a worker that died would leave
+# the producer waiting on a full queue for good. With a cache, the source of each
+# response (hit, miss, ...) is counted in totals["cache"], and with a policy what it did
+# (hedges, breaker trips, ...) in totals["policy"]
+###########################################################################################
+async def downloadWorker(session, queue, totals, chunkSize, cache, recorder, reporter, policy):
+    while True:
+        url = await queue.get()
+        try:
+            if url is None:
+                return
+            try:
+                result = await downloadSiteStreaming(session, url, chunkSize, recorder, cache,
+                                                     policy)
+            except Exception as error:
+                result = DownloadReporter.DownloadResult(url, error=error)
+            if result.error is not None:
+                totals["errors"] += 1
+            else:
+                totals["downloaded"] += 1
+                totals["bytes"] += result.size
+            if result.source is not None:
+                totals["cache"][result.source] = totals["cache"].get(result.source, 0) + 1
+            if policy is not None:
+                countPolicy(totals["policy"], result)
+            if reporter is not None:
+                reporter.report(result)
+        finally:
+            queue.task_done()
+
+
+###########################################################################################
+# Function to download a series of web pages asynchronously with bounded concurrency
+#
+# Instead of creating one task per url up front, a fixed number of workers pull urls from
+# a bounded queue. Memory stays flat no matter how many urls are passed in (sites can be
+# any iterable, including a generator) and the connector caps the number of open
+# connections overall (concurrency) and to any one host (limitPerHost). An optional
+# URLDownloadCache.ResponseCache serves repeated urls from disk, an optional
+# RequestTiming.TimingRecorder records the phase timings of every request and an
+# optional DownloadReporter.Reporter is handed each result as it finishes. An optional
+# RequestPolicy.RequestPolicy adds a deadline, hedging and circuit breakers - hedges
+# share the connector's limits with everything else. With a ConcurrencyProfiler running,
+# the loop's lag and the urls queued are recorded as the run goes.
+# Returns a dictionary with the number of sites downloaded, bytes read and errors
+###########################################################################################
+async def downloadAllSitesBounded(sites, concurrency=DEFAULT_CONCURRENCY,
+                                  limitPerHost=DEFAULT_LIMIT_PER_HOST, chunkSize=CHUNK_SIZE,
+                                  cache=None, recorder=None, reporter=None, policy=None):
+    totals = {"downloaded": 0, "bytes": 0, "errors": 0}
+    if cache is not None:
+        totals["cache"] = {}
+    if policy is not None:
+        totals["policy"] = dict.fromkeys(POLICY_COUNTS, 0)
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=limitPerHost)
+    async with createSession(recorder, connector=connector) as session:
+        # a small multiple of the worker count keeps the workers fed without buffering
+        # the whole list of urls
+        queue = asyncio.Queue(maxsize=concurrency * 2)
+        workers = [asyncio.create_task(downloadWorker(session, queue, totals, chunkSize, cache,
+                                                      recorder, reporter, policy))
+                   for _ in range(concurrency)]
+        try:
+            with ConcurrencyProfiler.watchLoop("asyncio"), \
+                    ConcurrencyProfiler.watch("asyncio", depth=queue.qsize):
+                async for url in iterateSites(sites):
+                    await queue.put(url)
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+    return totals
+
 
 ###########################################################################################
 # Function to download a series of web pages asynchronously using asyncio
@@ -52,11 +261,10 @@ def testConcurrency3IOBoundAsyncIO():
         "https://www.jython.org",
         "http://olympus.realpython.org/dice",
     ] * 80
-    startTime = time.time()
+    with DownloadReporter.Reporter(DownloadReporter.PROGRESS) as reporter:
+        startTime = time.time()
 
-    # start up the event loop and tell it the tasks to run
-    asyncio.run(downloadAllSites(sites))
-    time.sleep(3)
+        # start up the event loop and tell it the tasks to run
+        asyncio.run(downloadAllSites(sites, reporter=reporter))
     duration = time.time() - startTime
     print(f"\nPERFORMANCE: Downloaded {len(sites)} sites in {duration} seconds")
-
@@ -0,0 +1,584 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Sample - Shared On-Disk Response Cache
+#
+# The samples download the same couple of urls over and over ([...] * 80), and real
+# crawls repeat themselves too. The cache turns those repeats into one download plus
+# cheap revalidations (a 304 Not Modified carries no body) or no request at all:
+#
+# - single-flight: identical requests already in flight are not sent again - the
+#   duplicates wait for the first one and share its result
+# - bodies are stored on disk under the sha256 of their content, so urls that return
+#   the same body share one file, next to one small metadata file per url
+# - the index is kept in least recently used order and the oldest urls are evicted once
+#   the bodies on disk exceed maxBytes
+# - stored responses are revalidated with If-None-Match / If-Modified-Since once they are
+#   older than their Cache-Control max-age (or defaultTtl when the server sent none)
+#
+# The same cache works for requests (fetch) and aiohttp (fetchAsync) sessions. Several
+# processes can share a directory - everything on disk is written to a temporary file
+# and renamed into place, and a body removed by another process is simply a miss. A body
+# is opened under the cache's lock before it is read, so an eviction on another thread
+# can't remove it in between.
+# Pickling a cache (e.g., passing it to a multiprocessing pool) sends only its settings;
+# each process then reopens the directory with openCache
+###########################################################################################
+
+import asyncio
+import collections
+import email.utils
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import RequestPolicy
+import URLDownloadStreaming
+
+# every response seen by the cache is reported with one of these sources
+HIT = "hit"
+REVALIDATED = "revalidated"
+MISS = "miss"
+UNCACHEABLE = "uncacheable"
+COALESCED = "coalesced"
+
+# body bytes read from an aiohttp response before they are written to disk on a thread
+ASYNC_WRITE_BATCH = 1024 * 1024
+
+
+###########################################################################################
+# Metadata for one cached url
+###########################################################################################
+class CacheEntry:
+    __slots__ = ("url", "digest", "size", "etag", "lastModified", "expires")
+
+    def __init__(self, url, digest, size, etag=None, lastModified=None, expires=0.0):
+        self.url = url
+        self.digest = digest
+        self.size = size
+        self.etag = etag
+        self.lastModified = lastModified
+        self.expires = expires
+
+    def isFresh(self):
+        return time.time() < self.expires
+
+    def toDict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+###########################################################################################
+# Outcome of a fetch - the body size and where it came from (one of the sources above).
+# entry is the cache entry holding the body, or None when the response was not stored
+###########################################################################################
+class CacheResult:
+    __slots__ = ("url", "status", "size", "source", "entry")
+
+    def __init__(self, url, status, size, source, entry=None):
+        self.url = url
+        self.status = status
+        self.size = size
+        self.source = source
+        self.entry = entry
+
+
+###########################################################################################
+# Sink that writes a body to a temporary file in the cache while hashing it, so the file
+# can be renamed to its content address once the body is complete
+###########################################################################################
+class BlobSink:
+    def __init__(self, directory):
+        handle, self.path = tempfile.mkstemp(dir=directory, suffix=".part")
+        self.file = os.fdopen(handle, "wb")
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        self.hash.update(chunk)
+        self.size += self.file.write(chunk)
+
+    def close(self):
+        self.file.close()
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+###########################################################################################
+# Sink that passes every chunk on to several sinks (the cache's and the caller's)
+###########################################################################################
+class TeeSink:
+    def __init__(self, *sinks):
+        self.sinks = [sink for sink in sinks if sink is not None]
+
+    def write(self, chunk):
+        for sink in self.sinks:
+            sink.write(chunk)
+
+    def writeAll(self, chunks):
+        for chunk in chunks:
+            self.write(chunk)
+
+    def close(self):
+        pass
+
+
+###########################################################################################
+# Function to work out how long a response may be served without revalidating, from its
+# Cache-Control header. Returns None when it must not be stored at all
+###########################################################################################
+def freshnessLifetime(headers, defaultTtl):
+    directives = {}
+    for part in headers.get("Cache-Control", "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"')
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0.0
+    if "max-age" in directives:
+        try:
+            return max(0.0, float(directives["max-age"]))
+        except ValueError:
+            return 0.0
+    return defaultTtl
+
+
+###########################################################################################
+# The cache itself - safe to share between the threads of a process
+###########################################################################################
+class ResponseCache:
+    def __init__(self, directory, maxBytes=256 * 1024 * 1024, defaultTtl=0.0):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.defaultTtl = defaultTtl
+        self.blobDirectory = os.path.join(directory, "blobs")
+        self.metaDirectory = os.path.join(directory, "meta")
+        self.tempDirectory = os.path.join(directory, "tmp")
+        for path in (self.blobDirectory, self.metaDirectory, self.tempDirectory):
+            os.makedirs(path, exist_ok=True)
+
+        # one lock guards the index, the reference counts, the statistics and the table
+        # of requests in flight - it is never held while waiting on the network
+        self.lock = threading.RLock()
+        self.index = collections.OrderedDict()
+        self.references = collections.Counter()
+        self.totalBytes = 0
+        self.inFlight = {}
+        self.asyncInFlight = {}
+        self.stats = collections.Counter()
+        self.loadIndex()
+
+    # send only the settings when pickled - the receiving process reopens the directory
+    def __reduce__(self):
+        return (openCache, (self.directory, self.maxBytes, self.defaultTtl))
+
+    ###########################################################################################
+    # Helper functions for the on-disk layout
+    ###########################################################################################
+    def blobPath(self, digest):
+        return os.path.join(self.blobDirectory, digest[:2], digest)
+
+    def metaPath(self, url):
+        return os.path.join(self.metaDirectory, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    # write a file atomically - readers (in any process) see the old file or the new one
+    def writeAtomically(self, path, data):
+        handle, tempPath = tempfile.mkstemp(dir=self.tempDirectory)
+        with os.fdopen(handle, "w") as output:
+            output.write(data)
+        os.replace(tempPath, path)
+
+    ###########################################################################################
+    # Function to rebuild the in-memory index from the metadata files, least recently used
+    # first (metadata files are touched whenever their url is served from the cache)
+    ###########################################################################################
+    def loadIndex(self):
+        loaded = []
+        for name in os.listdir(self.metaDirectory):
+            path = os.path.join(self.metaDirectory, name)
+            try:
+                with open(path) as metaFile:
+                    entry = CacheEntry(**json.load(metaFile))
+                loaded.append((os.path.getmtime(path), entry))
+            except (OSError, ValueError, TypeError):
+                continue
+        for _, entry in sorted(loaded, key=lambda item: item[0]):
+            self.addToIndex(entry)
+
+    def addToIndex(self, entry):
+        previous = self.index.pop(entry.url, None)
+        if previous is not None:
+            self.releaseBlob(previous.digest)
+        self.index[entry.url] = entry
+        if self.references[entry.digest] == 0:
+            self.totalBytes += entry.size
+        self.references[entry.digest] += 1
+
+    def releaseBlob(self, digest):
+        self.references[digest] -= 1
+        if self.references[digest] > 0:
+            return False
+        del self.references[digest]
+        return True
+
+    ###########################################################################################
+    # Function to return the entry for url (marking it most recently used) and its body,
+    # open for reading - or (None, None). An entry whose body has gone (evicted by another
+    # process) is dropped and reported as (None, None). The caller closes the body
+    ###########################################################################################
+    def lookup(self, url):
+        with self.lock:
+            entry = self.index.get(url)
+            if entry is None:
+                return None, None
+            body = self.openBody(entry)
+            if body is None:
+                self.removeEntry(entry, removeBlob=False)
+                return None, None
+            self.index.move_to_end(url)
+        try:
+            os.utime(self.metaPath(url))
+        except OSError:
+            pass
+        return entry, body
+
+    # open an entry's body, or return None when it has gone. Opened under the lock, so
+    # evict() can't remove it in between - once open, it can be read to the end
+    def openBody(self, entry):
+        with self.lock:
+            try:
+                return open(self.blobPath(entry.digest), "rb")
+            except OSError:
+                return None
+
+    def removeEntry(self, entry, removeBlob=True):
+        self.index.pop(entry.url, None)
+        unreferenced = self.releaseBlob(entry.digest)
+        if unreferenced:
+            self.totalBytes -= entry.size
+        paths = [self.metaPath(entry.url)]
+        if unreferenced and removeBlob:
+            paths.append(self.blobPath(entry.digest))
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # evict least recently used urls until the bodies fit in maxBytes again
+    def evict(self):
+        with self.lock:
+            while self.totalBytes > self.maxBytes and len(self.index) > 1:
+                _, entry = next(iter(self.index.items()))
+                self.removeEntry(entry)
+                self.stats["evictions"] += 1
+
+    ###########################################################################################
+    # Functions to build the revalidation headers and to record the server's answers
+    ###########################################################################################
+    def conditionalHeaders(self, entry):
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.lastModified:
+                headers["If-Modified-Since"] = entry.lastModified
+        return headers
+
+    def refresh(self, entry, headers):
+        lifetime = freshnessLifetime(headers, self.defaultTtl)
+        entry.expires = time.time() + (lifetime or 0.0)
+        entry.etag = headers.get("ETag", entry.etag)
+        entry.lastModified = headers.get("Last-Modified", entry.lastModified)
+        self.writeAtomically(self.metaPath(entry.url), json.dumps(entry.toDict()))
+        return entry
+
+    # move a completely written body into place under its content address and record it
+    def store(self, url, blobSink, headers, lifetime):
+        digest = blobSink.hash.hexdigest()
+        path = self.blobPath(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            blobSink.discard()
+        else:
+            os.replace(blobSink.path, path)
+
+        lastModified = headers.get("Last-Modified")
+        if lastModified is None and headers.get("ETag") is None:
+            # nothing to revalidate with - use the Date so If-Modified-Since still works
+            lastModified = headers.get("Date") or email.utils.formatdate(usegmt=True)
+        entry = CacheEntry(url, digest, blobSink.size, headers.get("ETag"), lastModified,
+                           time.time() + lifetime)
+        self.writeAtomically(self.metaPath(url), json.dumps(entry.toDict()))
+        with self.lock:
+            self.addToIndex(entry)
+            self.stats["stores"] += 1
+        self.evict()
+        return entry
+
+    def newBlobSink(self):
+        return BlobSink(self.tempDirectory)
+
+    # feed a stored body (open, from lookup or openBody) to a caller's sink
+    def copyToSink(self, body, sink):
+        if sink is None:
+            return
+        buffer = URLDownloadStreaming.getBuffer()
+        view = memoryview(buffer)
+        while True:
+            count = body.readinto(buffer)
+            if not count:
+                break
+            sink.write(view[:count])
+
+    def count(self, source, amount=1):
+        with self.lock:
+            self.stats[source] += amount
+
+    ###########################################################################################
+    # Function to fetch url through the cache with a requests session. Identical requests
+    # already in flight on other threads are waited for instead of being sent again.
+    # sinkFactory works as in URLDownloadStreaming - the sink sees the body whether it came
+    # from the network or from disk. timeout is passed on to session.get and the body read
+    # is given up once the time.perf_counter() deadline passes - a duplicate waits for the
+    # first request only until then too. When the first request gives up because its own
+    # deadline passed, the duplicates are not failed with it - as in fetchAsync, the first
+    # of them to wake up sends the request itself. Returns a CacheResult
+    ###########################################################################################
+    def fetch(self, url, session, sinkFactory=None, timeout=None, deadline=None):
+        while True:
+            with self.lock:
+                flight = self.inFlight.get(url)
+                if flight is None:
+                    flight = self.inFlight[url] = {"done": threading.Event()}
+                    break
+
+            waitFor = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            if not flight["done"].wait(waitFor):
+                raise TimeoutError("no response within the deadline")
+            if flight.get("expired"):
+                # the first request ran out of its own time - this one may still have some
+                if deadline is not None:
+                    timeLeft = deadline - time.perf_counter()
+                    if timeLeft <= 0:
+                        raise TimeoutError("no response within the deadline")
+                    timeout = timeLeft if timeout is None else min(timeout, timeLeft)
+                continue
+            if "error" in flight:
+                raise flight["error"]
+            shared = self.shareResult(url, flight["result"], sinkFactory)
+            if shared is not None:
+                return shared
+            # the body was evicted before it could be copied - fetch the url after all
+            return self.fetchFromSession(url, session, sinkFactory, timeout, deadline)
+
+        try:
+            flight["result"] = self.fetchFromSession(url, session, sinkFactory, timeout,
+                                                     deadline)
+            return flight["result"]
+        except BaseException as error:
+            if deadline is not None and time.perf_counter() >= deadline:
+                flight["expired"] = True
+            else:
+                flight["error"] = error
+            raise
+        finally:
+            with self.lock:
+                del self.inFlight[url]
+            flight["done"].set()
+
+    # hand a leader's result to a request that waited for it - or return None when its
+    # sink needs the body and the body has been evicted since
+    def shareResult(self, url, result, sinkFactory):
+        if sinkFactory is not None and result.entry is not None:
+            body = self.openBody(result.entry)
+            if body is None:
+                return None
+            sink = sinkFactory(url)
+            try:
+                self.copyToSink(body, sink)
+            finally:
+                sink.close()
+                body.close()
+        self.count(COALESCED)
+        return CacheResult(url, result.status, result.size, COALESCED, result.entry)
+
+    def fetchFromSession(self, url, session, sinkFactory, timeout=None, deadline=None):
+        entry, body = self.lookup(url)
+        sink = sinkFactory(url) if sinkFactory is not None else None
+        try:
+            if entry is not None and entry.isFresh():
+                self.copyToSink(body, sink)
+                self.count(HIT)
+                return CacheResult(url, 200, entry.size, HIT, entry)
+
+            headers = self.conditionalHeaders(entry)
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304 and entry is not None:
+                    self.refresh(entry, response.headers)
+                    self.copyToSink(body, sink)
+                    self.count(REVALIDATED)
+                    return CacheResult(url, 200, entry.size, REVALIDATED, entry)
+
+                lifetime = freshnessLifetime(response.headers, self.defaultTtl)
+                if response.status_code != 200 or lifetime is None:
+                    size = URLDownloadStreaming.streamResponse(response, sink, deadline=deadline)
+                    self.count(UNCACHEABLE)
+                    return CacheResult(url, response.status_code, size, UNCACHEABLE)
+
+                blobSink = self.newBlobSink()
+                try:
+                    URLDownloadStreaming.streamResponse(response, TeeSink(blobSink, sink),
+                                                        deadline=deadline)
+                    blobSink.close()
+                except BaseException:
+                    blobSink.discard()
+                    raise
+                entry = self.store(url, blobSink, response.headers, lifetime)
+                self.count(MISS)
+                return CacheResult(url, 200, entry.size, MISS, entry)
+        finally:
+            if body is not None:
+                body.close()
+            if sink is not None:
+                sink.close()
+
+    ###########################################################################################
+    # Same as fetch for an aiohttp session - duplicates in flight on the event loop await
+    # the first request's future instead of being sent again. When the first request is
+    # cancelled (its deadline passed, say) the duplicates are not - the first of them to
+    # wake up sends the request itself and the others wait for it instead. Looking up,
+    # reading and storing bodies on disk runs on a thread so the event loop never waits
+    # on the disk - a body being downloaded is written there ASYNC_WRITE_BATCH bytes at a
+    # time, so the thread hops don't cost one per chunk
+    ###########################################################################################
+    async def fetchAsync(self, url, session, sinkFactory=None, chunkSize=URLDownloadStreaming.CHUNK_SIZE):
+        while True:
+            flight = self.asyncInFlight.get(url)
+            if flight is None:
+                break
+            try:
+                result = await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                # only the leader was cancelled when this task itself wasn't asked to stop
+                if flight.cancelled() and not RequestPolicy.cancelRequested():
+                    continue
+                raise
+            if sinkFactory is None:
+                return self.shareResult(url, result, sinkFactory)
+            shared = await asyncio.to_thread(self.shareResult, url, result, sinkFactory)
+            if shared is not None:
+                return shared
+            # the body was evicted before it could be copied - fetch the url after all
+            return await self.fetchFromAsyncSession(url, session, sinkFactory, chunkSize)
+
+        flight = self.asyncInFlight[url] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self.fetchFromAsyncSession(url, session, sinkFactory, chunkSize)
+            flight.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as error:
+            flight.set_exception(error)
+            # the exception is re-raised here as well - mark it retrieved so asyncio does
+            # not warn about it when no duplicate was waiting
+            flight.exception()
+            raise
+        finally:
+            del self.asyncInFlight[url]
+
+    async def fetchFromAsyncSession(self, url, session, sinkFactory, chunkSize):
+        entry, body = await asyncio.to_thread(self.lookup, url)
+        sink = sinkFactory(url) if sinkFactory is not None else None
+        try:
+            if entry is not None and entry.isFresh():
+                if sink is not None:
+                    await asyncio.to_thread(self.copyToSink, body, sink)
+                self.count(HIT)
+                return CacheResult(url, 200, entry.size, HIT, entry)
+
+            headers = self.conditionalHeaders(entry)
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and entry is not None:
+                    await asyncio.to_thread(self.refresh, entry, response.headers)
+                    if sink is not None:
+                        await asyncio.to_thread(self.copyToSink, body, sink)
+                    self.count(REVALIDATED)
+                    return CacheResult(url, 200, entry.size, REVALIDATED, entry)
+
+                lifetime = freshnessLifetime(response.headers, self.defaultTtl)
+                cacheable = response.status == 200 and lifetime is not None
+                blobSink = await asyncio.to_thread(self.newBlobSink) if cacheable else None
+                target = TeeSink(blobSink, sink)
+                size = 0
+                pending, pendingBytes = [], 0
+                try:
+                    while True:
+                        chunk = await response.content.read(chunkSize)
+                        if chunk:
+                            size += len(chunk)
+                            if target.sinks:
+                                pending.append(chunk)
+                                pendingBytes += len(chunk)
+                        if pending and (not chunk or pendingBytes >= ASYNC_WRITE_BATCH):
+                            await asyncio.to_thread(target.writeAll, pending)
+                            pending, pendingBytes = [], 0
+                        if not chunk:
+                            break
+                except BaseException:
+                    if blobSink is not None:
+                        blobSink.discard()
+                    raise
+
+                if not cacheable:
+                    self.count(UNCACHEABLE)
+                    return CacheResult(url, response.status, size, UNCACHEABLE)
+                blobSink.close()
+                entry = await asyncio.to_thread(self.store, url, blobSink, response.headers,
+                                                lifetime)
+                self.count(MISS)
+                return CacheResult(url, 200, entry.size, MISS, entry)
+        finally:
+            if body is not None:
+                body.close()
+            if sink is not None:
+                sink.close()
+
+    ###########################################################################################
+    # Function to return the hit/miss statistics along with the size of the cache
+    ###########################################################################################
+    def statistics(self):
+        with self.lock:
+            stats = {source: self.stats[source]
+                     for source in (HIT, REVALIDATED, MISS, UNCACHEABLE, COALESCED)}
+            stats.update(stores=self.stats["stores"], evictions=self.stats["evictions"],
+                         entries=len(self.index), bytes=self.totalBytes)
+        requests = sum(stats[source] for source in (HIT, REVALIDATED, MISS, UNCACHEABLE, COALESCED))
+        # a revalidation still costs a round trip but no body, so it counts as a hit here
+        served = stats[HIT] + stats[REVALIDATED] + stats[COALESCED]
+        stats["hitRatio"] = served / requests if requests else 0.0
+        return stats
+
+
+# caches opened in this process, keyed by directory, so that every task a pool worker
+# runs shares one index
+openCaches = {}
+openCachesLock = threading.Lock()
+
+
+###########################################################################################
+# Function to return this process's cache for directory, opening it the first time
+###########################################################################################
+def openCache(directory, maxBytes=256 * 1024 * 1024, defaultTtl=0.0):
+    with openCachesLock:
+        cache = openCaches.get(directory)
+        if cache is None:
+            cache = openCaches[directory] = ResponseCache(directory, maxBytes, defaultTtl)
+        return cache
@@ -0,0 +1,163 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Sample - I/O Bound Sample - Hybrid Multiprocess +
+# AsyncIO approach analyzing perfomance for downloading a collection of urls
+#
+# AsyncIO gets the most connections out of one thread, but it is still one thread on one
+# CPU - once TLS handshakes and parsing keep that CPU busy, more connections don't help.
+# Multiprocessing uses every CPU, but each process only does one blocking download at a
+# time. This approach does both: one process per CPU, each running its own event loop
+# with the bounded asyncio engine over its own share of the urls
+#
+# Urls are sharded by host, so each host's connections (and their keep-alive reuse)
+# stay in one process. A host with more than its fair share of the urls is split into
+# fair-sized pieces so no process is left with all of the work
+#
+# Downside here is that it is the most complicated of the approaches - it carries the
+# costs of both processes and event loops, and only pays off once a single event loop
+# is CPU bound
+###########################################################################################
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import queue
+import urllib.parse
+
+import ConcurrencyProfiler
+import DownloadReporter
+import RequestTiming
+import URLDownloadAsyncIO
+
+# urls sharded at a time - sharding needs the urls in hand, so a long (or endless) input
+# is read and sharded this many at a time
+DEFAULT_BATCH_SIZE = 10_000
+
+
+###########################################################################################
+# Function to split the sites into at most `shards` lists, keeping each host's urls
+# together where possible and balancing the number of urls per list
+###########################################################################################
+def shardByHost(sites, shards):
+    byHost = {}
+    for url in sites:
+        byHost.setdefault(urllib.parse.urlsplit(url).netloc, []).append(url)
+    total = sum(len(urls) for urls in byHost.values())
+    if total == 0:
+        return []
+    fairShare = math.ceil(total / shards)
+
+    pieces = []
+    for urls in byHost.values():
+        for start in range(0, len(urls), fairShare):
+            pieces.append(urls[start:start + fairShare])
+
+    # largest pieces first, each onto whichever shard has the fewest urls so far
+    heap = [(0, index, []) for index in range(shards)]
+    for piece in sorted(pieces, key=len, reverse=True):
+        size, index, shard = heapq.heappop(heap)
+        shard.extend(piece)
+        heapq.heappush(heap, (size + len(piece), index, shard))
+    return [shard for _, _, shard in sorted(heap, key=lambda item: item[1]) if shard]
+
+
+###########################################################################################
+# Function run in each worker process - download one shard on the process's own event
+# loop and return its totals (with its RequestTiming rows when instrument is True and
+# its DownloadResults when collect is True)
+###########################################################################################
+def downloadShard(shard, concurrency=URLDownloadAsyncIO.DEFAULT_CONCURRENCY,
+                  limitPerHost=URLDownloadAsyncIO.DEFAULT_LIMIT_PER_HOST, cache=None,
+                  instrument=False, collect=False, policy=None):
+    recorder = RequestTiming.TimingRecorder() if instrument else None
+    results = DownloadReporter.ResultList() if collect else None
+    totals = asyncio.run(URLDownloadAsyncIO.downloadAllSitesBounded(
+        shard, concurrency=concurrency, limitPerHost=limitPerHost, cache=cache,
+        recorder=recorder, reporter=results, policy=policy))
+    totals["pid"] = os.getpid()
+    totals["sites"] = len(shard)
+    if recorder is not None:
+        totals["timings"] = recorder.rows()
+    if results is not None:
+        totals["results"] = results
+    return totals
+
+
+def unpackShard(arguments):
+    return downloadShard(*arguments)
+
+
+###########################################################################################
+# Function to download a series of web pages across processes, each running asyncio
+#
+# Param: pool - multiprocessing pool to run the shards on (one shard per process)
+#        processes - number of processes in the pool
+#        concurrency / limitPerHost - per process limits for the asyncio engine
+#        recorder - optional RequestTiming.TimingRecorder for the requests' phase timings
+#        reporter - optional DownloadReporter.Reporter, handed each shard's results as
+#                   the shard finishes
+#        policy - optional RequestPolicy.RequestPolicy - each process keeps its own
+#                 breakers and latencies for the hosts in its shards
+#        batchSize - urls read from sites (any iterable, including a generator) and
+#                    sharded at a time
+#
+# There is no barrier between batches: as soon as fewer shards are outstanding than
+# there are processes, the next batch is read and its shards queued behind the ones
+# still running, so a process that finishes early picks up new work instead of waiting
+# for the slowest host's shard. At most two batches are held at once. The shards are
+# submitted one by one rather than through imap_unordered, whose task thread would read
+# an endless input to its end
+#
+# Returns the combined totals plus each shard's own totals
+###########################################################################################
+def downloadAllSites(sites, pool, processes, concurrency=URLDownloadAsyncIO.DEFAULT_CONCURRENCY,
+                     limitPerHost=URLDownloadAsyncIO.DEFAULT_LIMIT_PER_HOST, cache=None,
+                     recorder=None, reporter=None, policy=None, batchSize=DEFAULT_BATCH_SIZE):
+    shardTotals = []
+    totals = {"downloaded": 0, "bytes": 0, "errors": 0}
+    if policy is not None:
+        totals["policy"] = dict.fromkeys(URLDownloadAsyncIO.POLICY_COUNTS, 0)
+    # one shard per task so each process takes one at a time. Each process watches its
+    # own event loop when a ConcurrencyProfiler is running
+    task = ConcurrencyProfiler.wrapTask(unpackShard)
+    # shard totals (or the exception a shard raised) as the pool finishes them
+    finished = queue.SimpleQueue()
+    outstanding = 0
+    sites = iter(sites)
+    exhausted = False
+    while True:
+        while not exhausted and outstanding < processes:
+            batch = list(itertools.islice(sites, batchSize))
+            if not batch:
+                exhausted = True
+                break
+            for shard in shardByHost(batch, processes):
+                arguments = (shard, concurrency, limitPerHost, cache, recorder is not None,
+                             reporter is not None, policy)
+                pool.apply_async(task, (arguments,), callback=finished.put,
+                                 error_callback=finished.put)
+                outstanding += 1
+        if outstanding == 0:
+            break
+
+        shardTotal = finished.get()
+        outstanding -= 1
+        if isinstance(shardTotal, BaseException):
+            raise shardTotal
+        shardTotals.append(shardTotal)
+        for key in ("downloaded", "bytes", "errors"):
+            totals[key] += shardTotal[key]
+        if policy is not None:
+            for key, count in shardTotal["policy"].items():
+                totals["policy"][key] += count
+        # the processes counted into their own copies of the cache - count here as well
+        if cache is not None:
+            for source, count in shardTotal["cache"].items():
+                cache.count(source, count)
+        if recorder is not None:
+            recorder.addRows(shardTotal.pop("timings"))
+        if reporter is not None:
+            reporter.reportAll(shardTotal.pop("results"))
+    totals["shards"] = shardTotals
+    return totals
@@ -11,11 +11,23 @@
 # as race conditions that yield random, intermitten bugs that are difficult to diagnose
 # ###########################################################################################
 
+import collections
 import concurrent.futures
+import functools
 import requests
+import requests.adapters
 import threading
 import time
 
+import AdaptiveThreadPool
+import ConcurrencyProfiler
+import DownloadReporter
+import RequestTiming
+import URLDownloadStreaming
+
+# connection pools kept per thread's session in adaptive mode - one pool per host
+DEFAULT_HOST_POOLS = 32
+
 # used as access point for threads' session for thread safety
 threadLocal = threading.local()
 ###########################################################################################
@@ -28,26 +40,144 @@ def getSession():
     return threadLocal.session 
 
 
+###########################################################################################
+# Helper function to create the thread's session with its connection pools sized for one
+# thread: a thread only ever has one request in flight, so it needs one connection per
+# host (poolMaxsize) and a pool for each of the hosts it talks to (hostPools) - the
+# default of 10 pools means reconnecting whenever a crawl spans more than 10 hosts.
+# The total number of open connections then follows the number of worker threads
+###########################################################################################
+def createSizedSession(hostPools=DEFAULT_HOST_POOLS, poolMaxsize=1):
+    session = getSession()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=hostPools, pool_maxsize=poolMaxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+###########################################################################################
+# Helper function to close the thread's session (and its connections) when the thread
+# retires
+###########################################################################################
+def closeSession():
+    session = getattr(threadLocal, "session", None)
+    if session is not None:
+        session.close()
+        del threadLocal.session
+
+
 ###########################################################################################
 # Function to download a web page using multithreading
+#
+# Param: stream - when True, the body is read in chunks into the thread's reusable buffer
+#                 (and handed to a sink from sinkFactory) instead of buffered in memory
+#        cache - optional URLDownloadCache.ResponseCache shared by all of the threads -
+#                threads asking for a url already being downloaded wait for it
+#        recorder - optional RequestTiming.TimingRecorder to record the request's phase
+#                   timings in - it is shared by all of the threads
+#        policy - optional RequestPolicy.RequestPolicy (deadline, hedging, circuit breakers)
+#                 shared by all of the threads
+#
+# Returns a DownloadReporter.DownloadResult - a failed request is returned, not raised
 ###########################################################################################
-def downloadSite(url):
+def downloadSite(url, stream=False, sinkFactory=None, cache=None, recorder=None, policy=None):
+    startTime = time.perf_counter()
     # get the session for the thread
     session = getSession()
+    if policy is None:
+        try:
+            result = fetchSite(url, session, stream, sinkFactory, cache, recorder)
+        except (requests.RequestException, OSError) as error:
+            result = DownloadReporter.DownloadResult(url, error=error)
+    else:
+        fetch = functools.partial(fetchSite, url, stream=stream, sinkFactory=sinkFactory,
+                                  cache=cache, recorder=recorder)
+        # two attempts writing to sinks for the same url would clash - only hedge without one
+        result = policy.call(url, fetch, session, hedge=sinkFactory is None)
+    result.latency = time.perf_counter() - startTime
+    return result
+
+
+###########################################################################################
+# Function to make one attempt at downloading a web page - raises when the request fails
+###########################################################################################
+def fetchSite(url, session, stream=False, sinkFactory=None, cache=None, recorder=None,
+              timeout=None, deadline=None):
+    if recorder is not None:
+        RequestTiming.instrumentSession(session)
+    if cache is not None:
+        result = cache.fetch(url, session, sinkFactory, timeout, deadline)
+        return DownloadReporter.DownloadResult(url, result.status, result.size, result.source)
     # using get from Sessions instead of from requests directly to speed things up
-    with session.get(url) as response:
-        print(f"Read {len(response.content)} from {url}")
+    # with a deadline the body is streamed either way, so it can be given up between chunks
+    with session.get(url, stream=stream or deadline is not None, timeout=timeout) as response:
+        size = URLDownloadStreaming.readBody(response, url, stream, sinkFactory, deadline)
+        timing = None
+        if recorder is not None:
+            timing = recorder.finish(getattr(response, "timing", None))
+        return DownloadReporter.DownloadResult(url, response.status_code, size, timing=timing)
+
+
+###########################################################################################
+# Helper function run on the worker threads - download the url and hand the result to the
+# reporter (whose report() only queues it, so the thread goes straight back to work).
+# The result is returned too, so the adaptive pool can count the failures
+###########################################################################################
+def downloadAndReport(url, download, reporter):
+    result = download(url)
+    reporter.report(result)
+    return result
 
 
 ###########################################################################################
 # Function to download a series of web pages using multithreading
+#
+# Param: adaptive - when True, the number of threads is tuned while the sites download
+#                   (between minWorkers and maxWorkers) instead of being fixed at 5, and
+#                   the statistics of the adaptive pool are returned
+#        workers - number of threads when not adaptive
+#        reporter - optional DownloadReporter.Reporter to hand each result to
+#        policy - optional RequestPolicy.RequestPolicy
+#
+# sites can be any iterable, including a generator - at most twice as many urls as
+# there are threads are taken from it ahead of the threads, so memory stays flat
 ###########################################################################################
-def downloadAllSites(sites):
+def downloadAllSites(sites, stream=False, sinkFactory=None, cache=None, adaptive=False,
+                     minWorkers=2, maxWorkers=64, hostPools=DEFAULT_HOST_POOLS, recorder=None,
+                     reporter=None, workers=5, policy=None):
+    download = functools.partial(downloadSite, stream=stream, sinkFactory=sinkFactory,
+                                 cache=cache, recorder=recorder, policy=policy)
+    # every thread may be waiting on a hedged call at once
+    if policy is not None:
+        policy.reserveThreads(maxWorkers if adaptive else workers)
+    if reporter is not None:
+        download = functools.partial(downloadAndReport, download=download, reporter=reporter)
+    if adaptive:
+        pool = AdaptiveThreadPool.AdaptiveThreadPool(
+            download, minWorkers=minWorkers, maxWorkers=maxWorkers,
+            onWorkerStart=functools.partial(createSizedSession, hostPools),
+            onWorkerExit=closeSession, failed=lambda result: not result.ok)
+        pool.map(sites)
+        return pool.statistics()
+
     # Create a pool of concurrent threads and use an Executor to control 
     # how and when each of the threads in the pool will run to download
-    # each of the sites in the list
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        executor.map(downloadSite, sites)
+    # each of the sites in the list. executor.map would submit every site up front, so
+    # wait for the oldest download whenever the window of submitted ones is full
+    # with a ConcurrencyProfiler running, the threads busy downloading and the downloads
+    # waiting for a thread are recorded as the run goes
+    inFlight = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor, \
+            ConcurrencyProfiler.watch("multithreaded", workers=workers,
+                                      busy=lambda: sum(future.running() for future in list(inFlight)),
+                                      depth=lambda: sum(not future.done() and not future.running()
+                                                        for future in list(inFlight))):
+        for url in sites:
+            if len(inFlight) >= workers * 2:
+                inFlight.popleft().result()
+            inFlight.append(executor.submit(download, url))
+        for future in inFlight:
+            future.result()
 
 
 ###########################################################################################
@@ -59,7 +189,8 @@ def testConcurrency2IOBoundThreaded():
         "http://olympus.realpython.org/dice",
     ] * 80
 
-    startTime = time.time()
-    downloadAllSites(sites)
+    with DownloadReporter.Reporter(DownloadReporter.PROGRESS) as reporter:
+        startTime = time.time()
+        downloadAllSites(sites, reporter=reporter)
     duration = time.time() - startTime
     print(f"\nPERFORMANCE: Downloaded {len(sites)} in {duration} seconds")
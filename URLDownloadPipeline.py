@@ -0,0 +1,288 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Sample - Pipelined Download + Process approach
+#
+# The other samples are either I/O bound (download a page) or CPU bound (sum squares),
+# but real jobs tend to do both: fetch a page, then do some heavy processing on it.
+# Downloading everything and then processing everything keeps the network busy and the
+# CPUs idle, then the other way around, so the run takes as long as both stages added
+# together. This approach runs them as a pipeline:
+#
+#   asyncio download workers --> bounded queue of bodies --> ProcessPoolExecutor workers
+#
+# While the processes work on the bodies already downloaded, the event loop is fetching
+# the next ones, so the run takes about as long as the slower of the two stages. The
+# queue is bounded, so when processing falls behind the downloads wait for it instead of
+# piling bodies up in memory
+#
+# Bodies are not pickled across to the processes. Each one is read straight into a
+# multiprocessing.shared_memory block (sized from the Content-Length, grown when the
+# server didn't send one) and only the block's name and the body's size are sent. The
+# process maps the same memory and reads the body in place; the parent unlinks the block
+# once the process is done with it
+#
+# Downside here is that it is only worth it when the processing is heavy enough to keep
+# a process busy - for light processing the event loop alone is faster
+###########################################################################################
+
+import aiohttp
+import asyncio
+import hashlib
+import os
+import time
+from multiprocessing import shared_memory
+
+import ConcurrencyProfiler
+import DownloadReporter
+import RequestTiming
+import URLDownloadAsyncIO
+
+# bodies downloaded and waiting for a process, per process
+QUEUED_BODIES_PER_PROCESS = 4
+# bodies handed to the executor at a time, per process - one running and one waiting so
+# a process never sits idle while the parent sends it the next one
+BODIES_IN_FLIGHT_PER_PROCESS = 2
+
+
+###########################################################################################
+# A response body in a shared memory block created (and in the end unlinked) by the
+# parent. The block starts at capacity bytes and doubles whenever a write doesn't fit
+###########################################################################################
+class SharedBody:
+    def __init__(self, capacity):
+        self.block = shared_memory.SharedMemory(create=True, size=max(capacity, 1))
+        self.size = 0
+
+    @property
+    def name(self):
+        return self.block.name
+
+    def write(self, chunk):
+        end = self.size + len(chunk)
+        if end > self.block.size:
+            self.grow(max(end, self.block.size * 2))
+        self.block.buf[self.size:end] = chunk
+        self.size = end
+
+    def grow(self, capacity):
+        block = shared_memory.SharedMemory(create=True, size=capacity)
+        block.buf[:self.size] = self.block.buf[:self.size]
+        self.release()
+        self.block = block
+
+    # close and unlink the block - safe to call more than once
+    def release(self):
+        block, self.block = self.block, None
+        if block is not None:
+            block.close()
+            block.unlink()
+
+
+###########################################################################################
+# Processors - run in the worker processes on a read-only view of one body and return a
+# picklable result, which becomes the url's DownloadResult.processed. Anything
+# picklable that takes the body works, e.g. functools.partial(sumOfSquaresOfBytes,
+# rounds=10)
+###########################################################################################
+def digestBody(body, algorithm="sha256"):
+    return hashlib.new(algorithm, body).hexdigest()
+
+
+# the sum of squares sample applied to the body's bytes - pure Python, so it keeps a
+# process busy for a time that grows with the body size and rounds
+def sumOfSquaresOfBytes(body, rounds=1):
+    total = 0
+    for _ in range(rounds):
+        total += sum(byte * byte for byte in body)
+    return total
+
+
+# processors by the name used to select them on the command line
+PROCESSORS = {
+    "sha256": digestBody,
+    "sum-of-squares": sumOfSquaresOfBytes,
+}
+
+
+###########################################################################################
+# Function run in the worker processes - map the parent's block, run processor on the
+# body and unmap it again. The workers share the parent's resource tracker, so the
+# tracker registration that attaching makes is the one the parent's unlink removes
+###########################################################################################
+def processSharedBody(name, size, processor):
+    block = shared_memory.SharedMemory(name)
+    body = block.buf[:size]
+    try:
+        return processor(body)
+    finally:
+        # the view has to go before the block can be closed
+        body.release()
+        block.close()
+
+
+###########################################################################################
+# Function to download one body into a SharedBody. Returns the DownloadResult and the
+# body, or the failed DownloadResult and None - a failed request is returned, not raised
+###########################################################################################
+async def downloadBody(session, url, chunkSize=URLDownloadAsyncIO.CHUNK_SIZE, recorder=None):
+    record = RequestTiming.TimingRecord(url) if recorder is not None else None
+    body = None
+    try:
+        async with session.get(url, trace_request_ctx=record) as response:
+            if response.status >= 400:
+                await response.read()
+                return DownloadReporter.DownloadResult(url, response.status), None
+            body = SharedBody(response.content_length or chunkSize)
+            while True:
+                chunk = await response.content.read(chunkSize)
+                if not chunk:
+                    break
+                body.write(chunk)
+    except BaseException as error:
+        if body is not None:
+            body.release()
+        if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+            return DownloadReporter.DownloadResult(url, error=error), None
+        raise
+    timing = recorder.finish(record) if recorder is not None else None
+    return DownloadReporter.DownloadResult(url, response.status, body.size, timing=timing), body
+
+
+###########################################################################################
+# First stage worker - pull urls off the queue until the None sentinel arrives and put
+# every downloaded body on the bodies queue, waiting there while the queue is full.
+# Failed downloads (and error responses) never reach the processes, so they are reported
+# straight away - including anything else a url raises (e.g., an OSError when no shared
+# memory is left), as a worker that died would leave the producer waiting for good
+###########################################################################################
+async def downloadWorker(session, urls, bodies, totals, chunkSize, recorder, reporter):
+    while True:
+        url = await urls.get()
+        try:
+            if url is None:
+                return
+            startTime = time.perf_counter()
+            try:
+                result, body = await downloadBody(session, url, chunkSize, recorder)
+            except Exception as error:
+                result, body = DownloadReporter.DownloadResult(url, error=error), None
+            result.latency = time.perf_counter() - startTime
+            if body is None:
+                if result.error is not None:
+                    totals["errors"] += 1
+                else:
+                    totals["downloaded"] += 1
+                if reporter is not None:
+                    reporter.report(result)
+                continue
+            totals["downloaded"] += 1
+            totals["bytes"] += result.size
+            try:
+                await bodies.put((result, body))
+            except BaseException:
+                body.release()
+                raise
+        finally:
+            urls.task_done()
+
+
+###########################################################################################
+# Second stage worker - hand each body to the executor and wait for its result, then
+# unlink the body's block and report the url. Processing failures are reported as the
+# url's error and counted in totals["processErrors"] - the url was already counted as
+# downloaded, so counting it in totals["errors"] too would count it twice
+###########################################################################################
+async def processWorker(bodies, executor, processor, totals, reporter):
+    loop = asyncio.get_running_loop()
+    process = ConcurrencyProfiler.wrapTask(processSharedBody)
+    while True:
+        item = await bodies.get()
+        try:
+            if item is None:
+                return
+            result, body = item
+            try:
+                result.processed = await loop.run_in_executor(
+                    executor, process, body.name, body.size, processor)
+                totals["processed"] += 1
+            except Exception as error:
+                result.error = repr(error)
+                totals["processErrors"] += 1
+            finally:
+                body.release()
+            if reporter is not None:
+                reporter.report(result)
+        finally:
+            bodies.task_done()
+
+
+###########################################################################################
+# Function to download a series of web pages and process every body on a pool of
+# processes, with both stages running at the same time
+#
+# Param: executor - concurrent.futures.ProcessPoolExecutor (or any executor) to process
+#                   the bodies on
+#        processes - number of processes in the executor
+#        processor - picklable function run on each body (see PROCESSORS)
+#        concurrency / limitPerHost - download limits, as URLDownloadAsyncIO
+#        queueSize - bodies downloaded and waiting for a process before the downloads
+#                    wait (default QUEUED_BODIES_PER_PROCESS per process)
+#        recorder - optional RequestTiming.TimingRecorder for the downloads
+#        reporter - optional DownloadReporter.Reporter, handed each url's result once its
+#                   body has been processed (or its download failed)
+#        overlap - False runs the stages one after the other (every body is downloaded
+#                  before the first is processed) to measure what the pipeline saves
+#
+# Returns a dictionary with the number of sites downloaded, bodies processed, bytes read,
+# download errors (downloaded + errors is the number of urls) and processing errors,
+# and the seconds from the start until each stage finished
+###########################################################################################
+async def downloadAllSites(sites, executor, processes=None, processor=digestBody,
+                           concurrency=URLDownloadAsyncIO.DEFAULT_CONCURRENCY,
+                           limitPerHost=URLDownloadAsyncIO.DEFAULT_LIMIT_PER_HOST,
+                           chunkSize=URLDownloadAsyncIO.CHUNK_SIZE, queueSize=None,
+                           recorder=None, reporter=None, overlap=True):
+    processes = processes or os.cpu_count() or 1
+    totals = {"downloaded": 0, "processed": 0, "bytes": 0, "errors": 0, "processErrors": 0}
+    startTime = time.perf_counter()
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=limitPerHost)
+    urls = asyncio.Queue(maxsize=concurrency * 2)
+    # without overlap every body has to wait for the downloads to finish - don't bound it
+    bodies = asyncio.Queue(maxsize=(queueSize or processes * QUEUED_BODIES_PER_PROCESS)
+                                   if overlap else 0)
+
+    def startProcessing():
+        return [asyncio.create_task(processWorker(bodies, executor, processor, totals, reporter))
+                for _ in range(processes * BODIES_IN_FLIGHT_PER_PROCESS)]
+
+    processors = startProcessing() if overlap else []
+    async with URLDownloadAsyncIO.createSession(recorder, connector=connector) as session:
+        downloaders = [asyncio.create_task(downloadWorker(session, urls, bodies, totals,
+                                                          chunkSize, recorder, reporter))
+                       for _ in range(concurrency)]
+        # with a ConcurrencyProfiler running, the loop's lag and both queues are recorded
+        watch = ConcurrencyProfiler.watch("pipeline", depth=urls.qsize, bodies=bodies.qsize)
+        try:
+            with ConcurrencyProfiler.watchLoop("pipeline"), watch:
+                async for url in URLDownloadAsyncIO.iterateSites(sites):
+                    await urls.put(url)
+                for _ in downloaders:
+                    await urls.put(None)
+                await asyncio.gather(*downloaders)
+                totals["downloadSeconds"] = time.perf_counter() - startTime
+                if not overlap:
+                    processors = startProcessing()
+                for _ in processors:
+                    await bodies.put(None)
+                await asyncio.gather(*processors)
+                totals["processSeconds"] = time.perf_counter() - startTime
+        finally:
+            for task in downloaders + processors:
+                task.cancel()
+            # let the cancelled workers release the bodies they were holding
+            await asyncio.gather(*downloaders, *processors, return_exceptions=True)
+            # bodies still queued when the pipeline stopped early
+            while not bodies.empty():
+                item = bodies.get_nowait()
+                if item is not None:
+                    item[1].release()
+    return totals
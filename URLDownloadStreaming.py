@@ -0,0 +1,196 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Sample - Streaming Response Bodies
+#
+# response.content buffers the whole body in memory just so we can count its bytes - a
+# few large responses push each worker's memory up by the size of those responses.
+# Streaming reads the body in fixed-size chunks into a buffer that is reused for every
+# request made by the thread, so peak memory per worker stays at one chunk no matter how
+# large the responses are
+#
+# Each chunk can optionally be handed to a sink: count the bytes, hash them or write them
+# to a file. Sinks are created per url by a sink factory - the sink class itself works
+# (e.g., HashSink) as does functools.partial(FileSink, directory="downloads"). Factories
+# need to be picklable when used with the multiprocessing downloader
+###########################################################################################
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+CHUNK_SIZE = 64 * 1024
+
+# one reusable read buffer per thread (and therefore per process)
+bufferLocal = threading.local()
+
+
+###########################################################################################
+# Helper function to return the thread's read buffer, creating it the first time called
+###########################################################################################
+def getBuffer(size=CHUNK_SIZE):
+    buffer = getattr(bufferLocal, "buffer", None)
+    if buffer is None or len(buffer) != size:
+        buffer = bufferLocal.buffer = bytearray(size)
+    return buffer
+
+
+###########################################################################################
+# Sink that just counts the bytes written to it
+###########################################################################################
+class ByteCounterSink:
+    def __init__(self, url=None):
+        self.url = url
+        self.size = 0
+
+    def write(self, chunk):
+        self.size += len(chunk)
+
+    def close(self):
+        pass
+
+
+###########################################################################################
+# Sink that hashes the body - hexdigest() is available once the body has been streamed
+###########################################################################################
+class HashSink:
+    def __init__(self, url=None, algorithm="sha256"):
+        self.url = url
+        self.hash = hashlib.new(algorithm)
+
+    def write(self, chunk):
+        self.hash.update(chunk)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+    def close(self):
+        pass
+
+
+###########################################################################################
+# Sink that writes the body to a file in directory. The file is opened with a buffer of
+# bufferSize bytes and, when the server sent a Content-Length, space for the whole body
+# is reserved up front so the file does not grow (and fragment) a chunk at a time
+#
+# The body is written to a temporary file of its own and moved into place by close(), so
+# the same url downloaded by several workers at once never interleaves their writes -
+# the file at path is always one complete body (the last to finish)
+###########################################################################################
+class FileSink:
+    def __init__(self, url, directory=".", bufferSize=1024 * 1024):
+        self.url = url
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+        self.path = os.path.join(directory, name)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, self.temporaryPath = tempfile.mkstemp(dir=directory, prefix=name + ".",
+                                                          suffix=".part")
+        self.file = open(descriptor, "wb", buffering=bufferSize)
+        self.size = 0
+
+    def preallocate(self, length):
+        if length > 0 and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(self.file.fileno(), 0, length)
+            except OSError:
+                # not every file system supports it - it is only an optimization
+                pass
+
+    def write(self, chunk):
+        self.size += self.file.write(chunk)
+
+    def close(self):
+        # trim the file in case the body was shorter than the Content-Length reserved
+        try:
+            self.file.truncate(self.size)
+        finally:
+            self.file.close()
+        os.replace(self.temporaryPath, self.path)
+
+
+###########################################################################################
+# Helper function to raise a TimeoutError once the time.perf_counter() deadline (None for
+# no deadline) has passed - a TimeoutError is an OSError, so it is a failed attempt
+###########################################################################################
+def checkDeadline(deadline):
+    if deadline is not None and time.perf_counter() > deadline:
+        raise TimeoutError("body not read before the deadline")
+
+
+###########################################################################################
+# Function to read a streamed (stream=True) requests response in fixed-size chunks,
+# passing each chunk to sink. Returns the number of bytes read
+#
+# Uncompressed bodies are read straight into the thread's reusable buffer; compressed
+# bodies have to go through iter_content so that requests decodes them, which still
+# only holds one chunk at a time
+#
+# The socket timeout only bounds each read, so a body that keeps trickling in would run
+# on for as long as the server keeps sending. With a deadline (a time.perf_counter()
+# time) the read is given up between chunks once the deadline has passed, raising a
+# TimeoutError. Uncompressed bodies are then read with read1, which returns whatever has
+# arrived instead of waiting for a whole chunk, so a trickle is checked as it comes in
+###########################################################################################
+def streamResponse(response, sink=None, chunkSize=CHUNK_SIZE, deadline=None):
+    contentLength = response.headers.get("Content-Length")
+    if sink is not None and contentLength and hasattr(sink, "preallocate"):
+        sink.preallocate(int(contentLength))
+
+    size = 0
+    encoding = response.headers.get("Content-Encoding", "identity").lower()
+    identity = encoding in ("", "identity")
+    if identity and deadline is not None and hasattr(response.raw, "read1"):
+        while True:
+            checkDeadline(deadline)
+            chunk = response.raw.read1(chunkSize)
+            if not chunk:
+                break
+            size += len(chunk)
+            if sink is not None:
+                sink.write(chunk)
+    elif identity and hasattr(response.raw, "readinto"):
+        buffer = getBuffer(chunkSize)
+        view = memoryview(buffer)
+        while True:
+            checkDeadline(deadline)
+            count = response.raw.readinto(buffer)
+            if not count:
+                break
+            size += count
+            if sink is not None:
+                sink.write(view[:count])
+    else:
+        for chunk in response.iter_content(chunkSize):
+            checkDeadline(deadline)
+            size += len(chunk)
+            if sink is not None:
+                sink.write(chunk)
+    return size
+
+
+###########################################################################################
+# Function to stream the body of a response for url into a new sink from sinkFactory
+# (or nowhere when sinkFactory is None), closing the sink afterwards. Returns the number
+# of bytes read
+###########################################################################################
+def streamToSink(response, url, sinkFactory=None, chunkSize=CHUNK_SIZE, deadline=None):
+    sink = sinkFactory(url) if sinkFactory is not None else None
+    try:
+        return streamResponse(response, sink, chunkSize, deadline)
+    finally:
+        if sink is not None:
+            sink.close()
+
+
+###########################################################################################
+# Function to return the body size of a requests response - streamed through a sink when
+# stream is True, otherwise from the fully buffered response.content. With a deadline
+# the response has to have been requested with stream=True either way, so the body is
+# read (and only counted, not buffered) in chunks that are checked against it
+###########################################################################################
+def readBody(response, url, stream=False, sinkFactory=None, deadline=None):
+    if stream:
+        return streamToSink(response, url, sinkFactory, deadline=deadline)
+    if deadline is not None:
+        return streamResponse(response, deadline=deadline)
+    return len(response.content)
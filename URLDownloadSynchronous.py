@@ -9,25 +9,74 @@
 # The downside is that it is slow compared to solutions using concurrency
 ###########################################################################################
 
+import functools
 import requests
 import time
 
+import DownloadReporter
+import RequestTiming
+import URLDownloadStreaming
+
 ###########################################################################################
 # Function to download a web page
+#
+# Param: stream - when True, the body is read in chunks into a reusable buffer (and
+#                 handed to a sink from sinkFactory) instead of buffered in memory
+#        cache - optional URLDownloadCache.ResponseCache to serve repeated urls from
+#        recorder - optional RequestTiming.TimingRecorder to record the request's phase
+#                   timings in
+#        policy - optional RequestPolicy.RequestPolicy (deadline, hedging, circuit breakers)
+#
+# Returns a DownloadReporter.DownloadResult - a failed request is returned, not raised
+###########################################################################################
+def downloadSite(url, session, stream=False, sinkFactory=None, cache=None, recorder=None,
+                 policy=None):
+    startTime = time.perf_counter()
+    if policy is None:
+        try:
+            result = fetchSite(url, session, stream, sinkFactory, cache, recorder)
+        except (requests.RequestException, OSError) as error:
+            result = DownloadReporter.DownloadResult(url, error=error)
+    else:
+        fetch = functools.partial(fetchSite, url, stream=stream, sinkFactory=sinkFactory,
+                                  cache=cache, recorder=recorder)
+        # two attempts writing to sinks for the same url would clash - only hedge without one
+        result = policy.call(url, fetch, session, hedge=sinkFactory is None)
+    result.latency = time.perf_counter() - startTime
+    return result
+
+
+###########################################################################################
+# Function to make one attempt at downloading a web page - raises when the request fails
 ###########################################################################################
-def downloadSite(url, session):
+def fetchSite(url, session, stream=False, sinkFactory=None, cache=None, recorder=None,
+              timeout=None, deadline=None):
+    if recorder is not None:
+        RequestTiming.instrumentSession(session)
+    if cache is not None:
+        result = cache.fetch(url, session, sinkFactory, timeout, deadline)
+        return DownloadReporter.DownloadResult(url, result.status, result.size, result.source)
     # using get from Sessions instead of from requests directly to speed things up
-    with session.get(url) as response:
-        print(f"Read {len(response.content)} from {url}")
+    # with a deadline the body is streamed either way, so it can be given up between chunks
+    with session.get(url, stream=stream or deadline is not None, timeout=timeout) as response:
+        size = URLDownloadStreaming.readBody(response, url, stream, sinkFactory, deadline)
+        timing = None
+        if recorder is not None:
+            timing = recorder.finish(getattr(response, "timing", None))
+        return DownloadReporter.DownloadResult(url, response.status_code, size, timing=timing)
 
 
 ###########################################################################################
-# Function to download a series of web pages
+# Function to download a series of web pages, handing each result to the optional
+# DownloadReporter.Reporter
 ###########################################################################################
-def downloadAllSites(sites):
+def downloadAllSites(sites, stream=False, sinkFactory=None, cache=None, recorder=None,
+                     reporter=None, policy=None):
     with requests.Session() as session:
         for url in sites:
-            downloadSite(url, session)
+            result = downloadSite(url, session, stream, sinkFactory, cache, recorder, policy)
+            if reporter is not None:
+                reporter.report(result)
 
 
 ###########################################################################################
@@ -40,7 +89,8 @@ def testConcurrency1IOBoundSynchronous():
         "http://olympus.realpython.org/dice",
     ] * 80
 
-    startTime = time.time()
-    downloadAllSites(sites)
+    with DownloadReporter.Reporter(DownloadReporter.PROGRESS) as reporter:
+        startTime = time.time()
+        downloadAllSites(sites, reporter=reporter)
     duration = time.time() - startTime
     print(f"\nPERFORMANCE: Downloaded {len(sites)} in {duration} seconds")
\ No newline at end of file
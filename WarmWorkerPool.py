@@ -0,0 +1,154 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Persistent (Warm) Worker Process Pool
+#
+# Starting processes is expensive - for short jobs, creating a multiprocessing.Pool,
+# running each process's initializer and tearing it all down again costs more than the
+# work itself. A WarmWorkerPool starts its processes once and hands the same pool to
+# every job that follows:
+#
+# - start() creates the processes and waits until every one of them has run its
+#   initializer, recording how long that took (warmupSeconds) so benchmarks can report
+#   warm-up separately from the jobs
+# - with the forkserver context, modules listed in preload are imported once by the
+#   fork server, so every worker starts with them already loaded
+# - maxtasksperchild recycles workers after that many tasks (e.g., to bound leaks)
+# - getPool() checks the pool is still healthy (at most every checkInterval seconds)
+#   and starts a new one if it is not
+# - shutdown() closes the pool and waits for the workers to exit; it is also registered
+#   to run when the interpreter exits
+###########################################################################################
+
+import atexit
+import multiprocessing
+import multiprocessing.pool
+import os
+import threading
+import time
+
+
+###########################################################################################
+# Function run in the workers to prove they are up - returns the worker's process id
+###########################################################################################
+def ping(_=None):
+    return os.getpid()
+
+
+###########################################################################################
+# Long-lived wrapper around a multiprocessing.Pool - safe to share between threads
+###########################################################################################
+class WarmWorkerPool:
+    def __init__(self, processes=None, initializer=None, initargs=(), maxtasksperchild=None,
+                 context=None, preload=(), checkInterval=30.0, checkTimeout=10.0,
+                 startTimeout=60.0):
+        self.processes = processes or os.cpu_count() or 1
+        self.initializer = initializer
+        self.initargs = initargs
+        self.maxtasksperchild = maxtasksperchild
+        self.contextName = context
+        self.preload = list(preload)
+        self.checkInterval = checkInterval
+        self.checkTimeout = checkTimeout
+        self.startTimeout = startTimeout
+
+        self.lock = threading.RLock()
+        self.pool = None
+        self.warmupSeconds = None
+        self.lastCheck = 0.0
+        self.restarts = 0
+        atexit.register(self.shutdown)
+
+    ###########################################################################################
+    # Function to start the processes (if they are not running already) and wait for all
+    # of them to finish initializing. Returns the seconds spent warming up, 0 when the
+    # pool was already running
+    ###########################################################################################
+    def start(self):
+        with self.lock:
+            if self.pool is not None:
+                return 0.0
+            startTime = time.perf_counter()
+            context = multiprocessing.get_context(self.contextName)
+            if self.contextName == "forkserver" and self.preload:
+                context.set_forkserver_preload(self.preload)
+            self.pool = context.Pool(self.processes, self.initializer, self.initargs,
+                                     self.maxtasksperchild)
+            # one ping per process - a worker can only answer once its initializer is done.
+            # Workers that fail to start are replaced forever, so don't wait indefinitely
+            try:
+                self.pool.map_async(ping, range(self.processes), chunksize=1).get(self.startTimeout)
+            except multiprocessing.TimeoutError:
+                self.terminate()
+                raise RuntimeError(f"worker processes did not start within {self.startTimeout} seconds")
+            self.warmupSeconds = time.perf_counter() - startTime
+            self.lastCheck = time.monotonic()
+            return self.warmupSeconds
+
+    ###########################################################################################
+    # Function to check that the pool is running, has live worker processes and, when it
+    # is idle, that a worker answers within timeout. A ping waits behind every job
+    # already submitted, so while jobs are outstanding a long one would look like a hung
+    # pool - then only the processes are checked. multiprocessing.Pool has no public way
+    # to see its state, workers or outstanding jobs, hence _state, _pool and _cache
+    ###########################################################################################
+    def isHealthy(self, timeout=None):
+        with self.lock:
+            pool = self.pool
+        if pool is None or getattr(pool, "_state", multiprocessing.pool.RUN) != multiprocessing.pool.RUN:
+            return False
+        # the pool replaces workers that exit, so some can be gone for a moment - all of
+        # them gone means nothing is replacing them
+        workers = getattr(pool, "_pool", None)
+        if workers is not None and not any(worker.is_alive() for worker in workers):
+            return False
+        if not getattr(pool, "_cache", None):
+            try:
+                pool.apply_async(ping).get(timeout or self.checkTimeout)
+            except multiprocessing.TimeoutError:
+                # a job submitted since the pool was seen idle holds the ping up too
+                if len(getattr(pool, "_cache", ())) <= 1:
+                    return False
+            except Exception:
+                return False
+        self.lastCheck = time.monotonic()
+        return True
+
+    ###########################################################################################
+    # Function to return the running multiprocessing.Pool, starting it the first time and
+    # replacing it when a health check fails
+    ###########################################################################################
+    def getPool(self):
+        with self.lock:
+            if self.pool is None:
+                self.start()
+            elif time.monotonic() - self.lastCheck > self.checkInterval and not self.isHealthy():
+                self.restart()
+            return self.pool
+
+    def restart(self):
+        with self.lock:
+            self.terminate()
+            self.restarts += 1
+            return self.start()
+
+    ###########################################################################################
+    # Functions to stop the pool - shutdown lets the workers finish what they are doing,
+    # terminate stops them straight away
+    ###########################################################################################
+    def shutdown(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def terminate(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    def statistics(self):
+        return {"processes": self.processes, "running": self.pool is not None,
+                "warmupSeconds": self.warmupSeconds, "restarts": self.restarts,
+                "context": self.contextName, "maxtasksperchild": self.maxtasksperchild}
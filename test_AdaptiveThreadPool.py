@@ -0,0 +1,59 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Self-Tuning Thread Pool Tests
+#
+# Run with python -m pytest (or python -m unittest)
+###########################################################################################
+
+import itertools
+import threading
+import unittest
+
+import AdaptiveThreadPool
+
+
+class AdaptiveThreadPoolTest(unittest.TestCase):
+    # a function that returns its failures instead of raising them still has them counted,
+    # so the pool backs off a failing upstream
+    def testReturnedFailuresCountAsErrors(self):
+        pool = AdaptiveThreadPool.AdaptiveThreadPool(
+            lambda item: item % 2 == 0, minWorkers=2, maxWorkers=4,
+            failed=lambda ok: not ok)
+        pool.map(range(20))
+        statistics = pool.statistics()
+        self.assertEqual(statistics["errors"], 10)
+        self.assertEqual(statistics["completed"], 10)
+
+    # with errors in an interval the pool halves its workers
+    def testErrorsHalveTheWorkers(self):
+        pool = AdaptiveThreadPool.AdaptiveThreadPool(lambda item: None, minWorkers=2,
+                                                     maxWorkers=64, initialWorkers=32)
+        pool.adjust(throughput=100.0, latency=0.01, errors=3)
+        self.assertEqual(pool.target, 16)
+
+    # workers whose start raises are counted and replaced - even when every worker's start
+    # fails, map still finishes instead of waiting on a queue nobody is taking from
+    def testFailedStartsAreCountedAndReplaced(self):
+        starts = itertools.count()
+        exits = []
+
+        def onWorkerStart():
+            if next(starts) < 2:
+                raise OSError("no session")
+
+        done = []
+        pool = AdaptiveThreadPool.AdaptiveThreadPool(
+            done.append, minWorkers=2, maxWorkers=2, interval=0.05,
+            onWorkerStart=onWorkerStart, onWorkerExit=lambda: exits.append(1))
+        mapping = threading.Thread(target=pool.map, args=(range(10),), daemon=True)
+        mapping.start()
+        mapping.join(timeout=10)
+        self.assertFalse(mapping.is_alive(), "map hung after the workers failed to start")
+        statistics = pool.statistics()
+        self.assertEqual(sorted(done), list(range(10)))
+        self.assertEqual(statistics["failedStarts"], 2)
+        self.assertEqual(statistics["completed"], 10)
+        self.assertEqual(len(exits), len(pool.threads))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Concurrency Tests
+#
+# Run with python -m pytest (or python -m unittest)
+###########################################################################################
+
+import contextlib
+import io
+import unittest
+
+import Concurrency
+import SumOfSquaresKernels
+
+
+class SplitRangesTest(unittest.TestCase):
+    # add the sub-ranges' partial sums back up per number, as findSumsMultiProcessing does
+    def sumTasks(self, numbers, tasks):
+        results = [0] * len(numbers)
+        for task in tasks:
+            index, partialSum = SumOfSquaresKernels.sumOfSquaresSubRange(task)
+            results[index] += partialSum
+        return results
+
+    def testSubRangesCoverEveryNumberOnce(self):
+        numbers = [100, 1, 37, 1000]
+        tasks = Concurrency.splitRanges(numbers, 8)
+        for index, number in enumerate(numbers):
+            ranges = sorted((start, stop) for _, taskIndex, start, stop in tasks
+                            if taskIndex == index)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], number)
+            # contiguous - each sub-range starts where the one before it stopped
+            for (_, stop), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(start, stop)
+
+    def testWorkIsSplitEvenly(self):
+        tasks = Concurrency.splitRanges([1000, 3000], 8)
+        self.assertEqual(len(tasks), 8)
+        self.assertEqual({stop - start for _, _, start, stop in tasks}, {500})
+
+    def testPartialSumsMatchTheReference(self):
+        numbers = [10_000, 3, 0, -4, 1, 2_500]
+        for name in SumOfSquaresKernels.availableKernels():
+            for parts in (0, 1, 7, 64, 100_000):
+                with self.subTest(kernel=name, parts=parts):
+                    tasks = Concurrency.splitRanges(numbers, parts, name)
+                    self.assertTrue(all(task[0] == name for task in tasks))
+                    self.assertEqual(self.sumTasks(numbers, tasks),
+                                     [SumOfSquaresKernels.sumOfSquaresPython(number)
+                                      for number in numbers])
+
+    def testZeroAndNegativeNumbersNeedNoWork(self):
+        self.assertEqual(Concurrency.splitRanges([0, -10], 4), [])
+        self.assertEqual(Concurrency.splitRanges([], 4), [])
+
+
+class ParseArgumentsTest(unittest.TestCase):
+    def parse(self, *argv):
+        with contextlib.redirect_stderr(io.StringIO()) as errors:
+            try:
+                return Concurrency.parseArguments(list(argv))
+            except SystemExit:
+                return errors.getvalue()
+
+    # the pipeline can't use a cache or a policy - a usage error, not a traceback mid-run
+    def testPipelineRejectsCacheAndPolicy(self):
+        for options in (["--cache", "cache"], ["--deadline", "1"], ["--hedge"]):
+            with self.subTest(options=options):
+                error = self.parse("urls.txt", "--strategy", "pipeline", *options)
+                self.assertIn("--strategy pipeline does not support", error)
+
+    def testPipelineAndOtherStrategiesParse(self):
+        self.assertEqual(self.parse("urls.txt", "--strategy", "pipeline").strategy, "pipeline")
+        self.assertEqual(self.parse("--strategy", "asyncio", "--cache", "cache").cache, "cache")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Reproducible Download Benchmark Tests
+#
+# Run with python -m pytest (or python -m unittest). The urls are served by a
+# LocalTestServer on a free port, so no network access is needed
+###########################################################################################
+
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+import ConcurrencyBenchmark
+import LocalTestServer
+import PerformanceStats
+
+
+class LatencyTest(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalTestServer.startServer(latency=0.01, bodySize=100)
+        self.sites = ConcurrencyBenchmark.buildSites(self.server, 10)
+
+    def tearDown(self):
+        LocalTestServer.stopServer(self.server)
+
+    def benchmark(self, name):
+        return ConcurrencyBenchmark.benchmarkStrategy(name, self.sites, trials=3, warmup=1)
+
+    def testPercentilesAreOverEveryTimedRequest(self):
+        for name in ("synchronous", "multithreaded", "asyncio-bounded"):
+            with self.subTest(name):
+                result = self.benchmark(name)
+                latency = result["latency"]
+                # the warmup's requests are dropped, each timed trial's are kept
+                self.assertEqual(latency["count"], len(self.sites) * 3)
+                self.assertGreaterEqual(latency["min"], 0.01)
+                self.assertLessEqual(latency["p50"], latency["p95"])
+                self.assertLessEqual(latency["p95"], latency["p99"])
+                # a request can't take longer than the trial it was part of
+                self.assertLessEqual(latency["max"], max(result["durations"]))
+                self.assertNotIn("latency", result["downloads"])
+
+
+class WriteJsonTest(unittest.TestCase):
+    # an empty summary's figures are nan - they are written as null, since NaN isn't JSON
+    def testNanIsWrittenAsNull(self):
+        report = {"latency": PerformanceStats.summarizeLatencies([]), "durations": [0.5]}
+        expected = {"latency": {"count": 0, "mean": None, "min": None, "max": None,
+                                "p50": None, "p95": None, "p99": None},
+                    "durations": [0.5]}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "report.json")
+            ConcurrencyBenchmark.writeJson(report, path)
+            with open(path) as source:
+                self.assertEqual(json.load(source, parse_constant=self.fail), expected)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            ConcurrencyBenchmark.writeJson(report, "-")
+        self.assertEqual(json.loads(output.getvalue(), parse_constant=self.fail), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Profiling and Monitoring Tests
+#
+# Run with python -m pytest (or python -m unittest)
+###########################################################################################
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import ConcurrencyProfiler
+
+
+def busyWork():
+    return sum(i * i for i in range(200_000))
+
+
+class ConcurrencyProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def metric(self, summary, name, metric):
+        return [entry for entry in summary["metrics"]
+                if entry["name"] == name and entry["metric"] == metric]
+
+    # with no Profiler running the engines' hooks change nothing
+    def testHooksDoNothingWithoutAProfiler(self):
+        self.assertIsNone(ConcurrencyProfiler.active)
+        self.assertIs(ConcurrencyProfiler.wrapTask(busyWork), busyWork)
+        with ConcurrencyProfiler.watch("pool", workers=2, busy=lambda: 1):
+            pass
+
+        async def run():
+            with ConcurrencyProfiler.watchLoop("asyncio"):
+                await asyncio.sleep(0)
+
+        asyncio.run(run())
+        self.assertEqual(os.listdir(self.path), [])
+
+    def testUnknownModeRaisesValueError(self):
+        with self.assertRaises(ValueError):
+            ConcurrencyProfiler.Profiler(self.path, mode="perf")
+
+    # the monitor reads every watched gauge, and busy over workers gives the utilization
+    def testWatchedGaugesAreSampled(self):
+        with ConcurrencyProfiler.Profiler(self.path, sampleInterval=0.001,
+                                          monitorInterval=0.01) as profiler:
+            self.assertIs(ConcurrencyProfiler.active, profiler)
+            self.assertIsInstance(ConcurrencyProfiler.wrapTask(busyWork),
+                                  ConcurrencyProfiler.ProfiledTask)
+            with ConcurrencyProfiler.watch("pool", workers=4, busy=lambda: 2, depth=lambda: 3):
+                busyWork()
+                time.sleep(0.1)
+        self.assertIsNone(ConcurrencyProfiler.active)
+
+        summary = ConcurrencyProfiler.mergeProfiles(self.path)
+        (utilization,) = self.metric(summary, "pool", "utilization")
+        self.assertEqual(utilization["mean"], 0.5)
+        (depth,) = self.metric(summary, "pool", "depth")
+        self.assertEqual(depth["max"], 3)
+        self.assertTrue(self.metric(summary, "process", "wakeup delay ms"))
+        self.assertTrue(summary["stacks"])
+        self.assertTrue(os.path.exists(os.path.join(self.path, "profile.collapsed")))
+
+    def testEventLoopLagIsSampled(self):
+        async def run():
+            with ConcurrencyProfiler.watchLoop("asyncio"):
+                for _ in range(10):
+                    await asyncio.sleep(0.01)
+
+        with ConcurrencyProfiler.Profiler(self.path, monitorInterval=0.01):
+            asyncio.run(run())
+        summary = ConcurrencyProfiler.mergeProfiles(self.path)
+        self.assertTrue(self.metric(summary, "asyncio", "loop lag ms"))
+
+    def testCProfileModeMergesTheFunctions(self):
+        with ConcurrencyProfiler.Profiler(self.path, mode=ConcurrencyProfiler.CPROFILE):
+            busyWork()
+        summary = ConcurrencyProfiler.mergeProfiles(self.path)
+        self.assertTrue(any(entry["function"].startswith("busyWork ")
+                            for entry in summary["functions"]))
+        self.assertTrue(os.path.exists(os.path.join(self.path, "profile.prof")))
+
+    # a new run in the same directory starts from a clean slate
+    def testEarlierRunsFilesAreRemoved(self):
+        for name in ("worker-1.json", "worker-1.collapsed", "profile.collapsed"):
+            with open(os.path.join(self.path, name), "w") as output:
+                output.write("stale")
+        with ConcurrencyProfiler.Profiler(self.path, label="parent"):
+            pass
+        self.assertEqual(sorted(os.listdir(self.path)), ["parent.collapsed", "parent.json"])
+
+    # worker processes' files are merged - utilization is only meaningful for workers
+    def testMergeProfilesCombinesEveryProcess(self):
+        def writeProcess(label, worker, stacks):
+            with open(os.path.join(self.path, label + ".collapsed"), "w") as output:
+                output.writelines(f"{stack} {count}\n" for stack, count in stacks.items())
+            with open(os.path.join(self.path, label + ".json"), "w") as output:
+                json.dump({"label": label, "pid": 1, "mode": "sample", "worker": worker,
+                           "elapsed": 2.0, "tasks": 4 if worker else 0, "busySeconds": 1.5,
+                           "samples": [[0.1, "process", "wakeup delay ms", 1.0],
+                                       [0.2, "process", "wakeup delay ms", 3.0]]}, output)
+
+        writeProcess("parent-1", False, {"parent-1;MainThread;main;wait": 3})
+        writeProcess("worker-2", True, {"worker-2;MainThread;main;busyWork": 5,
+                                        "worker-2;MainThread;main;wait": 1})
+        summary = ConcurrencyProfiler.mergeProfiles(self.path)
+
+        self.assertEqual([(entry["frame"], entry["samples"]) for entry in summary["stacks"]],
+                         [("busyWork", 5), ("wait", 4)])
+        self.assertAlmostEqual(sum(entry["share"] for entry in summary["stacks"]), 1.0)
+        utilizations = {entry["label"]: entry["utilization"] for entry in summary["processes"]}
+        self.assertEqual(utilizations, {"parent-1": None, "worker-2": 0.75})
+        for entry in self.metric(summary, "process", "wakeup delay ms"):
+            self.assertEqual((entry["samples"], entry["mean"], entry["max"]), (2, 2.0, 3.0))
+
+        text = ConcurrencyProfiler.formatSummary(summary)
+        self.assertIn("innermost frame", text)
+        self.assertIn("75.0%", text)
+        self.assertIn("wakeup delay ms", text)
+        with open(os.path.join(self.path, "profile.collapsed")) as merged:
+            self.assertEqual(len(merged.readlines()), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Download Results and Batched Reporting Tests
+#
+# Run with python -m pytest (or python -m unittest)
+###########################################################################################
+
+import io
+import json
+import math
+import threading
+import time
+import unittest
+
+import DownloadReporter
+
+URL = "http://example.invalid/page"
+
+
+# output whose writes wait until release() - a writer that has fallen behind
+class BlockedOutput(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def write(self, text):
+        self.released.wait(5)
+        return super().write(text)
+
+    def release(self):
+        self.released.set()
+
+
+# output whose first write fails - a full disk, say
+class FailingOutput(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.failed = False
+
+    def write(self, text):
+        if not self.failed:
+            self.failed = True
+            raise OSError(28, "No space left on device")
+        return super().write(text)
+
+
+class ReporterTest(unittest.TestCase):
+    # with the writer stuck, report() waits once queueSize results are queued
+    def testReportWaitsForASlowWriter(self):
+        output = BlockedOutput()
+        reporter = DownloadReporter.Reporter(DownloadReporter.PRINT, output, batchSize=1,
+                                             queueSize=2)
+        reporting = threading.Thread(
+            target=reporter.reportAll,
+            args=([DownloadReporter.DownloadResult(URL, 200, 1) for _ in range(10)],))
+        reporting.start()
+        reporting.join(0.2)
+        self.assertTrue(reporting.is_alive())
+        self.assertLessEqual(reporter.queue.qsize(), 2)
+
+        output.release()
+        reporting.join(5)
+        reporter.close()
+        self.assertEqual(reporter.summary()["downloaded"], 10)
+        self.assertEqual(output.getvalue().count("\n"), 10)
+
+    # a batch that fails to write is logged, and the results after it are still handled
+    def testFailedBatchDoesNotStopTheThread(self):
+        output = FailingOutput()
+        reporter = DownloadReporter.Reporter(DownloadReporter.PRINT, output)
+        with self.assertLogs("DownloadReporter", "ERROR"):
+            reporter.report(DownloadReporter.DownloadResult(URL, 200, 1))
+            while not output.failed:
+                time.sleep(0.01)
+            reporter.report(DownloadReporter.DownloadResult(URL, 200, 2))
+            reporter.close()
+        self.assertEqual(reporter.summary()["downloaded"], 2)
+        self.assertEqual(output.getvalue(), f"Read 2 from {URL}\n")
+
+    # the latencies reported before resetLatencies() are left out of the percentiles
+    def testResetLatencies(self):
+        with DownloadReporter.Reporter(DownloadReporter.QUIET, keepLatencies=True) as reporter:
+            for latency in (5.0, 0.1, 0.2, 0.3):
+                result = DownloadReporter.DownloadResult(URL, 200, 1)
+                result.latency = latency
+                reporter.report(result)
+                if latency == 5.0:
+                    reporter.resetLatencies()
+        summary = reporter.summary()
+        self.assertEqual(summary["downloaded"], 4)
+        self.assertEqual(summary["latency"]["count"], 3)
+        self.assertEqual(summary["latency"]["max"], 0.3)
+
+    def testLatenciesAreOnlyKeptWhenAsked(self):
+        with DownloadReporter.Reporter(DownloadReporter.QUIET) as reporter:
+            reporter.report(DownloadReporter.DownloadResult(URL, 200, 1))
+        self.assertNotIn("latency", reporter.summary())
+
+    # a phase that wasn't measured (nan) is written as null - NaN isn't JSON
+    def testJsonLinesHaveNoNan(self):
+        output = io.StringIO()
+        timing = ("host", math.nan, 0.0, math.nan, 0.1, 0.0, 0.1)
+        result = DownloadReporter.DownloadResult(URL, 200, 1, timing=timing)
+        with DownloadReporter.Reporter(DownloadReporter.JSONL, output) as reporter:
+            reporter.report(result)
+        record = json.loads(output.getvalue(), parse_constant=self.fail)
+        self.assertEqual(record["timing"], ["host", None, 0.0, None, 0.1, 0.0, 0.1])
+
+
+if __name__ == "__main__":
+    unittest.main()
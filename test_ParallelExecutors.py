@@ -0,0 +1,71 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Parallel Executors Tests
+#
+# Run with python -m pytest (or python -m unittest)
+###########################################################################################
+
+import concurrent.futures
+import unittest
+from unittest import mock
+
+import ParallelExecutors
+
+
+class DetectKindTest(unittest.TestCase):
+    def detect(self, gilEnabled, interpretersSupported):
+        with mock.patch.object(ParallelExecutors, "gilEnabled", lambda: gilEnabled), \
+             mock.patch.object(ParallelExecutors, "interpretersSupported",
+                               lambda: interpretersSupported):
+            return ParallelExecutors.detectKind(), ParallelExecutors.availableKinds()
+
+    # the cheapest kind that runs in parallel wins - threads without a GIL, then
+    # subinterpreters, then processes
+    def testCheapestParallelKindIsPicked(self):
+        cases = [(False, True, ParallelExecutors.THREADS),
+                 (False, False, ParallelExecutors.THREADS),
+                 (True, True, ParallelExecutors.INTERPRETERS),
+                 (True, False, ParallelExecutors.PROCESSES)]
+        for gilEnabled, interpretersSupported, expected in cases:
+            with self.subTest(gilEnabled=gilEnabled, interpretersSupported=interpretersSupported):
+                self.assertEqual(self.detect(gilEnabled, interpretersSupported)[0], expected)
+
+    def testInterpretersAreOnlyAvailableWhenSupported(self):
+        self.assertNotIn(ParallelExecutors.INTERPRETERS, self.detect(True, False)[1])
+        self.assertIn(ParallelExecutors.INTERPRETERS, self.detect(True, True)[1])
+        self.assertIn(ParallelExecutors.THREADS, self.detect(True, False)[1])
+
+    def testDetectedKindCanRunHere(self):
+        self.assertIn(ParallelExecutors.detectKind(), ParallelExecutors.availableKinds())
+
+
+class GetExecutorTest(unittest.TestCase):
+    def tearDown(self):
+        ParallelExecutors.shutdown()
+
+    # the executor is created and warmed once, then handed out again
+    def testExecutorIsKeptWarm(self):
+        executor = ParallelExecutors.getExecutor(ParallelExecutors.THREADS)
+        self.assertIsInstance(executor, concurrent.futures.ThreadPoolExecutor)
+        self.assertIs(ParallelExecutors.getExecutor(ParallelExecutors.THREADS), executor)
+        self.assertGreater(ParallelExecutors.startupSeconds[ParallelExecutors.THREADS], 0.0)
+        self.assertEqual(list(executor.map(abs, [-1, -2])), [1, 2])
+
+    def testShutdownForgetsTheExecutors(self):
+        executor = ParallelExecutors.getExecutor(ParallelExecutors.THREADS)
+        ParallelExecutors.shutdown()
+        self.assertEqual(ParallelExecutors.executors, {})
+        self.assertIsNot(ParallelExecutors.getExecutor(ParallelExecutors.THREADS), executor)
+
+    def testUnknownKindRaisesValueError(self):
+        with self.assertRaises(ValueError):
+            ParallelExecutors.getExecutor("fibers")
+        self.assertNotIn("fibers", ParallelExecutors.executors)
+
+    def testInterpretersNeedSupport(self):
+        with mock.patch.object(ParallelExecutors, "interpretersSupported", lambda: False):
+            with self.assertRaises(RuntimeError):
+                ParallelExecutors.createExecutor(ParallelExecutors.INTERPRETERS)
+
+
+if __name__ == "__main__":
+    unittest.main()
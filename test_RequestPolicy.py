@@ -0,0 +1,337 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Request Policy Tests
+#
+# Run with python -m pytest (or python -m unittest)
+###########################################################################################
+
+import asyncio
+import http.server
+import pickle
+import threading
+import time
+import unittest
+
+import requests
+
+import DownloadReporter
+import RequestPolicy
+import URLDownloadSynchronous
+
+URL = "http://example.invalid/page"
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    # a probe cancelled before it has an outcome hands the probe on to the next request
+    # instead of leaving the host's breaker half-open (rejecting everything) for good
+    def testCancelledProbeReleasesTheBreaker(self):
+        policy = RequestPolicy.RequestPolicy(breakerFailures=1, breakerCooldown=0.0)
+        breaker = policy.getBreaker(URL)
+        breaker.allow()
+        breaker.recordFailure()
+
+        async def run():
+            async def fetch():
+                await asyncio.sleep(10)
+            probe = asyncio.create_task(policy.callAsync(URL, fetch))
+            await asyncio.sleep(0.01)
+            self.assertEqual(breaker.state, RequestPolicy.CircuitBreaker.HALF_OPEN)
+            probe.cancel()
+            await asyncio.gather(probe, return_exceptions=True)
+
+        asyncio.run(run())
+        self.assertEqual(breaker.state, RequestPolicy.CircuitBreaker.OPEN)
+        self.assertEqual(breaker.allow(), RequestPolicy.CircuitBreaker.HALF_OPEN)
+
+    def fetchStatus(self, status):
+        calls = []
+
+        def fetch(session, timeout=None, deadline=None):
+            calls.append(session)
+            return DownloadReporter.DownloadResult(URL, status, 1)
+        return fetch, calls
+
+    # closed -> open after breakerFailures failures in a row -> rejecting until the
+    # cooldown -> half-open for a single probe -> closed again when the probe succeeds
+    def testBreakerCycle(self):
+        policy = RequestPolicy.RequestPolicy(breakerFailures=2, breakerCooldown=0.1)
+        breaker = policy.getBreaker(URL)
+        failing, failingCalls = self.fetchStatus(503)
+        working, workingCalls = self.fetchStatus(200)
+
+        self.assertFalse(policy.call(URL, failing, None).tripped)
+        self.assertEqual(breaker.state, RequestPolicy.CircuitBreaker.CLOSED)
+        self.assertTrue(policy.call(URL, failing, None).tripped)
+        self.assertEqual(breaker.state, RequestPolicy.CircuitBreaker.OPEN)
+
+        # open - rejected without sending anything
+        result = policy.call(URL, working, None)
+        self.assertTrue(result.rejected)
+        self.assertFalse(result.ok)
+        self.assertEqual(len(workingCalls), 0)
+
+        # after the cooldown one probe goes through while everything else is still rejected
+        time.sleep(0.1)
+        self.assertEqual(breaker.allow(), RequestPolicy.CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+        breaker.recordSuccess()
+        self.assertEqual(breaker.state, RequestPolicy.CircuitBreaker.CLOSED)
+
+        # the same cycle through the policy, with a probe that succeeds
+        policy.call(URL, failing, None)
+        policy.call(URL, failing, None)
+        self.assertEqual(breaker.state, RequestPolicy.CircuitBreaker.OPEN)
+        time.sleep(0.1)
+        self.assertTrue(policy.call(URL, working, None).ok)
+        self.assertEqual(breaker.state, RequestPolicy.CircuitBreaker.CLOSED)
+        self.assertEqual(len(workingCalls), 1)
+        self.assertEqual(len(failingCalls), 4)
+        self.assertEqual(policy.statistics()["trips"], 2)
+        self.assertEqual(policy.statistics()["rejected"], 1)
+
+    # a failed probe opens the breaker again for another cooldown
+    def testFailedProbeReopens(self):
+        policy = RequestPolicy.RequestPolicy(breakerFailures=1, breakerCooldown=0.1)
+        breaker = policy.getBreaker(URL)
+        failing, _ = self.fetchStatus(500)
+        policy.call(URL, failing, None)
+        time.sleep(0.1)
+        self.assertTrue(policy.call(URL, failing, None).tripped)
+        self.assertEqual(breaker.state, RequestPolicy.CircuitBreaker.OPEN)
+        self.assertTrue(policy.call(URL, failing, None).rejected)
+
+    # only failures in a row count, and each host has its own breaker
+    def testSuccessResetsTheCountAndHostsAreSeparate(self):
+        policy = RequestPolicy.RequestPolicy(breakerFailures=2, breakerCooldown=60.0)
+        failing, _ = self.fetchStatus(502)
+        working, _ = self.fetchStatus(200)
+        otherUrl = "http://other.invalid/page"
+        for fetch in (failing, working, failing, working):
+            policy.call(URL, fetch, None)
+        self.assertEqual(policy.getBreaker(URL).state, RequestPolicy.CircuitBreaker.CLOSED)
+        policy.call(URL, failing, None)
+        policy.call(URL, failing, None)
+        self.assertEqual(policy.getBreaker(URL).state, RequestPolicy.CircuitBreaker.OPEN)
+        self.assertTrue(policy.call(otherUrl, working, None).ok)
+        self.assertEqual(policy.statistics()["openBreakers"], ["example.invalid"])
+
+    def testAsyncBreakerCycle(self):
+        policy = RequestPolicy.RequestPolicy(breakerFailures=1, breakerCooldown=0.1)
+        breaker = policy.getBreaker(URL)
+
+        async def fetchStatus(status):
+            return DownloadReporter.DownloadResult(URL, status, 1)
+
+        async def run():
+            self.assertTrue((await policy.callAsync(URL, lambda: fetchStatus(503))).tripped)
+            self.assertTrue((await policy.callAsync(URL, lambda: fetchStatus(200))).rejected)
+            await asyncio.sleep(0.1)
+            self.assertTrue((await policy.callAsync(URL, lambda: fetchStatus(200))).ok)
+
+        asyncio.run(run())
+        self.assertEqual(breaker.state, RequestPolicy.CircuitBreaker.CLOSED)
+
+
+class HedgeTest(unittest.TestCase):
+    def setUp(self):
+        self.policy = RequestPolicy.RequestPolicy(hedge=True, hedgeAfter=0.05)
+
+    def tearDown(self):
+        self.policy.close()
+
+    # the call returns once the hedge wins while the first attempt is still reading, so
+    # neither attempt may use the caller's session - each gets its thread's own
+    def testAttemptsDontShareTheCallersSession(self):
+        callerSession = requests.Session()
+        sessions = []
+        firstDone = threading.Event()
+
+        def fetch(session, timeout=None, deadline=None):
+            sessions.append(session)
+            if len(sessions) == 1:
+                time.sleep(0.3)
+                firstDone.set()
+            return DownloadReporter.DownloadResult(URL, 200, 1)
+
+        result = self.policy.call(URL, fetch, callerSession)
+        self.assertTrue(result.hedged)
+        self.assertTrue(result.hedgeWon)
+        self.assertFalse(firstDone.is_set())
+        self.assertNotIn(callerSession, sessions)
+        self.assertIsNot(sessions[0], sessions[1])
+        firstDone.wait(1)
+        callerSession.close()
+
+    # fetch for hedging tests - attempts are told apart by the order they start in. Each
+    # sleeps for its delay and returns its status (an exception is raised) with size 1 for
+    # the first attempt and 2 for the hedge
+    def fetchAttempts(self, first, hedge):
+        attempts = []
+        lock = threading.Lock()
+
+        def fetch(session, timeout=None, deadline=None):
+            with lock:
+                attempt = len(attempts) + 1
+                attempts.append(session)
+            delay, outcome = first if attempt == 1 else hedge
+            time.sleep(delay)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return DownloadReporter.DownloadResult(URL, outcome, attempt)
+        return fetch
+
+    def testFastRequestIsNotHedged(self):
+        with requests.Session() as session:
+            result = self.policy.call(URL, self.fetchAttempts((0.0, 200), (0.0, 200)), session)
+        self.assertFalse(result.hedged)
+        self.assertFalse(result.hedgeWon)
+        self.assertEqual(result.size, 1)
+        self.assertEqual(self.policy.statistics()["hedges"], 0)
+
+    # the hedge is sent, but the first attempt still answers first and is kept
+    def testFirstAttemptCanStillWin(self):
+        with requests.Session() as session:
+            result = self.policy.call(URL, self.fetchAttempts((0.1, 200), (0.5, 200)), session)
+        self.assertTrue(result.hedged)
+        self.assertFalse(result.hedgeWon)
+        self.assertEqual(result.size, 1)
+        self.assertEqual(self.policy.statistics()["hedges"], 1)
+        self.assertEqual(self.policy.statistics()["hedgeWins"], 0)
+
+    # an attempt that fails first doesn't win - the other attempt is waited for
+    def testFailedAttemptDoesNotWin(self):
+        with requests.Session() as session:
+            fetch = self.fetchAttempts((0.1, requests.ConnectionError("reset")), (0.2, 200))
+            result = self.policy.call(URL, fetch, session)
+            self.assertTrue(result.ok)
+            self.assertTrue(result.hedgeWon)
+            self.assertEqual(result.size, 2)
+
+            # both answer with an error - the result is a failure either way
+            fetch = self.fetchAttempts((0.1, 503), (0.1, 503))
+            result = self.policy.call(URL, fetch, session)
+            self.assertFalse(result.ok)
+            self.assertTrue(result.hedged)
+            self.assertEqual(result.status, 503)
+
+    # the hedge answers first - the slow first attempt is cancelled
+    def testAsyncHedgeWins(self):
+        attempts = []
+
+        async def fetch():
+            attempt = len(attempts)
+            attempts.append("started")
+            try:
+                await asyncio.sleep(1.0 if attempt == 0 else 0.01)
+            except asyncio.CancelledError:
+                attempts[attempt] = "cancelled"
+                raise
+            attempts[attempt] = "finished"
+            return DownloadReporter.DownloadResult(URL, 200, attempt)
+
+        async def run():
+            result = await self.policy.callAsync(URL, fetch)
+            await asyncio.sleep(0)
+            return result
+
+        result = asyncio.run(run())
+        self.assertTrue(result.hedged)
+        self.assertTrue(result.hedgeWon)
+        self.assertEqual(result.size, 1)
+        self.assertEqual(attempts, ["cancelled", "finished"])
+
+    # without hedgeAfter there is no hedging until hedgeMinSamples successes have been
+    # seen, then requests slower than the hedgePercentile latency are hedged
+    def testHedgeDelayFollowsTheLatencies(self):
+        policy = RequestPolicy.RequestPolicy(hedge=True, hedgeMinSamples=3, hedgePercentile=50)
+        self.assertIsNone(policy.hedgeDelay())
+        for latency in (0.1, 0.3, 0.2):
+            policy.record(DownloadReporter.DownloadResult(URL, 200), None, latency)
+        policy.record(DownloadReporter.DownloadResult(URL, 500), None, 5.0)
+        self.assertAlmostEqual(policy.hedgeDelay(), 0.2)
+        policy.close()
+
+    # every engine thread can have both of its attempts on the policy's threads at once
+    def testReserveThreadsFitsTheEngine(self):
+        executor = self.policy.getExecutor()
+        self.policy.reserveThreads(100)
+        self.assertEqual(self.policy.maxWorkers, 200)
+        self.assertIsNot(self.policy.getExecutor(), executor)
+        self.policy.reserveThreads(10)
+        self.assertEqual(self.policy.maxWorkers, 200)
+
+
+class OpenPolicyTest(unittest.TestCase):
+    def tearDown(self):
+        for policy in list(RequestPolicy.openPolicies.values()):
+            policy.close()
+        RequestPolicy.openPolicies.clear()
+
+    # what a pool worker gets for a policy pickled by the parent
+    def unpickle(self, policy):
+        return pickle.loads(pickle.dumps(policy))
+
+    def testTasksOfOneRunShareACopy(self):
+        policy = RequestPolicy.RequestPolicy(hedge=True, breakerFailures=3)
+        copy = self.unpickle(policy)
+        self.assertIsNot(copy, policy)
+        self.assertIs(self.unpickle(policy), copy)
+        self.assertEqual(copy.settings(), policy.settings())
+
+    # the next run's policy closes the copies of the runs before it
+    def testNewRunClosesTheOldCopies(self):
+        first = self.unpickle(RequestPolicy.RequestPolicy(hedge=True, hedgeAfter=0.01))
+        first.getExecutor().submit(first.getThreadSession).result()
+        self.assertEqual(len(first.threadSessions), 1)
+        second = self.unpickle(RequestPolicy.RequestPolicy(hedge=True))
+        self.assertEqual(list(RequestPolicy.openPolicies.values()), [second])
+        self.assertIsNone(first.executor)
+        self.assertEqual(first.threadSessions, [])
+
+
+# sends its headers straight away, then the body a few bytes at a time - every read
+# returns well within any socket timeout, but the body takes a second to arrive
+class TrickleHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2000")
+        self.end_headers()
+        for _ in range(20):
+            self.wfile.write(b"x" * 100)
+            self.wfile.flush()
+            time.sleep(0.05)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), TrickleHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address[:2]
+        self.url = f"http://{host}:{port}/page"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # the socket timeout alone would let the trickle run for the whole second - the body
+    # read is given up once the deadline passes
+    def testDeadlineBoundsATricklingBody(self):
+        policy = RequestPolicy.RequestPolicy(deadline=0.2)
+        for stream in (False, True):
+            with requests.Session() as session:
+                startTime = time.perf_counter()
+                result = URLDownloadSynchronous.downloadSite(self.url, session, stream=stream,
+                                                             policy=policy)
+                duration = time.perf_counter() - startTime
+            self.assertLess(duration, 0.5)
+            self.assertTrue(result.error.startswith("TimeoutError"))
+        self.assertEqual(policy.statistics()["deadlines"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Per-Request Timing Tests
+#
+# Run with python -m pytest (or python -m unittest). The urls are served by a
+# LocalTestServer on a free port, so no network access is needed
+###########################################################################################
+
+import asyncio
+import math
+import unittest
+
+import aiohttp
+import requests
+
+import LocalTestServer
+import RequestTiming
+
+
+class TimingRecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.recorder = RequestTiming.TimingRecorder("test")
+        self.recorder.add("a", math.nan, 0.002, math.nan, 0.010, 0.005, 0.015)
+        self.recorder.add("b", 0.001, 0.0, math.nan, 0.020, 0.030, 0.050)
+        self.recorder.add("a", math.nan, 0.0, math.nan, 0.003, 0.001, 0.004)
+
+    def testRowsRoundTripThroughAddRows(self):
+        copy = RequestTiming.TimingRecorder()
+        copy.addRows(self.recorder.rows())
+        self.assertEqual(len(copy), 3)
+        self.assertEqual(copy.hostNames, ["a", "b"])
+        self.assertEqual(str(copy.rows()), str(self.recorder.rows()))
+
+    # phases that weren't measured (nan) are left out, and a host selects its own rows
+    def testPhaseValuesSkipNanAndFilterByHost(self):
+        self.assertEqual(self.recorder.phaseValues("dns"), [0.001])
+        self.assertEqual(self.recorder.phaseValues("total", "a"), [0.015, 0.004])
+        self.assertEqual(self.recorder.phaseValues("total", "unknown"), [])
+
+    def testSummaryHasEveryPhaseForAllHostsAndEachHost(self):
+        summary = self.recorder.summary()
+        self.assertEqual(set(summary), {"all", "a", "b"})
+        self.assertEqual(set(summary["all"]), set(RequestTiming.PHASES))
+        self.assertEqual(summary["all"]["total"]["count"], 3)
+        self.assertEqual(summary["a"]["tls"]["count"], 0)
+
+    def testHistogramCountsEachRequestOnce(self):
+        histogram = dict(self.recorder.histogram("total"))
+        self.assertEqual(histogram[5], 1)
+        self.assertEqual(histogram[20], 1)
+        self.assertEqual(histogram[50], 1)
+        self.assertEqual(sum(histogram.values()), 3)
+
+    def testClearDropsTheRows(self):
+        self.recorder.clear()
+        self.assertEqual(len(self.recorder), 0)
+        self.assertIn("test", self.recorder.report())
+
+
+class InstrumentedRequestsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalTestServer.startServer(latency=0.0)
+        self.url = LocalTestServer.baseUrl(self.server) + "/page"
+        self.session = requests.Session()
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=7))
+
+    def tearDown(self):
+        self.session.close()
+        LocalTestServer.stopServer(self.server)
+
+    def testInstrumentingTwiceKeepsTheFirstAdapterAndItsPoolSize(self):
+        RequestTiming.instrumentSession(self.session)
+        adapter = self.session.get_adapter(self.url)
+        RequestTiming.instrumentSession(self.session)
+        self.assertIs(self.session.get_adapter(self.url), adapter)
+        self.assertIsInstance(adapter, RequestTiming.TimingAdapter)
+        self.assertEqual(adapter._pool_maxsize, 7)
+
+    # the first request opens the connection, the second reuses it; plain http has no TLS
+    # and urllib3 resolves inside connect, so neither is measured
+    def testResponsesCarryTheirTiming(self):
+        RequestTiming.instrumentSession(self.session)
+        recorder = RequestTiming.TimingRecorder()
+        for _ in range(2):
+            response = self.session.get(self.url)
+            self.assertEqual(len(response.content), 10_000)
+            recorder.finish(response.timing)
+        first, second = recorder.rows()
+        self.assertGreater(first[2], 0.0)
+        self.assertEqual(second[2], 0.0)
+        for row in (first, second):
+            host, dns, connect, tls, ttfb, transfer, total = row
+            self.assertEqual(host, self.url.split("/")[2])
+            self.assertTrue(math.isnan(dns))
+            self.assertTrue(math.isnan(tls))
+            self.assertAlmostEqual(ttfb + transfer, total)
+
+
+class TraceConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalTestServer.startServer(latency=0.0)
+        self.url = LocalTestServer.baseUrl(self.server) + "/page"
+
+    def tearDown(self):
+        LocalTestServer.stopServer(self.server)
+
+    def testTraceConfigFillsInTheRecord(self):
+        recorder = RequestTiming.TimingRecorder()
+
+        async def run():
+            async with aiohttp.ClientSession(
+                    trace_configs=[RequestTiming.createTraceConfig()]) as session:
+                for _ in range(2):
+                    record = RequestTiming.TimingRecord(self.url)
+                    async with session.get(self.url, trace_request_ctx=record) as response:
+                        await response.read()
+                    recorder.finish(record)
+
+        asyncio.run(run())
+        first, second = recorder.rows()
+        self.assertGreater(first[2], 0.0)
+        self.assertEqual(second[2], 0.0)
+        for row in (first, second):
+            host, dns, connect, tls, ttfb, transfer, total = row
+            # an IP address is never resolved
+            self.assertEqual(dns, 0.0)
+            self.assertTrue(math.isnan(tls))
+            self.assertGreater(ttfb, 0.0)
+            self.assertAlmostEqual(ttfb + transfer, total)
+
+
+if __name__ == "__main__":
+    unittest.main()
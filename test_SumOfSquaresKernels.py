@@ -0,0 +1,65 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Sum of Squares Kernel Tests
+#
+# Run with python -m pytest (or python -m unittest)
+###########################################################################################
+
+import unittest
+
+import SumOfSquaresKernels
+
+NUMBERS = (-5, -1, 0, 1, 2, 3, 10, 1000)
+RANGES = ((0, 0), (0, 1), (5, 5), (7, 3), (3, 10), (-4, -1), (-3, 4), (-3, 0), (0, -3),
+          (995, 1000))
+
+
+class KernelTest(unittest.TestCase):
+    def testKernelsMatchTheReference(self):
+        for name in SumOfSquaresKernels.availableKernels():
+            kernel = SumOfSquaresKernels.getKernel(name)
+            for number in NUMBERS:
+                with self.subTest(kernel=name, number=number):
+                    self.assertEqual(kernel(number), SumOfSquaresKernels.sumOfSquaresPython(number))
+
+    def testRangeKernelsMatchTheReference(self):
+        for name in SumOfSquaresKernels.availableKernels():
+            kernel = SumOfSquaresKernels.getRangeKernel(name)
+            for start, stop in RANGES:
+                with self.subTest(kernel=name, start=start, stop=stop):
+                    self.assertEqual(kernel(start, stop),
+                                     SumOfSquaresKernels.sumOfSquaresPythonRange(start, stop))
+
+    def testSubRangesAddUpToTheWhole(self):
+        for name in SumOfSquaresKernels.availableKernels():
+            tasks = [(name, 3, start, min(start + 7, 100)) for start in range(0, 100, 7)]
+            partialSums = [SumOfSquaresKernels.sumOfSquaresSubRange(task) for task in tasks]
+            self.assertEqual({index for index, _ in partialSums}, {3})
+            self.assertEqual(sum(partialSum for _, partialSum in partialSums),
+                             SumOfSquaresKernels.sumOfSquaresPython(100))
+
+    def testUnknownKernel(self):
+        with self.assertRaises(ValueError):
+            SumOfSquaresKernels.getRangeKernel("fortran")
+
+    def testVerifyResultsNamesTheWrongNumber(self):
+        SumOfSquaresKernels.verifyResults("python", [0, 4], [0, 14])
+        with self.assertRaisesRegex(RuntimeError, "returned 15 for 4"):
+            SumOfSquaresKernels.verifyResults("python", [0, 4], [0, 15])
+
+
+@unittest.skipIf(SumOfSquaresKernels.numpy is None, "the numpy kernel needs NumPy installed")
+class NumpyKernelTest(unittest.TestCase):
+    # between about 1e8 and 3e9 int64 chunks would shrink to a handful of values - the
+    # kernel has to stay exact there (and past where one square overflows int64)
+    def testLargeNumbersMatchTheReference(self):
+        for start in (10 ** 8, 10 ** 9, 3 * 10 ** 9, 10 ** 10):
+            self.assertEqual(SumOfSquaresKernels.sumOfSquaresNumpyRange(start, start + 10_000),
+                             SumOfSquaresKernels.sumOfSquaresPythonRange(start, start + 10_000))
+
+    def testSmallChunksStayInInt64(self):
+        self.assertEqual(SumOfSquaresKernels.sumOfSquaresNumpy(10_000, chunkSize=7),
+                         SumOfSquaresKernels.sumOfSquaresPython(10_000))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Bounded AsyncIO Downloader Tests
+#
+# Run with python -m pytest (or python -m unittest)
+###########################################################################################
+
+import asyncio
+import time
+import unittest
+
+import URLDownloadAsyncIO
+
+URL = "http://example.invalid/page"
+
+
+# a cache whose disk has gone away - every lookup raises an OSError, not a ClientError
+class FailingCache:
+    async def fetchAsync(self, url, session, chunkSize=None):
+        raise OSError(28, "No space left on device")
+
+
+class DownloadAllSitesBoundedTest(unittest.TestCase):
+    # an unexpected exception is that url's failure - the workers keep going, so the
+    # producer never waits on a full queue with nobody left to empty it
+    def testUnexpectedErrorsAreReportedNotFatal(self):
+        sites = [f"{URL}/{index}" for index in range(50)]
+
+        async def run():
+            return await asyncio.wait_for(URLDownloadAsyncIO.downloadAllSitesBounded(
+                sites, concurrency=4, cache=FailingCache()), timeout=10)
+
+        totals = asyncio.run(run())
+        self.assertEqual(totals["errors"], len(sites))
+        self.assertEqual(totals["downloaded"], 0)
+
+
+class IterateSitesTest(unittest.TestCase):
+    # a generator whose every url takes a while to read (like a slow producer piping urls
+    # in) is read on a thread - the event loop keeps running in the meantime
+    def testSlowInputDoesNotBlockTheLoop(self):
+        def slowSites():
+            for index in range(3):
+                time.sleep(0.1)
+                yield f"{URL}/{index}"
+
+        async def run():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            ticker = asyncio.create_task(tick())
+            urls = [url async for url in URLDownloadAsyncIO.iterateSites(slowSites())]
+            ticker.cancel()
+            return urls, ticks
+
+        urls, ticks = asyncio.run(run())
+        self.assertEqual(urls, [f"{URL}/{index}" for index in range(3)])
+        self.assertGreater(ticks, 10)
+
+    # whole batches, a short last batch and an empty input all end the iteration
+    def testGeneratorsAreReadInBatches(self):
+        async def run(count):
+            sites = (f"{URL}/{index}" for index in range(count))
+            return [url async for url in URLDownloadAsyncIO.iterateSites(sites, batchSize=4)]
+
+        for count in (0, 3, 8, 10):
+            with self.subTest(count=count):
+                self.assertEqual(asyncio.run(run(count)),
+                                 [f"{URL}/{index}" for index in range(count)])
+
+    def testListsAreIteratedDirectly(self):
+        async def run():
+            return [url async for url in URLDownloadAsyncIO.iterateSites([URL, URL])]
+
+        self.assertEqual(asyncio.run(run()), [URL, URL])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,270 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Response Cache Tests
+#
+# Run with python -m pytest (or python -m unittest). The urls are served by a
+# LocalTestServer on a free port, so no network access is needed
+###########################################################################################
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import aiohttp
+import requests
+
+import LocalTestServer
+import RequestPolicy
+import URLDownloadAsyncIO
+import URLDownloadCache
+import URLDownloadStreaming
+
+
+class CacheDeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalTestServer.startServer(latency=0.2)
+        self.url = LocalTestServer.baseUrl(self.server) + "/page"
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = URLDownloadCache.ResponseCache(self.directory.name)
+
+    def tearDown(self):
+        LocalTestServer.stopServer(self.server)
+        self.directory.cleanup()
+
+    # later requests for the url coalesce onto the first, which its deadline cancels before
+    # theirs has passed - each of them has to come back as a failed result, not raise
+    def testDeadlineCancellingTheLeaderFailsEveryUrl(self):
+        policy = RequestPolicy.RequestPolicy(deadline=0.05)
+
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                def download():
+                    return asyncio.create_task(URLDownloadAsyncIO.downloadSiteStreaming(
+                        session, self.url, cache=self.cache, policy=policy))
+                leader = download()
+                await asyncio.sleep(0.02)
+                return await asyncio.gather(leader, *[download() for _ in range(5)])
+
+        results = asyncio.run(run())
+        self.assertTrue(all(result.error.startswith("TimeoutError") for result in results))
+        self.assertEqual(policy.statistics()["deadlines"], len(results))
+
+    # a waiter whose leader is cancelled sends the request itself
+    def testWaiterTakesOverFromCancelledLeader(self):
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                leader = asyncio.create_task(self.cache.fetchAsync(self.url, session))
+                await asyncio.sleep(0.01)
+                waiters = [asyncio.create_task(self.cache.fetchAsync(self.url, session))
+                           for _ in range(3)]
+                await asyncio.sleep(0.01)
+                leader.cancel()
+                return await asyncio.gather(*waiters)
+
+        results = asyncio.run(run())
+        self.assertEqual(sorted(result.source for result in results),
+                         [URLDownloadCache.COALESCED, URLDownloadCache.COALESCED,
+                          URLDownloadCache.MISS])
+        self.assertTrue(all(result.status == 200 for result in results))
+
+    # with requests too, a waiter whose leader gave up at its own deadline sends the
+    # request itself rather than failing with the leader's TimeoutError
+    def testWaiterTakesOverFromExpiredLeader(self):
+        outcomes = {}
+
+        def download(name, seconds):
+            with requests.Session() as session:
+                deadline = time.perf_counter() + seconds
+                try:
+                    outcomes[name] = self.cache.fetch(self.url, session, timeout=seconds,
+                                                      deadline=deadline).source
+                except (requests.RequestException, OSError) as error:
+                    outcomes[name] = type(error).__name__
+
+        leader = threading.Thread(target=download, args=("leader", 0.05))
+        leader.start()
+        time.sleep(0.02)
+        waiter = threading.Thread(target=download, args=("waiter", 2.0))
+        waiter.start()
+        leader.join()
+        waiter.join()
+        self.assertNotEqual(outcomes["leader"], URLDownloadCache.MISS)
+        self.assertEqual(outcomes["waiter"], URLDownloadCache.MISS)
+
+
+# store data for url as if it had just been downloaded
+def storeBody(cache, url, data, lifetime=60.0):
+    blobSink = cache.newBlobSink()
+    blobSink.write(data)
+    blobSink.close()
+    return cache.store(url, blobSink, {"ETag": '"%d"' % len(data)}, lifetime)
+
+
+class CacheStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = URLDownloadCache.ResponseCache(self.directory.name, maxBytes=2500)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def lookup(self, url):
+        entry, body = self.cache.lookup(url)
+        if body is not None:
+            body.close()
+        return entry
+
+    # looking a url up makes it the most recently used, so the other one goes first
+    def testLeastRecentlyUsedUrlIsEvicted(self):
+        storeBody(self.cache, "a", b"a" * 1000)
+        evicted = storeBody(self.cache, "b", b"b" * 1000)
+        self.assertIsNotNone(self.lookup("a"))
+        storeBody(self.cache, "c", b"c" * 1000)
+        self.assertEqual(list(self.cache.index), ["a", "c"])
+        self.assertEqual(self.cache.statistics()["evictions"], 1)
+        self.assertEqual(self.cache.totalBytes, 2000)
+        self.assertFalse(os.path.exists(self.cache.blobPath(evicted.digest)))
+
+    # urls with the same body share one blob, which stays until the last of them goes
+    def testUrlsWithTheSameBodyShareOneBlob(self):
+        shared = storeBody(self.cache, "a", b"x" * 1000)
+        storeBody(self.cache, "b", b"x" * 1000)
+        self.assertEqual(self.cache.totalBytes, 1000)
+        self.assertEqual(self.cache.references[shared.digest], 2)
+
+        storeBody(self.cache, "a", b"y" * 1000)
+        self.assertEqual(self.cache.references[shared.digest], 1)
+        self.assertEqual(self.cache.totalBytes, 2000)
+        self.assertTrue(os.path.exists(self.cache.blobPath(shared.digest)))
+
+        storeBody(self.cache, "c", b"z" * 1000)
+        self.assertNotIn("b", self.cache.index)
+        self.assertNotIn(shared.digest, self.cache.references)
+        self.assertFalse(os.path.exists(self.cache.blobPath(shared.digest)))
+
+    # a body removed behind the cache's back (by another process) is a miss, not an error
+    def testRemovedBodyIsAMiss(self):
+        entry = storeBody(self.cache, "a", b"a" * 1000)
+        os.remove(self.cache.blobPath(entry.digest))
+        self.assertIsNone(self.lookup("a"))
+        self.assertNotIn("a", self.cache.index)
+        self.assertEqual(self.cache.totalBytes, 0)
+
+    # a request that waited for another one can't be handed a body evicted since - it has
+    # to fetch the url itself instead of failing
+    def testEvictedBodyIsNotShared(self):
+        entry = storeBody(self.cache, "a", b"a" * 1000)
+        result = URLDownloadCache.CacheResult("a", 200, entry.size, URLDownloadCache.MISS, entry)
+        os.remove(self.cache.blobPath(entry.digest))
+        self.assertIsNone(self.cache.shareResult("a", result, URLDownloadStreaming.ByteCounterSink))
+        self.assertIsNotNone(self.cache.shareResult("a", result, None))
+
+    # the index is rebuilt from the metadata on disk
+    def testIndexIsReloaded(self):
+        storeBody(self.cache, "a", b"a" * 1000)
+        storeBody(self.cache, "b", b"b" * 1000)
+        reopened = URLDownloadCache.ResponseCache(self.directory.name, maxBytes=2500)
+        self.assertEqual(sorted(reopened.index), ["a", "b"])
+        self.assertEqual(reopened.totalBytes, 2000)
+
+
+class CacheFreshnessTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        LocalTestServer.stopServer(self.server)
+        self.directory.cleanup()
+
+    def startServer(self, **config):
+        self.server = LocalTestServer.startServer(latency=0.0, bodySize=1000, **config)
+        self.url = LocalTestServer.baseUrl(self.server) + "/page"
+
+    def fetchTwice(self, cache, sinkFactory=None):
+        return [cache.fetch(self.url, self.session, sinkFactory).source for _ in range(2)]
+
+    # without a max-age (and no default ttl) every repeat is revalidated with a 304
+    def testStaleResponseIsRevalidated(self):
+        self.startServer()
+        cache = URLDownloadCache.ResponseCache(self.directory.name)
+        self.assertEqual(self.fetchTwice(cache), [URLDownloadCache.MISS,
+                                                  URLDownloadCache.REVALIDATED])
+        self.assertEqual(self.server.requestCount, 2)
+        self.assertEqual(self.server.notModifiedCount, 1)
+
+    # within its max-age a response is served without sending a request
+    def testFreshResponseIsServedFromDisk(self):
+        self.startServer(maxAge=60)
+        cache = URLDownloadCache.ResponseCache(self.directory.name)
+        self.assertEqual(self.fetchTwice(cache), [URLDownloadCache.MISS, URLDownloadCache.HIT])
+        self.assertEqual(self.server.requestCount, 1)
+
+    # the default ttl applies when the server sent no Cache-Control
+    def testDefaultTtl(self):
+        self.startServer()
+        cache = URLDownloadCache.ResponseCache(self.directory.name, defaultTtl=60)
+        self.assertEqual(self.fetchTwice(cache), [URLDownloadCache.MISS, URLDownloadCache.HIT])
+
+    # a body evicted by another process after the index was loaded is downloaded again and
+    # the sink still gets all of it
+    def testRemovedBodyIsDownloadedAgain(self):
+        self.startServer(maxAge=60)
+        cache = URLDownloadCache.ResponseCache(self.directory.name)
+        entry = cache.fetch(self.url, self.session).entry
+        os.remove(cache.blobPath(entry.digest))
+        sinks = []
+
+        def sinkFactory(url):
+            sinks.append(URLDownloadStreaming.ByteCounterSink(url))
+            return sinks[-1]
+
+        self.assertEqual(cache.fetch(self.url, self.session, sinkFactory).source,
+                         URLDownloadCache.MISS)
+        self.assertEqual(sinks[0].size, 1000)
+
+    def testAsyncFreshResponseIsServedFromDisk(self):
+        self.startServer(maxAge=60)
+        cache = URLDownloadCache.ResponseCache(self.directory.name)
+
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                return [(await cache.fetchAsync(self.url, session)).source for _ in range(2)]
+
+        self.assertEqual(asyncio.run(run()), [URLDownloadCache.MISS, URLDownloadCache.HIT])
+        self.assertEqual(self.server.requestCount, 1)
+
+    # the body being downloaded is written to disk (and the caller's sink) on a thread, a
+    # batch of chunks at a time, never on the event loop's thread
+    def testAsyncBodyIsWrittenOffTheLoop(self):
+        self.startServer(maxAge=60)
+        cache = URLDownloadCache.ResponseCache(self.directory.name)
+        writers = set()
+
+        class ThreadSink(URLDownloadStreaming.ByteCounterSink):
+            def write(self, chunk):
+                writers.add(threading.get_ident())
+                super().write(chunk)
+
+        sinks = []
+
+        def sinkFactory(url):
+            sinks.append(ThreadSink(url))
+            return sinks[-1]
+
+        async def run():
+            async with aiohttp.ClientSession() as session:
+                return await cache.fetchAsync(self.url, session, sinkFactory, chunkSize=100)
+
+        result = asyncio.run(run())
+        self.assertEqual(result.source, URLDownloadCache.MISS)
+        self.assertEqual(sinks[0].size, 1000)
+        self.assertEqual(result.entry.size, 1000)
+        self.assertNotIn(threading.get_ident(), writers)
+
+
+if __name__ == "__main__":
+    unittest.main()
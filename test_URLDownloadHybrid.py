@@ -0,0 +1,135 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Hybrid (Process + AsyncIO) Download Tests
+#
+# Run with python -m pytest (or python -m unittest)
+###########################################################################################
+
+import collections
+import multiprocessing.pool
+import threading
+import time
+import unittest
+import urllib.parse
+from unittest import mock
+
+import DownloadReporter
+import LocalTestServer
+import URLDownloadHybrid
+
+
+def hostSites(host, count):
+    return [f"http://{host}/page/{index}" for index in range(count)]
+
+
+def host(url):
+    return urllib.parse.urlsplit(url).netloc
+
+
+class ShardByHostTest(unittest.TestCase):
+    def assertEveryUrlOnce(self, sites, shards):
+        self.assertEqual(collections.Counter(url for shard in shards for url in shard),
+                         collections.Counter(sites))
+
+    def testHostsStayTogether(self):
+        sites = [url for name in "abcd" for url in hostSites(f"{name}.test", 10)]
+        shards = URLDownloadHybrid.shardByHost(sites, 4)
+        self.assertEveryUrlOnce(sites, shards)
+        self.assertEqual(len(shards), 4)
+        for shard in shards:
+            self.assertEqual(len({host(url) for url in shard}), 1)
+
+    def testSmallHostsAreNotSplit(self):
+        sites = hostSites("big.test", 30) + hostSites("small.test", 5) + hostSites("tiny.test", 1)
+        shards = URLDownloadHybrid.shardByHost(sites, 3)
+        self.assertEveryUrlOnce(sites, shards)
+        for name in ("small.test", "tiny.test"):
+            self.assertEqual(sum(any(host(url) == name for url in shard) for shard in shards), 1)
+
+    def testOneHostIsSplitEvenly(self):
+        sites = hostSites("only.test", 100)
+        shards = URLDownloadHybrid.shardByHost(sites, 4)
+        self.assertEveryUrlOnce(sites, shards)
+        self.assertEqual([len(shard) for shard in shards], [25, 25, 25, 25])
+        # each shard is a run of the host's urls in their original order
+        self.assertEqual([url for shard in shards for url in shard], sites)
+
+    def testShardsAreBalanced(self):
+        counts = {"a.test": 37, "b.test": 21, "c.test": 13, "d.test": 8, "e.test": 5,
+                  "f.test": 3, "g.test": 2, "h.test": 1}
+        sites = [url for name, count in counts.items() for url in hostSites(name, count)]
+        for shardCount in (1, 2, 3, 5, 8):
+            with self.subTest(shards=shardCount):
+                shards = URLDownloadHybrid.shardByHost(sites, shardCount)
+                self.assertEveryUrlOnce(sites, shards)
+                self.assertLessEqual(len(shards), shardCount)
+                # no host is cut into pieces smaller than it needs to be
+                fairShare = -(-len(sites) // shardCount)
+                for name, count in counts.items():
+                    pieces = sum(any(host(url) == name for url in shard) for shard in shards)
+                    self.assertLessEqual(pieces, -(-count // fairShare))
+                # placing the largest pieces first keeps every shard within one piece of
+                # the smallest
+                sizes = [len(shard) for shard in shards]
+                self.assertLessEqual(max(sizes) - min(sizes), fairShare)
+
+    def testMoreShardsThanUrls(self):
+        sites = hostSites("a.test", 2) + hostSites("b.test", 1)
+        shards = URLDownloadHybrid.shardByHost(sites, 8)
+        self.assertEveryUrlOnce(sites, shards)
+        self.assertEqual(len(shards), 3)
+        self.assertTrue(all(shards))
+
+    def testNoSites(self):
+        self.assertEqual(URLDownloadHybrid.shardByHost([], 4), [])
+
+
+# the shards run on a thread pool here - it takes tasks the same way a process pool does
+class DownloadAllSitesTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = multiprocessing.pool.ThreadPool(2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.pool.join()
+
+    def testEveryBatchIsDownloaded(self):
+        server = LocalTestServer.startServer(latency=0.0, bodySize=100)
+        try:
+            sites = (f"{LocalTestServer.baseUrl(server)}/{index}" for index in range(25))
+            with DownloadReporter.Reporter(DownloadReporter.QUIET) as reporter:
+                totals = URLDownloadHybrid.downloadAllSites(sites, self.pool, 2, concurrency=4,
+                                                            reporter=reporter, batchSize=10)
+        finally:
+            LocalTestServer.stopServer(server)
+        self.assertEqual(totals["downloaded"], 25)
+        self.assertEqual(totals["bytes"], 2500)
+        self.assertEqual(reporter.summary()["downloaded"], 25)
+        self.assertEqual(sum(shard["sites"] for shard in totals["shards"]), 25)
+
+    # the next batch starts on the process that is free while the slow host's shard of
+    # the batch before is still running
+    def testNoBarrierBetweenBatches(self):
+        events = []
+        lock = threading.Lock()
+
+        def downloadShard(shard, *args):
+            slow = host(shard[0]) == "slow.test"
+            with lock:
+                events.append(("start", shard[0]))
+            time.sleep(0.5 if slow else 0.01)
+            with lock:
+                events.append(("end", shard[0]))
+            return {"downloaded": len(shard), "bytes": 0, "errors": 0, "sites": len(shard)}
+
+        sites = (hostSites("slow.test", 5) + hostSites("fast.test", 5) +
+                 hostSites("next.test", 10) + hostSites("last.test", 10))
+        with mock.patch.object(URLDownloadHybrid, "downloadShard", downloadShard):
+            totals = URLDownloadHybrid.downloadAllSites(sites, self.pool, 2, batchSize=10)
+        self.assertEqual(totals["downloaded"], len(sites))
+        slowEnd = events.index(("end", "http://slow.test/page/0"))
+        started = [url for event, url in events[:slowEnd] if event == "start"]
+        self.assertTrue(any(host(url) in ("next.test", "last.test") for url in started))
+
+
+if __name__ == "__main__":
+    unittest.main()
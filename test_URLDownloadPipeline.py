@@ -0,0 +1,61 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Pipelined Download + Process Tests
+#
+# Run with python -m pytest (or python -m unittest). The urls are served by a
+# LocalTestServer on a free port, so no network access is needed
+###########################################################################################
+
+import asyncio
+import concurrent.futures
+import unittest
+from unittest import mock
+
+import LocalTestServer
+import URLDownloadPipeline
+
+
+def failingProcessor(body):
+    raise ValueError("cannot process")
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalTestServer.startServer(latency=0.0, bodySize=1000)
+        self.sites = [f"{LocalTestServer.baseUrl(self.server)}/{index}" for index in range(20)]
+        self.executor = concurrent.futures.ThreadPoolExecutor(2)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        LocalTestServer.stopServer(self.server)
+
+    def download(self, processor=URLDownloadPipeline.digestBody):
+        return asyncio.run(asyncio.wait_for(URLDownloadPipeline.downloadAllSites(
+            self.sites, self.executor, processes=1, processor=processor, concurrency=4),
+            timeout=10))
+
+    def testEveryBodyIsProcessed(self):
+        totals = self.download()
+        self.assertEqual(totals["processed"], len(self.sites))
+        self.assertEqual(totals["bytes"], 1000 * len(self.sites))
+        self.assertEqual(totals["errors"], 0)
+
+    # an unexpected exception is that url's failure - the download workers keep going, so
+    # the producer never waits on a full queue with nobody left to empty it
+    def testUnexpectedErrorsAreReportedNotFatal(self):
+        with mock.patch.object(URLDownloadPipeline, "SharedBody",
+                               side_effect=OSError(28, "No space left on device")):
+            totals = self.download()
+        self.assertEqual(totals["errors"], len(self.sites))
+        self.assertEqual(totals["processed"], 0)
+
+    # a body that downloaded but failed to process is counted once as each
+    def testProcessingErrorsAreCountedApart(self):
+        totals = self.download(failingProcessor)
+        self.assertEqual(totals["downloaded"], len(self.sites))
+        self.assertEqual(totals["errors"], 0)
+        self.assertEqual(totals["processErrors"], len(self.sites))
+        self.assertEqual(totals["processed"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Streaming Response Body Tests
+#
+# Run with python -m pytest (or python -m unittest). The urls are served by a
+# LocalTestServer on a free port, so no network access is needed
+###########################################################################################
+
+import functools
+import hashlib
+import os
+import tempfile
+import time
+import unittest
+
+import requests
+
+import LocalTestServer
+import URLDownloadStreaming
+
+
+class ReadBodyTest(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalTestServer.startServer(latency=0.0, bodySize=200_000)
+        self.url = LocalTestServer.baseUrl(self.server) + "/page"
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        LocalTestServer.stopServer(self.server)
+
+    def get(self, stream):
+        return self.session.get(self.url, stream=stream)
+
+    def testBufferedAndStreamedSizesAgree(self):
+        with self.get(stream=False) as response:
+            self.assertEqual(URLDownloadStreaming.readBody(response, self.url), 200_000)
+        with self.get(stream=True) as response:
+            self.assertEqual(URLDownloadStreaming.readBody(response, self.url, stream=True),
+                             200_000)
+
+    # every chunk reaches the sink, in order, and the sink is closed afterwards
+    def testSinkSeesTheWholeBody(self):
+        sinks = []
+
+        def sinkFactory(url):
+            sinks.append(URLDownloadStreaming.HashSink(url))
+            return sinks[-1]
+
+        with self.get(stream=True) as response:
+            size = URLDownloadStreaming.readBody(response, self.url, stream=True,
+                                                 sinkFactory=sinkFactory)
+        self.assertEqual(size, 200_000)
+        self.assertEqual(len(sinks), 1)
+        self.assertEqual(sinks[0].url, self.url)
+        self.assertEqual(sinks[0].hexdigest(), hashlib.sha256(self.server.body).hexdigest())
+
+    def testByteCounterSinkCountsTheChunks(self):
+        sinks = []
+
+        def sinkFactory(url):
+            sinks.append(URLDownloadStreaming.ByteCounterSink(url))
+            return sinks[-1]
+
+        with self.get(stream=True) as response:
+            URLDownloadStreaming.readBody(response, self.url, stream=True,
+                                          sinkFactory=sinkFactory)
+        self.assertEqual(sinks[0].size, 200_000)
+
+    def testFileSinkFactoryWritesTheBody(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sinkFactory = functools.partial(URLDownloadStreaming.FileSink, directory=directory)
+            with self.get(stream=True) as response:
+                URLDownloadStreaming.readBody(response, self.url, stream=True,
+                                              sinkFactory=sinkFactory)
+            (name,) = os.listdir(directory)
+            with open(os.path.join(directory, name), "rb") as file:
+                self.assertEqual(file.read(), self.server.body)
+
+    # a deadline is checked between chunks - streamed or not, the body is given up on once
+    # it has passed
+    def testPassedDeadlineRaisesTimeoutError(self):
+        for stream in (False, True):
+            with self.subTest(stream=stream):
+                with self.get(stream=True) as response:
+                    with self.assertRaises(TimeoutError):
+                        URLDownloadStreaming.readBody(response, self.url, stream=stream,
+                                                      deadline=time.perf_counter() - 1)
+
+    def testDeadlineInTimeReadsTheWholeBody(self):
+        with self.get(stream=True) as response:
+            size = URLDownloadStreaming.readBody(response, self.url,
+                                                 deadline=time.perf_counter() + 30)
+        self.assertEqual(size, 200_000)
+
+
+class FileSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # two workers downloading the same url at once each write a file of their own - the
+    # file left behind is one whole body, not the two interleaved
+    def testConcurrentWritesOfOneUrlDontInterleave(self):
+        # unbuffered, so every write reaches the file as it is made
+        first = URLDownloadStreaming.FileSink("http://example.com/a", self.directory.name,
+                                              bufferSize=0)
+        second = URLDownloadStreaming.FileSink("http://example.com/a", self.directory.name,
+                                               bufferSize=0)
+        for _ in range(3):
+            first.write(b"1" * 1000)
+            second.write(b"2" * 10)
+        first.close()
+        with open(first.path, "rb") as file:
+            self.assertEqual(file.read(), b"1" * 3000)
+        second.close()
+        with open(second.path, "rb") as file:
+            self.assertEqual(file.read(), b"2" * 30)
+        self.assertEqual(os.listdir(self.directory.name), [os.path.basename(first.path)])
+
+    # space reserved for a Content-Length longer than the body is trimmed off again
+    def testPreallocatedFileIsTrimmedToTheBody(self):
+        sink = URLDownloadStreaming.FileSink("http://example.com/b", self.directory.name)
+        sink.preallocate(100_000)
+        sink.write(b"body")
+        sink.close()
+        self.assertEqual(os.path.getsize(sink.path), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+###########################################################################################
+# Bruce Rhoades - Concurrency Code Samples - Persistent (Warm) Worker Process Pool Tests
+#
+# Run with python -m pytest (or python -m unittest)
+###########################################################################################
+
+import time
+import unittest
+
+import WarmWorkerPool
+
+
+class HealthCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.workers = WarmWorkerPool.WarmWorkerPool(1, checkInterval=0.0, checkTimeout=0.2)
+        self.workers.start()
+        self.pool = self.workers.pool
+
+    def tearDown(self):
+        self.workers.terminate()
+
+    def testIdlePoolIsHealthy(self):
+        self.assertTrue(self.workers.isHealthy())
+        self.assertIs(self.workers.getPool(), self.pool)
+        self.assertEqual(self.workers.restarts, 0)
+
+    def testLongJobDoesNotRestartThePool(self):
+        # the only worker is busy for longer than checkTimeout - a ping would time out
+        job = self.pool.apply_async(time.sleep, (1.0,))
+        self.assertTrue(self.workers.isHealthy())
+        self.assertIs(self.workers.getPool(), self.pool)
+        self.assertEqual(self.workers.restarts, 0)
+        job.get(5)
+
+    def testStoppedPoolIsReplaced(self):
+        # stopped behind the WarmWorkerPool's back - its workers are gone for good
+        self.pool.terminate()
+        self.assertFalse(self.workers.isHealthy())
+        self.assertIsNot(self.workers.getPool(), self.pool)
+        self.assertEqual(self.workers.restarts, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()